@@ -1,34 +1,114 @@
+"""
+This module was written for reading the Amber topology and coordinate files
+into a Molecule. The whole system can be read, or only the residues selected
+by an Amber mask (or a list of atom IDs) and those within a distance of them,
+then the topology is only read as the raw arrays of its flags and the Atom and
+Residue objects are only built for the selected residues, which is much faster
+for a solvated system.
+"""
 from __future__ import absolute_import, print_function
-from parmed.amber import AmberParm
+from parmed import Structure
+from parmed import Atom as ParmedAtom
+from parmed.amber import AmberParm, AmberFormat
+from parmed.amber.mask import AmberMask
 from msmtmol.element import AtnumRev
 from msmtmol.rstfile import read_rstf
 from msmtmol.mol import *
+from pymsmtexp import *
+from scipy.spatial import cKDTree
 
-def read_amber_prm(pfile, cfile):
+def get_mask_struct(prmtop, crds):
+    """Get a Structure with only the atoms, residues and coordinates of the
+       topology, which is enough for the Amber masks (including the distance
+       operators) and much faster to build than an AmberParm."""
 
-    prmtop = AmberParm(pfile)
+    struct = Structure()
+    names = prmtop.parm_data['ATOM_NAME']
+    typs = prmtop.parm_data['AMBER_ATOM_TYPE']
+    chgs = prmtop.parm_data['CHARGE']
+    atnums = prmtop.parm_data['ATOMIC_NUMBER']
+    resnames = prmtop.parm_data['RESIDUE_LABEL']
+    resptrs = prmtop.parm_data['RESIDUE_POINTER'] + [len(names)+1]
+
+    for i in range(0, len(resnames)):
+        for j in range(resptrs[i]-1, resptrs[i+1]-1):
+            atom = ParmedAtom(name=names[j], type=typs[j], charge=chgs[j],
+                              atomic_number=atnums[j])
+            struct.add_atom(atom, resnames[i], i+1)
+    struct.coordinates = crds
+    return struct
+
+def get_mask_atids(prmtop, crds, mask):
+    """Get the atom IDs (starting from 1) selected by the Amber mask."""
+    if isinstance(prmtop, AmberParm):
+        struct = prmtop
+        struct.coordinates = crds
+    else:
+        struct = get_mask_struct(prmtop, crds)
+    return [i+1 for i in AmberMask(struct, mask).Selected()]
+
+def get_near_atids(crds, atids, radius):
+    """Get the IDs of the atoms within the radius of any of the atoms."""
+    tree = cKDTree(crds)
+    nearids = set(atids)
+    for i in tree.query_ball_point(crds[[j-1 for j in atids]], radius):
+        nearids.update([j+1 for j in i])
+    return sorted(nearids)
+
+def read_amber_prm(pfile, cfile, mask=None, radius=None):
+    """Read the topology and coordinate files. If the mask (an Amber mask or a
+       list of atom IDs) is given, only the residues which have the atoms
+       selected by it (or within the radius of them) are in the Molecule, and
+       the topology is an AmberFormat with the raw arrays of the flags."""
+
+    if mask is None:
+        prmtop = AmberParm(pfile)
+    else:
+        prmtop = AmberFormat(pfile)
     crds = read_rstf(cfile)
 
-    atids = list(range(1, len(prmtop.parm_data['ATOM_NAME'])+1))
-    resids = list(range(1, len(prmtop.parm_data['RESIDUE_LABEL'])+1))
+    atnum = len(prmtop.parm_data['ATOM_NAME'])
+    resnum = len(prmtop.parm_data['RESIDUE_LABEL'])
+    if atnum != len(crds):
+        raise pymsmtError('The toplogy and coordinates file are not '
+                          'consistent in the atom numbers.')
+
+    #The residues to build
+    if mask is None:
+        resids = list(range(1, resnum+1))
+    else:
+        if isinstance(mask, str):
+            selids = get_mask_atids(prmtop, crds, mask)
+        else:
+            selids = sorted(mask)
+        if not selids:
+            raise pymsmtError('No atom is selected by the mask %s .' %mask)
+        if radius is not None:
+            selids = get_near_atids(crds, selids, radius)
 
-    if len(prmtop.parm_data['ATOM_NAME']) != len(crds):
-        raise ReadError('The toplogy and coordinates file are not \
-                          consistent in the atom numbers.')
+        resptrs = prmtop.parm_data['RESIDUE_POINTER']
+        resids = set()
+        ires = 0
+        for i in selids:
+            while ires < resnum - 1 and resptrs[ires+1] <= i:
+                ires = ires + 1
+            resids.add(ires + 1)
+        resids = sorted(resids)
 
     residues = {}
     atoms = {}
-    for i in range(0, len(prmtop.parm_data['RESIDUE_LABEL'])):
+    atids = []
+    for resid in resids:
 
-        resid = i + 1
+        i = resid - 1
         resname = prmtop.parm_data['RESIDUE_LABEL'][i]
 
-        if i < len(prmtop.parm_data['RESIDUE_LABEL'])-1:
+        if i < resnum - 1:
             resconter = list(range(prmtop.parm_data['RESIDUE_POINTER'][i], \
                          prmtop.parm_data['RESIDUE_POINTER'][i+1]))
         else:
             resconter = list(range(prmtop.parm_data['RESIDUE_POINTER'][i], \
-                         len(prmtop.parm_data['ATOM_NAME'])+1))
+                         atnum+1))
 
         residues[resid] = Residue(resid, resname, resconter)
 
@@ -49,6 +129,7 @@ def read_amber_prm(pfile, cfile):
 
             atoms[j] = Atom(gtype, atid, atname, element, atomtype, crd, charge, \
                            resid, resname)
+            atids.append(j)
 
     mol = Molecule(atoms, residues)
 
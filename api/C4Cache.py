@@ -0,0 +1,143 @@
+"""
+This module was written for the cache of the objective function of OptC4.py.
+The value of each evaluated set of C4 terms is kept in memory and appended to
+a log file, so that a repeated set (e.g. in the line searches of SciPy) gets
+the value at once, and an interrupted run replays the log when it is
+restarted with the same inputs. For the warm starts, the minimized
+coordinates of the sets evaluated in the run are also kept (only the maxstart
+sets nearest to the last one), and a new set is minimized from those of the
+nearest one if its C4 terms change their forces enough (see
+C4Context.check_start). The values of the warm starts depend on the evaluations before,
+so they are not written into the log.
+
+Each line of the log is:
+  <settings key> <objective value> <C4 term 1> <C4 term 2> ...
+The settings key is the hash of the topology and coordinate files, the metal
+mask, the C4 terms optimized and the minimization settings; the lines with
+another key (from another run using the same log) are skipped.
+"""
+from __future__ import absolute_import, print_function
+from msmtmol.filehash import hash_file
+import hashlib
+import numpy
+import os
+import threading
+
+LOG_FORMAT = '1'
+
+#Maximum number of the minimized coordinates kept for the warm starts
+MAX_STARTS = 20
+
+def get_settings_key(fnames, fields):
+    """Get the hash of the input files (by their contents) and the list of
+       (name, value) of the settings which change the objective value."""
+    sha = hashlib.sha256()
+
+    def add(item):
+        sha.update((item + '\n').encode('utf-8'))
+
+    add('FORMAT ' + LOG_FORMAT)
+    for fname in fnames:
+        add('FILE %s' %hash_file(fname))
+    for name, value in fields:
+        add('FIELD %s %r' %(name, value))
+    return sha.hexdigest()[:16]
+
+class C4Cache(object):
+
+    def __init__(self, setkey, nterm, logf=None, ndigits=4, warm=False,
+                 maxstart=MAX_STARTS):
+        self.setkey = setkey
+        self.nterm = nterm
+        self.logf = logf
+        self.ndigits = ndigits
+        self.vals = {}
+        self.nhit = 0
+        self.warm = warm
+        self.maxstart = maxstart
+        self.c4s = [] #C4 terms and minimized coordinates for the warm starts
+        self.crds = []
+        self.lock = threading.Lock()
+        if warm:
+            self.logf = None
+        if (self.logf is not None) and os.path.isfile(self.logf):
+            self.replay()
+
+    def get_key(self, c4terms):
+        return tuple([round(float(i), self.ndigits) for i in c4terms])
+
+    def replay(self):
+        """Read the evaluations of the same settings in the log."""
+        fp = open(self.logf, 'r')
+        for line in fp:
+            #The last line may be cut if the run was killed
+            if line[-1:] != '\n':
+                fp.close()
+                fp = open(self.logf, 'a')
+                fp.write('\n')
+                break
+            line = line.split()
+            if len(line) != self.nterm + 2 or line[0] != self.setkey:
+                continue
+            try:
+                val = float(line[1])
+                c4terms = [float(i) for i in line[2:]]
+            except ValueError:
+                continue
+            self.vals[self.get_key(c4terms)] = val
+        fp.close()
+        print('Read %d evaluations from the log file %s' %(len(self.vals),
+              self.logf))
+
+    def get(self, c4terms):
+        """Get the objective value of the C4 terms, None if it is not
+           evaluated yet."""
+        with self.lock:
+            val = self.vals.get(self.get_key(c4terms))
+            if val is not None:
+                self.nhit = self.nhit + 1
+            return val
+
+    def get_start(self, c4terms):
+        """Get the nearest C4 terms evaluated and their minimized coordinates,
+           None if there is not any."""
+        with self.lock:
+            if not self.c4s:
+                return None
+            dists = numpy.sum((numpy.array(self.c4s) -
+                               numpy.array(c4terms, dtype=float))**2, axis=1)
+            i = int(numpy.argmin(dists))
+            return self.c4s[i], self.crds[i]
+
+    def get_crds(self, c4terms):
+        """Get the minimized coordinates of the C4 terms, None if they are
+           not kept."""
+        with self.lock:
+            key = self.get_key(c4terms)
+            for c4s, crds in zip(self.c4s, self.crds):
+                if self.get_key(c4s) == key:
+                    return crds
+            return None
+
+    def put(self, c4terms, val, crds=None):
+        """Save the objective value of the C4 terms, and the minimized
+           coordinates for the warm starts."""
+        with self.lock:
+            key = self.get_key(c4terms)
+            self.vals[key] = val
+            if self.warm and (crds is not None):
+                c4s = numpy.array(c4terms, dtype=float)
+                self.c4s.append(c4s)
+                self.crds.append(crds)
+                #Drop the coordinates of the farthest C4 terms
+                if len(self.c4s) > self.maxstart:
+                    dists = numpy.sum((numpy.array(self.c4s) - c4s)**2,
+                                      axis=1)
+                    i = int(numpy.argmax(dists))
+                    del self.c4s[i]
+                    del self.crds[i]
+            if self.logf is not None:
+                fp = open(self.logf, 'a')
+                fp.write('%s %r %s\n' %(self.setkey, float(val),
+                         ' '.join([repr(i) for i in key])))
+                fp.close()
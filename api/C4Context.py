@@ -0,0 +1,226 @@
+"""
+This module was written for the OpenMM minimizations of OptC4.py. The System,
+integrator and Context are built once from the topology with the C4 terms, and
+the C4 terms of each optimization cycle are only written into the tabulated
+ccoef function of the 12-6-4 CustomNonbondedForce of the live Context. Each
+C4Context has its own System, so that several of them can be minimized at the
+same time in threads (OpenMM releases the GIL during the minimization).
+"""
+from __future__ import absolute_import, print_function
+
+# OpenMM Imports
+import simtk.openmm as mm
+import simtk.openmm.app as app
+
+# ParmEd imports
+from parmed import unit as u
+from parmed.amber import AmberParm
+from parmed.openmm.reporters import RestartReporter
+
+from msmtmol.cal import calc_bonds, calc_angles, calc_dihs
+from pymsmtexp import *
+import numpy
+
+#Unit conversion of the C4 terms, from kcal/mol*A^4 to kJ/mol*nm^4
+C4FAC = u.kilocalories.conversion_factor_to(u.kilojoules) * \
+        u.angstroms.conversion_factor_to(u.nanometers)**4
+
+def get_c4_force(system):
+    """Get the CustomNonbondedForce and the index of its ccoef function."""
+    for force in system.getForces():
+        if not isinstance(force, mm.CustomNonbondedForce):
+            continue
+        for i in range(0, force.getNumTabulatedFunctions()):
+            if force.getTabulatedFunctionName(i) == 'ccoef':
+                return force, i
+    raise pymsmtError('There is no C4 term in the OpenMM system, please '
+                      'check whether the topology file has the '
+                      'LENNARD_JONES_CCOEF flag.')
+
+def get_geo_ids(atompairs):
+    """Index arrays (starting from 0) of the bonds, angles and dihedrals."""
+    geoids = []
+    for n in [2, 3, 4]:
+        ids = [[j-1 for j in i] for i in atompairs if len(i) == n]
+        geoids.append(numpy.array(ids, dtype=int).reshape(len(ids), n))
+    return geoids
+
+def get_geo_vals(crds, geoids):
+    """Bond lengths (angstrom), angles and dihedrals (degree) of the
+       coordinates (angstrom)."""
+    bondids, angids, dihids = geoids
+    return calc_bonds(crds, bondids), calc_angles(crds, angids), \
+           calc_dihs(crds, dihids)
+
+def get_geo_diff(vals, refvals):
+    """Sum of the unsigned errors of the bonds, angles and dihedrals, the
+       weights of them are 1/100, 1/2 and 1 respectively."""
+    bonddiffs = numpy.abs(vals[0] - refvals[0]) / 100.0
+    angdiffs = numpy.abs(vals[1] - refvals[1]) / 2.0
+    dihdiffs = numpy.abs(vals[2] - refvals[2])
+    dihdiffs = numpy.minimum(dihdiffs, 360.0 - dihdiffs)
+    return numpy.sum(bonddiffs) + numpy.sum(angdiffs) + numpy.sum(dihdiffs)
+
+#A warm start is only used if the new C4 terms change its forces by this
+#times the tolerance (or the force left in it) at least
+WARM_RATIO = 10.0
+
+class C4Context(object):
+
+    def __init__(self, pfile, cfile, mcresids2, options, nthreads=None,
+                 rfile=None):
+
+        #Use AmberParm function to transfer the topology and
+        #coordinate file to the object OpenMM can use
+        self.Ambermol = AmberParm(pfile, cfile)
+        self.positions = self.Ambermol.positions
+
+        # Create the OpenMM system
+        print('Creating OpenMM System')
+        if options.simupha == 'gas':
+            system = self.Ambermol.createSystem(nonbondedMethod=app.NoCutoff)
+        elif options.simupha == 'liquid':
+            system = self.Ambermol.createSystem(nonbondedMethod=app.PME,
+                                           nonbondedCutoff=8.0*u.angstroms,
+                                           constraints=app.HBonds,)
+        else:
+            raise pymsmtError('The simulation phase should be gas or liquid.')
+
+        #Add restraints
+        force = mm.CustomExternalForce("k*((x-x0)^2+(y-y0)^2+(z-z0)^2)")
+        force.addGlobalParameter("k", 200.0)
+        force.addPerParticleParameter("x0")
+        force.addPerParticleParameter("y0")
+        force.addPerParticleParameter("z0")
+        for i, atom_crd in enumerate(self.positions):
+            if (i+1 not in mcresids2) and \
+              (self.Ambermol.atoms[i].residue.name not in ['WAT', 'HOH']) and \
+              (self.Ambermol.atoms[i].name in ['CA', 'C', 'N']):
+                force.addParticle(i, atom_crd.value_in_unit(u.nanometers))
+        system.addForce(force)
+
+        # Create the integrator to do Langevin dynamics
+        # Temperature of heat bath, Friction coefficient, Time step
+        integrator = mm.LangevinIntegrator(300*u.kelvin, 1.0/u.picoseconds,
+                                           1.0*u.femtoseconds,)
+
+        # Define the platform to use; CUDA, OpenCL, CPU, or Reference
+        # Create the Simulation object
+        if options.platf in ['ref', 'reference']:
+            platform = mm.Platform.getPlatformByName('Reference')
+            prop = None
+        elif options.platf == 'cpu':
+            platform = mm.Platform.getPlatformByName('CPU')
+            prop = None
+            #Restrict the context to a number of threads
+            if nthreads is not None:
+                for i in ['Threads', 'CpuThreads']:
+                    if i in platform.getPropertyNames():
+                        prop = {i: str(nthreads)}
+                        break
+        elif options.platf == 'cuda':
+            platform = mm.Platform.getPlatformByName('CUDA')
+            prop = dict(CudaPrecision=options.presn)
+        elif options.platf == 'opencl':
+            platform = mm.Platform.getPlatformByName('OpenCL')
+            prop = dict(OpenCLPrecision=options.presn)
+        else:
+            raise pymsmtError('The platform should be reference, cpu, cuda '
+                              'or opencl.')
+        self.sim = app.Simulation(self.Ambermol.topology, system, integrator,
+                                  platform, prop)
+
+        #The C4 force and the ccoef table, which is indexed by i + ntypes*j
+        #for the atom type indexes i and j starting from 0
+        self.c4force, self.c4fid = get_c4_force(system)
+        self.ntypes, ntypes2, self.ccoef = \
+            self.c4force.getTabulatedFunction(self.c4fid).getFunctionParameters()
+        self.ccoef = list(self.ccoef)
+
+        #Table entries of each C4 term in the LENNARD_JONES_CCOEF flag
+        self.tabids = {}
+        nbidx = self.Ambermol.parm_data['NONBONDED_PARM_INDEX']
+        for i in range(0, self.ntypes):
+            for j in range(0, self.ntypes):
+                idx = nbidx[self.ntypes*i+j] - 1
+                if idx >= 0:
+                    self.tabids.setdefault(idx, []).append(i + self.ntypes*j)
+
+        if rfile is None:
+            rfile = options.rfile
+        self.restrt = RestartReporter(rfile, 100, write_velocities=False)
+
+    def set_c4(self, idxs, c4terms):
+        """Set the C4 terms (in kcal/mol*A^4) of the indexes in the
+           LENNARD_JONES_CCOEF flag in the live Context."""
+        for idx, c4 in zip(idxs, c4terms):
+            self.Ambermol.parm_data['LENNARD_JONES_CCOEF'][idx] = c4
+            for i in self.tabids[idx]:
+                self.ccoef[i] = c4 * C4FAC
+        self.c4force.getTabulatedFunction(self.c4fid).setFunctionParameters(
+            self.ntypes, self.ntypes, self.ccoef)
+        self.c4force.updateParametersInContext(self.sim.context)
+
+    def get_forces(self, crds):
+        """Forces (kJ/mol/nm) of the coordinates (in nm) with the current C4
+           terms."""
+        self.sim.context.setPositions(crds)
+        return self.sim.context.getState(getForces=True).getForces(
+                   asNumpy=True).value_in_unit(u.kilojoules_per_mole/
+                                               u.nanometers)
+
+    def check_start(self, idxs, c4terms, start, tol):
+        """Check a warm start (the C4 terms and the coordinates minimized
+           with them) for the C4 terms. If the new C4 terms hardly change the
+           forces of the start, the minimization stops at once and the
+           objective does not follow the C4 terms. Return the coordinates of
+           the start, or None if it should not be used. The C4 terms are set
+           in the Context."""
+
+        c4s, crds = start
+        self.set_c4(idxs, c4s)
+        frcs0 = self.get_forces(crds)
+        self.set_c4(idxs, c4terms)
+        frcs = self.get_forces(crds)
+        dfrc = numpy.sqrt(numpy.mean((frcs - frcs0)**2))
+        left = numpy.sqrt(numpy.mean(frcs0**2))
+        if dfrc < WARM_RATIO * max(tol, left):
+            print('The C4 terms change the forces by %.3g kJ/mol/nm (%.3g '
+                  'left in the warm start), minimizing from the coordinate '
+                  'file.' %(dfrc, left))
+            return None
+        return crds
+
+    def minimize(self, maxsteps, tol=None, crds=None):
+        """Minimize the structure from the initial coordinates (or the
+           coordinates given, in nm), until the RMS force is below the
+           tolerance (kJ/mol/nm) or after the maximum steps (no limit if it
+           is 0). Return the final coordinates (in nm) as an array, which are
+           not wrapped into the periodic box."""
+
+        # Set the particle positions
+        if crds is None:
+            self.sim.context.setPositions(self.positions)
+        else:
+            self.sim.context.setPositions(crds)
+
+        # Minimize the energy
+        if maxsteps == 0:
+            print('Minimizing energy to the convergence.')
+        else:
+            print('Minimizing energy ' + str(maxsteps) + ' steps.')
+        if tol is None:
+            self.sim.minimizeEnergy(maxIterations=maxsteps)
+        else:
+            self.sim.minimizeEnergy(tolerance=tol*u.kilojoules_per_mole/
+                                    u.nanometers, maxIterations=maxsteps)
+
+        crds = self.sim.context.getState(getPositions=True).getPositions(
+                   asNumpy=True).value_in_unit(u.nanometers)
+        return crds
+
+    def write_rst(self):
+        """Write the current structure into the restart file."""
+        state = self.sim.context.getState(getPositions=True,
+                                          enforcePeriodicBox=True)
+        self.restrt.report(self.sim, state)
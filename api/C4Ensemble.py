@@ -0,0 +1,155 @@
+"""
+This module was written for optimizing the C4 terms of OptC4.py against an
+ensemble of structures of the same metal site (e.g. different PDB entries or
+MD snapshots). Each structure is minimized in its own worker process, which
+keeps a C4Context of the structure for the whole run, and the objective value
+is the weighted average of the errors of the structures.
+
+The ensemble file has one line for each structure:
+  topology_file coordinate_file [weight] [restart_file]
+The default weight is 1.0 and the default restart file is the -r file with
+the number of the structure appended, the empty lines and the lines
+beginning with # are skipped.
+"""
+from __future__ import absolute_import, print_function
+from api.C4Context import C4Context, get_geo_vals, get_geo_diff
+from api.C4Cache import C4Cache
+from pymsmtexp import *
+from multiprocessing import Process, Pipe, cpu_count
+import copy
+import traceback
+
+def read_ensemble_file(ensf, rfile):
+    """Read the ensemble file, return a list of (topology file, coordinate
+       file, weight, restart file) of the structures."""
+
+    structs = []
+    fp = open(ensf, 'r')
+    for line in fp:
+        line = line.split()
+        if (not line) or line[0][0] == '#':
+            continue
+        if len(line) < 2:
+            raise pymsmtError('There should be the topology and coordinate '
+                              'files in each line of the ensemble file %s .'
+                              %ensf)
+        weight = 1.0
+        if len(line) > 2:
+            weight = float(line[2])
+        if len(line) > 3:
+            rfilei = line[3]
+        else:
+            rfilei = rfile + '.' + str(len(structs) + 1)
+        structs.append((line[0], line[1], weight, rfilei))
+    fp.close()
+
+    if not structs:
+        raise pymsmtError('There is no structure in the ensemble file %s .'
+                          %ensf)
+    return structs
+
+def c4_worker(conn, pfile, cfile, rfile, mcresids2, idxs, geoids, val_bf_min,
+              options, nthreads):
+    """Minimize one structure of the ensemble for each set of C4 terms
+       received, and send back its error."""
+
+    c4ctx = C4Context(pfile, cfile, mcresids2, options, nthreads, rfile)
+    #Only for the warm starts
+    starts = C4Cache(None, len(idxs), warm=options.warm)
+
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        task, c4terms = job
+        try:
+            c4ctx.set_c4(idxs, c4terms)
+            crds = None
+            start = starts.get_start(c4terms)
+            if options.warm and start is not None:
+                crds = c4ctx.check_start(idxs, c4terms, start, options.tol)
+            crds = c4ctx.minimize(options.maxsteps, options.tol, crds)
+            if task == 'rst':
+                c4ctx.write_rst()
+                conn.send(('done', None))
+            else:
+                diff = get_geo_diff(get_geo_vals(crds * 10.0, geoids),
+                                    val_bf_min)
+                starts.put(c4terms, diff, crds)
+                conn.send(('done', diff))
+        except Exception:
+            conn.send(('error', traceback.format_exc()))
+    conn.close()
+
+class C4Ensemble(object):
+
+    def __init__(self, sites, options):
+        """The sites are a list of (c4 topology file, coordinate file, weight,
+           restart file, mcresids2, idxs, geoids, val_bf_min) of the
+           structures, the idxs are in the same order of the C4 terms in all
+           of them."""
+
+        self.weights = [i[2] for i in sites]
+        self.conns = []
+        self.procs = []
+
+        #The CPU threads are divided among the workers
+        nthreads = max(1, cpu_count() // len(sites))
+        options = copy.copy(options)
+        for site in sites:
+            pfile, cfile, weight, rfile, mcresids2, idxs, geoids, \
+                val_bf_min = site
+            conn, wconn = Pipe()
+            proc = Process(target=c4_worker, args=(wconn, pfile, cfile,
+                           rfile, mcresids2, idxs, geoids, val_bf_min,
+                           options, nthreads))
+            proc.daemon = True
+            proc.start()
+            wconn.close()
+            self.conns.append(conn)
+            self.procs.append(proc)
+
+    def run(self, task, c4termsl):
+        """Send the sets of C4 terms to all the workers, each worker minimizes
+           them one by one while the workers run at the same time."""
+        for c4terms in c4termsl:
+            for conn in self.conns:
+                conn.send((task, list(c4terms)))
+        results = []
+        errs = []
+        for c4terms in c4termsl:
+            result = []
+            for i, conn in enumerate(self.conns):
+                try:
+                    stat, val = conn.recv()
+                except EOFError:
+                    raise pymsmtError('The worker of the structure %d is '
+                                      'terminated.' %(i+1))
+                if stat == 'error':
+                    errs.append('Structure %d:\n%s' %(i+1, val))
+                result.append(val)
+            results.append(result)
+        if errs:
+            raise pymsmtError('The minimization failed.\n' + '\n'.join(errs))
+        return results
+
+    def evaluate(self, c4termsl):
+        """Get the weighted average errors of the sets of C4 terms."""
+        fnldiffs = []
+        for diffs in self.run('eval', c4termsl):
+            fnldiff = 0.0
+            for weight, diff in zip(self.weights, diffs):
+                fnldiff = fnldiff + weight * diff
+            fnldiffs.append(fnldiff / sum(self.weights))
+        return fnldiffs
+
+    def write_rst(self, c4terms):
+        """Minimize the structures with the C4 terms and write them into
+           their restart files."""
+        self.run('rst', [c4terms])
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for proc in self.procs:
+            proc.join()
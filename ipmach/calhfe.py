@@ -2,6 +2,7 @@
 
 from __future__ import print_function
 import os
+import subprocess
 
 def get_lamadas(windows):
     if windows == 12:
@@ -48,14 +49,14 @@ def print_message(type, steps, note, window=0):
     elif type.lower() in ['tot', 'vdw', 'chg']:
         print("Perform window %d of %s TI %d steps (%s)" %(window, type.upper(), steps, note))
 
-def get_results(ti_windows, output_name, ti_sample_steps):
+def get_results(ti_windows, output_name, ti_sample_steps, workdir='.'):
     weights = get_weights(ti_windows)
     dG = 0.0
     for i in range(1, ti_windows+1):
         dvdl = os.popen("grep -A 10 -i '%s, AVERAGES OVER     500 STEPS' %s | grep -i '%s  =' "
                         "| tail -n %d | "
                         "awk 'BEGIN {sum=0} {sum+=$3} END {print sum/NR}'"
-                        %("DV\/DL", str(i)+output_name, "DV\/DL", ti_sample_steps/500)).read()
+                        %("DV\/DL", os.path.join(workdir, str(i)+output_name), "DV\/DL", ti_sample_steps/500)).read()
         dvdl = float(dvdl) * weights[i-1]
         dG += dvdl
     dG = round(dG, 2)
@@ -154,10 +155,14 @@ def print_pmemd_1step_mdf(file_name, nxt, window_steps, lamada, fwdorbwd):
 
 def OneStep_pTI(ti_windows, ti_window_steps, ti_sample_steps, exe,
                 ti_prmtop, ti_inpcrd, ti_min_steps, ti_nvt_steps,
-                ti_npt_steps, rev):
+                ti_npt_steps, rev, workdir='.'):
 
     prog = exe.split()[-1]
 
+    #The jobs are run in workdir
+    ti_prmtop = os.path.abspath(ti_prmtop)
+    ti_inpcrd = os.path.abspath(ti_inpcrd)
+
     print("****Perform TI calculation using one step method and %s program" %prog)
 
     #Get lamadas
@@ -168,53 +173,53 @@ def OneStep_pTI(ti_windows, ti_window_steps, ti_sample_steps, exe,
     # 1. Total appearing--------------------------------------------------------
     for i in range(1, ti_windows+1):
         lamada = lamadas[i-1]
-        print_pmemd_1step_mdf(str(i)+'_fwd.in', 'ti', ti_window_steps, lamada, 1)
+        print_pmemd_1step_mdf(os.path.join(workdir, str(i)+'_fwd.in'), 'ti', ti_window_steps, lamada, 1)
 
         if i == 1:
             # 1.1 Minimization
             print_message('min', ti_min_steps, 'preparation')
-            print_pmemd_1step_mdf('ti_min.in', 'min', ti_min_steps, lamada, 1)
-            os.system("%s -O -i ti_min.in -o ti_min.out -p %s -c %s -r ti_min.rst -x ti_min.netcdf" %(exe, ti_prmtop, ti_inpcrd))
+            print_pmemd_1step_mdf(os.path.join(workdir, 'ti_min.in'), 'min', ti_min_steps, lamada, 1)
+            subprocess.call("%s -O -i ti_min.in -o ti_min.out -p %s -c %s -r ti_min.rst -x ti_min.netcdf" %(exe, ti_prmtop, ti_inpcrd), shell=True, cwd=workdir)
 
             # 1.2 NVT heating
             print_message('heating', ti_nvt_steps, 'preparation')
-            print_pmemd_1step_mdf('ti_nvt.in', 'nvt', ti_nvt_steps, lamada, 1)
-            os.system("%s -O -i ti_nvt.in -o ti_nvt.out -p %s -c ti_min.rst -r ti_nvt.rst -x ti_nvt.netcdf" %(exe, ti_prmtop))
+            print_pmemd_1step_mdf(os.path.join(workdir, 'ti_nvt.in'), 'nvt', ti_nvt_steps, lamada, 1)
+            subprocess.call("%s -O -i ti_nvt.in -o ti_nvt.out -p %s -c ti_min.rst -r ti_nvt.rst -x ti_nvt.netcdf" %(exe, ti_prmtop), shell=True, cwd=workdir)
 
             # 1.3 NPT equil
             print_message('equ', ti_npt_steps, 'preparation')
-            print_pmemd_1step_mdf('ti_npt.in', 'npt', ti_npt_steps, lamada, 1)
-            os.system("%s -O -i ti_npt.in -o ti_npt.out -p %s -c ti_nvt.rst -r ti_npt.rst -x ti_npt.netcdf" %(exe, ti_prmtop))
+            print_pmemd_1step_mdf(os.path.join(workdir, 'ti_npt.in'), 'npt', ti_npt_steps, lamada, 1)
+            subprocess.call("%s -O -i ti_npt.in -o ti_npt.out -p %s -c ti_nvt.rst -r ti_npt.rst -x ti_npt.netcdf" %(exe, ti_prmtop), shell=True, cwd=workdir)
 
             # 1.4 TI
             print_message('tot', ti_window_steps, 'forward', i)
-            os.system("%s -O -i %d_fwd.in -o %d_fwd.out -p %s -c ti_npt.rst -r %d_fwd.rst -x %d_fwd.netcdf" %(exe, i, i, ti_prmtop, i, i))
+            subprocess.call("%s -O -i %d_fwd.in -o %d_fwd.out -p %s -c ti_npt.rst -r %d_fwd.rst -x %d_fwd.netcdf" %(exe, i, i, ti_prmtop, i, i), shell=True, cwd=workdir)
         else:
             print_message('tot', ti_window_steps, 'forward', i)
             j = i - 1
-            os.system("%s -O -i %d_fwd.in -o %d_fwd.out -p %s -c %d_fwd.rst -r %d_fwd.rst -x %d_fwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i))
+            subprocess.call("%s -O -i %d_fwd.in -o %d_fwd.out -p %s -c %d_fwd.rst -r %d_fwd.rst -x %d_fwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i), shell=True, cwd=workdir)
 
     #2. Total disappearing---------------------------------------------------
     if rev == 1:
         for i in range(1, ti_windows+1):
 
             lamada = lamadas[i-1]
-            print_pmemd_1step_mdf(str(i)+'_bwd.in', 'ti', ti_window_steps, lamada, -1)
+            print_pmemd_1step_mdf(os.path.join(workdir, str(i)+'_bwd.in'), 'ti', ti_window_steps, lamada, -1)
             print_message('tot', ti_window_steps, 'backward', i)
 
             if i == 1:
-                os.system("%s -O -i %d_bwd.in -o %d_bwd.out -p %s -c %d_fwd.rst -r %d_bwd.rst -x %d_bwd.netcdf" %(exe, i, i, ti_prmtop, ti_windows, i, i))
+                subprocess.call("%s -O -i %d_bwd.in -o %d_bwd.out -p %s -c %d_fwd.rst -r %d_bwd.rst -x %d_bwd.netcdf" %(exe, i, i, ti_prmtop, ti_windows, i, i), shell=True, cwd=workdir)
             else:
                 j = i - 1
-                os.system("%s -O -i %d_bwd.in -o %d_bwd.out -p %s -c %d_bwd.rst -r %d_bwd.rst -x %d_bwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i))
+                subprocess.call("%s -O -i %d_bwd.in -o %d_bwd.out -p %s -c %d_bwd.rst -r %d_bwd.rst -x %d_bwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i), shell=True, cwd=workdir)
 
     #--------------------------------------------------------------------------
     #                             Obtain the Results
     #--------------------------------------------------------------------------
 
-    dG1 = get_results(ti_windows, '_fwd.out', ti_sample_steps)
+    dG1 = get_results(ti_windows, '_fwd.out', ti_sample_steps, workdir)
     if rev == 1:
-        dG2 = get_results(ti_windows, '_bwd.out', ti_sample_steps)
+        dG2 = get_results(ti_windows, '_bwd.out', ti_sample_steps, workdir)
         dG = (dG1 - dG2)/2
         dG = round(dG, 2)
     else:
@@ -240,10 +245,17 @@ def print_sander_1step_mdf(file_name, nxt, window_steps, lamada, ifc4):
 
 def OneStep_sTI(ti_windows, ti_window_steps, ti_sample_steps, minexe, exe,
                 md_prmtop, md_inpcrd, md0_prmtop, md0_inpcrd,
-                ti_min_steps, ti_nvt_steps, ti_npt_steps, rev, ifc4):
+                ti_min_steps, ti_nvt_steps, ti_npt_steps, rev, ifc4,
+                workdir='.'):
 
     prog = exe.split()[-1]
 
+    #The jobs are run in workdir
+    md_prmtop = os.path.abspath(md_prmtop)
+    md_inpcrd = os.path.abspath(md_inpcrd)
+    md0_prmtop = os.path.abspath(md0_prmtop)
+    md0_inpcrd = os.path.abspath(md0_inpcrd)
+
     print("****Perform TI calculation using one step method and %s program" %prog)
 
     # Get lamadas
@@ -255,8 +267,8 @@ def OneStep_sTI(ti_windows, ti_window_steps, ti_sample_steps, minexe, exe,
     for i in range(1, ti_windows+1):
         lamada = lamadas[i-1]
 
-        print_sander_1step_mdf(str(i)+'_v1.in', 'ti', ti_window_steps, lamada, ifc4)
-        os.system("cp %d_v1.in %d_v2.in" %(i, i))
+        print_sander_1step_mdf(os.path.join(workdir, str(i)+'_v1.in'), 'ti', ti_window_steps, lamada, ifc4)
+        subprocess.call("cp %d_v1.in %d_v2.in" %(i, i), shell=True, cwd=workdir)
 
         if i == 1:
 
@@ -264,67 +276,67 @@ def OneStep_sTI(ti_windows, ti_window_steps, ti_sample_steps, minexe, exe,
             print_message('min', ti_min_steps, 'preparation')
  
             # Input file and group file
-            print_sander_1step_mdf('ti_min1.in', 'min', ti_min_steps, lamada, ifc4)
-            os.system("cp ti_min1.in ti_min2.in")
-            groupf = open('ti_min.group', 'w')
+            print_sander_1step_mdf(os.path.join(workdir, 'ti_min1.in'), 'min', ti_min_steps, lamada, ifc4)
+            subprocess.call("cp ti_min1.in ti_min2.in", shell=True, cwd=workdir)
+            groupf = open(os.path.join(workdir, 'ti_min.group'), 'w')
             print("-O -i ti_min1.in -o ti_min1.out -p %s -c %s -inf ti_min1.info -x ti_min1.netcdf -r ti_min1.rst" %(md0_prmtop, md0_inpcrd), file=groupf)
             print("-O -i ti_min2.in -o ti_min2.out -p %s -c %s -inf ti_min2.info -x ti_min2.netcdf -r ti_min2.rst" %(md_prmtop, md_inpcrd), file=groupf)
             groupf.close()
 
             # Run the job
-            os.system("%s -ng 2 -groupfile ti_min.group" %minexe)
+            subprocess.call("%s -ng 2 -groupfile ti_min.group" %minexe, shell=True, cwd=workdir)
 
             # 1.2 NVT heating
             print_message('heating', ti_nvt_steps, 'preparation')
 
             # Input file and group file
-            print_sander_1step_mdf('ti_nvt1.in', 'nvt', ti_nvt_steps, lamada, ifc4)
-            os.system("cp ti_nvt1.in ti_nvt2.in")
-            groupf = open('ti_nvt.group', 'w')
+            print_sander_1step_mdf(os.path.join(workdir, 'ti_nvt1.in'), 'nvt', ti_nvt_steps, lamada, ifc4)
+            subprocess.call("cp ti_nvt1.in ti_nvt2.in", shell=True, cwd=workdir)
+            groupf = open(os.path.join(workdir, 'ti_nvt.group'), 'w')
             print("-O -i ti_nvt1.in -o ti_nvt1.out -p %s -c ti_min1.rst -inf ti_nvt1.info -x ti_nvt1.netcdf -r ti_nvt1.rst" %md0_prmtop, file=groupf)
             print("-O -i ti_nvt2.in -o ti_nvt2.out -p %s -c ti_min2.rst -inf ti_nvt2.info -x ti_nvt2.netcdf -r ti_nvt2.rst" %md_prmtop, file=groupf)
             groupf.close()
 
             # Run the job
-            os.system("%s -ng 2 -groupfile ti_nvt.group" %exe)
+            subprocess.call("%s -ng 2 -groupfile ti_nvt.group" %exe, shell=True, cwd=workdir)
 
             # 1.3 NPT equil
             print_message('equ', ti_npt_steps, 'preparation')
 
             # Input file and group file
-            print_sander_1step_mdf('ti_npt1.in', 'npt', ti_npt_steps, lamada, ifc4)
-            os.system("cp ti_npt1.in ti_npt2.in")
-            groupf = open('ti_npt.group', 'w')
+            print_sander_1step_mdf(os.path.join(workdir, 'ti_npt1.in'), 'npt', ti_npt_steps, lamada, ifc4)
+            subprocess.call("cp ti_npt1.in ti_npt2.in", shell=True, cwd=workdir)
+            groupf = open(os.path.join(workdir, 'ti_npt.group'), 'w')
             print("-O -i ti_npt1.in -o ti_npt1.out -p %s -c ti_nvt1.rst -inf ti_npt1.info -x ti_npt1.netcdf -r ti_npt1.rst" %md0_prmtop, file=groupf)
             print("-O -i ti_npt2.in -o ti_npt2.out -p %s -c ti_nvt2.rst -inf ti_npt2.info -x ti_npt2.netcdf -r ti_npt2.rst" %md_prmtop, file=groupf)
             groupf.close()
 
             # Run the job
-            os.system("%s -ng 2 -groupfile ti_npt.group" %exe)
+            subprocess.call("%s -ng 2 -groupfile ti_npt.group" %exe, shell=True, cwd=workdir)
 
             # 1.4 TI
             print_message('tot', ti_window_steps, 'forward', i)
             # Group file
-            groupf = open(str(i)+'_fwd.group', 'w')
+            groupf = open(os.path.join(workdir, str(i)+'_fwd.group'), 'w')
             print("-O -i %d_v1.in -o %d_fwd1.out -p %s -c ti_npt1.rst -inf %d_fwd1.info -x %d_fwd1.netcdf -r %d_fwd1.rst" %(i, i, md0_prmtop, i, i, i), file=groupf)
             print("-O -i %d_v2.in -o %d_fwd2.out -p %s -c ti_npt2.rst -inf %d_fwd2.info -x %d_fwd2.netcdf -r %d_fwd2.rst" %(i, i, md_prmtop, i, i, i), file=groupf)
             groupf.close()
 
             # Run the job
-            os.system("%s -ng 2 -groupfile %d_fwd.group" %(exe, i))
+            subprocess.call("%s -ng 2 -groupfile %d_fwd.group" %(exe, i), shell=True, cwd=workdir)
 
         else:
             print_message('tot', ti_window_steps, 'forward', i)
             j = i - 1
 
             # Group file
-            groupf = open(str(i)+'_fwd.group', 'w')
+            groupf = open(os.path.join(workdir, str(i)+'_fwd.group'), 'w')
             print("-O -i %d_v1.in -o %d_fwd1.out -p %s -c %d_fwd1.rst -inf %d_fwd1.info -x %d_fwd1.netcdf -r %d_fwd1.rst" %(i, i, md0_prmtop, j, i, i, i), file=groupf)
             print("-O -i %d_v2.in -o %d_fwd2.out -p %s -c %d_fwd2.rst -inf %d_fwd2.info -x %d_fwd2.netcdf -r %d_fwd2.rst" %(i, i, md_prmtop, j, i, i, i), file=groupf)
             groupf.close()
 
             # Run the job
-            os.system("%s -ng 2 -groupfile %d_fwd.group" %(exe, i))
+            subprocess.call("%s -ng 2 -groupfile %d_fwd.group" %(exe, i), shell=True, cwd=workdir)
 
     #2. Total disappearing---------------------------------------------------
     if rev == 1:
@@ -333,32 +345,32 @@ def OneStep_sTI(ti_windows, ti_window_steps, ti_sample_steps, minexe, exe,
 
             if i == 1:
                 # Group file
-                groupf = open(str(i)+'_bwd.group', 'w')
+                groupf = open(os.path.join(workdir, str(i)+'_bwd.group'), 'w')
                 print("-O -i %d_v2.in -o %d_bwd2.out -p %s -c %d_fwd2.rst -inf %d_bwd2.info -x %d_bwd2.netcdf -r %d_bwd2.rst" %(i, i, md_prmtop, ti_windows, i, i, i), file=groupf)
                 print("-O -i %d_v1.in -o %d_bwd1.out -p %s -c %d_fwd1.rst -inf %d_bwd1.info -x %d_bwd1.netcdf -r %d_bwd1.rst" %(i, i, md0_prmtop, ti_windows, i, i, i), file=groupf)
                 groupf.close()
 
                 # Run the job
-                os.system("%s -ng 2 -groupfile %d_bwd.group" %(exe, i))
+                subprocess.call("%s -ng 2 -groupfile %d_bwd.group" %(exe, i), shell=True, cwd=workdir)
             else:
                 j = i - 1
                 # Group file
-                groupf = open(str(i)+'_bwd.group', 'w')
+                groupf = open(os.path.join(workdir, str(i)+'_bwd.group'), 'w')
                 print("-O -i %d_v2.in -o %d_bwd2.out -p %s -c %d_bwd2.rst -inf %d_bwd2.info -x %d_bwd2.netcdf -r %d_bwd2.rst" %(i, i, md_prmtop, j, i, i, i), file=groupf)
                 print("-O -i %d_v1.in -o %d_bwd1.out -p %s -c %d_bwd1.rst -inf %d_bwd1.info -x %d_bwd1.netcdf -r %d_bwd1.rst" %(i, i, md0_prmtop, j, i, i, i), file=groupf)
                 groupf.close()
 
                 # Run the job
-                os.system("%s -ng 2 -groupfile %d_bwd.group" %(exe, i))
+                subprocess.call("%s -ng 2 -groupfile %d_bwd.group" %(exe, i), shell=True, cwd=workdir)
 
 
     #--------------------------------------------------------------------------
     #                             Obtain the Results
     #--------------------------------------------------------------------------
 
-    dG1 = get_results(ti_windows, '_fwd1.out', ti_sample_steps)
+    dG1 = get_results(ti_windows, '_fwd1.out', ti_sample_steps, workdir)
     if rev == 1:
-        dG2 = get_results(ti_windows, '_bwd1.out', ti_sample_steps)
+        dG2 = get_results(ti_windows, '_bwd1.out', ti_sample_steps, workdir)
         dG = (dG1 - dG2)/2
         dG = round(dG, 2)
     else:
@@ -403,10 +415,15 @@ def print_pmemd_2step_mdf(file_name, nxt, window_steps, lamada, fwdorbwd, force)
 def TwoStep_pTI(ti_vdw_windows, ti_chg_windows, vdw_window_steps,
                chg_window_steps, vdw_sample_steps, chg_sample_steps,
                exe, vdw_prmtop, ti_prmtop, ti_inpcrd, ti_min_steps,
-               ti_nvt_steps, ti_npt_steps, rev):
+               ti_nvt_steps, ti_npt_steps, rev, workdir='.'):
 
     prog = exe.split()[-1]
 
+    #The jobs are run in workdir
+    vdw_prmtop = os.path.abspath(vdw_prmtop)
+    ti_prmtop = os.path.abspath(ti_prmtop)
+    ti_inpcrd = os.path.abspath(ti_inpcrd)
+
     print("****Perform TI calculation using two step method and %s program" %prog)
 
     #Get lamadas
@@ -419,98 +436,98 @@ def TwoStep_pTI(ti_vdw_windows, ti_chg_windows, vdw_window_steps,
     #1. VDW appearing-------------------------------------------------------
     for i in range(1, ti_vdw_windows+1):
         vdw_lamada = vdw_lamadas[i-1]
-        print_pmemd_2step_mdf(str(i)+'_vdw_fwd.in', 'ti', vdw_window_steps, vdw_lamada, 1, 'v')
+        print_pmemd_2step_mdf(os.path.join(workdir, str(i)+'_vdw_fwd.in'), 'ti', vdw_window_steps, vdw_lamada, 1, 'v')
 
         if i == 1:
             #1.1 Minimization
             print_message('min', ti_min_steps, 'preparation')
-            print_pmemd_2step_mdf('ti_min.in', 'min', ti_min_steps, vdw_lamada, 1, 'v')
-            os.system("%s -O -i ti_min.in -o ti_min.out -p %s -c %s -r ti_min.rst -x ti_min.netcdf" %(exe, ti_prmtop, ti_inpcrd))
+            print_pmemd_2step_mdf(os.path.join(workdir, 'ti_min.in'), 'min', ti_min_steps, vdw_lamada, 1, 'v')
+            subprocess.call("%s -O -i ti_min.in -o ti_min.out -p %s -c %s -r ti_min.rst -x ti_min.netcdf" %(exe, ti_prmtop, ti_inpcrd), shell=True, cwd=workdir)
 
             #1.2 NVT heating
             print_message('heating', ti_nvt_steps, 'preparation')
-            print_pmemd_2step_mdf('ti_nvt.in', 'nvt', ti_nvt_steps, vdw_lamada, 1, 'v')
-            os.system("%s -O -i ti_nvt.in -o ti_nvt.out -p %s -c ti_min.rst -r ti_nvt.rst -x ti_nvt.netcdf" %(exe, ti_prmtop))
+            print_pmemd_2step_mdf(os.path.join(workdir, 'ti_nvt.in'), 'nvt', ti_nvt_steps, vdw_lamada, 1, 'v')
+            subprocess.call("%s -O -i ti_nvt.in -o ti_nvt.out -p %s -c ti_min.rst -r ti_nvt.rst -x ti_nvt.netcdf" %(exe, ti_prmtop), shell=True, cwd=workdir)
 
             #1.3 NPT equil
             print_message('equ', ti_npt_steps, 'preparation')
-            print_pmemd_2step_mdf('ti_npt.in', 'npt', ti_npt_steps, vdw_lamada, 1, 'v')
-            os.system("%s -O -i ti_npt.in -o ti_npt.out -p %s -c ti_nvt.rst -r ti_npt.rst -x ti_npt.netcdf" %(exe, ti_prmtop))
+            print_pmemd_2step_mdf(os.path.join(workdir, 'ti_npt.in'), 'npt', ti_npt_steps, vdw_lamada, 1, 'v')
+            subprocess.call("%s -O -i ti_npt.in -o ti_npt.out -p %s -c ti_nvt.rst -r ti_npt.rst -x ti_npt.netcdf" %(exe, ti_prmtop), shell=True, cwd=workdir)
 
             #1.4 TI
             print_message('vdw', vdw_window_steps, 'forward', i)
-            os.system("%s -O -i %d_vdw_fwd.in -o %d_vdw_fwd.out -p %s -c ti_npt.rst -r %d_vdw_fwd.rst -x %d_vdw_fwd.netcdf" %(exe, i, i, ti_prmtop, i, i))
+            subprocess.call("%s -O -i %d_vdw_fwd.in -o %d_vdw_fwd.out -p %s -c ti_npt.rst -r %d_vdw_fwd.rst -x %d_vdw_fwd.netcdf" %(exe, i, i, ti_prmtop, i, i), shell=True, cwd=workdir)
         else:
             j = i - 1
             print_message('vdw', vdw_window_steps, 'forward', i)
-            os.system("%s -O -i %d_vdw_fwd.in -o %d_vdw_fwd.out -p %s -c %d_vdw_fwd.rst -r %d_vdw_fwd.rst -x %d_vdw_fwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i))
+            subprocess.call("%s -O -i %d_vdw_fwd.in -o %d_vdw_fwd.out -p %s -c %d_vdw_fwd.rst -r %d_vdw_fwd.rst -x %d_vdw_fwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i), shell=True, cwd=workdir)
 
     #VDW TI
     k = ti_vdw_windows+1
     print_message('vdw', vdw_window_steps, 'forward and equ', k)
-    print_pmemd_2step_mdf(str(k)+'_vdw_fwd.in', 'ti', vdw_window_steps, 0.98000, 1, 'v')
-    os.system("%s -O -i %d_vdw_fwd.in -o %d_vdw_fwd.out -p %s -c %d_vdw_fwd.rst -r %d_vdw_fwd.rst -x %d_vdw_fwd.netcdf" %(exe,
-               k, k, ti_prmtop, ti_vdw_windows, k, k))
+    print_pmemd_2step_mdf(os.path.join(workdir, str(k)+'_vdw_fwd.in'), 'ti', vdw_window_steps, 0.98000, 1, 'v')
+    subprocess.call("%s -O -i %d_vdw_fwd.in -o %d_vdw_fwd.out -p %s -c %d_vdw_fwd.rst -r %d_vdw_fwd.rst -x %d_vdw_fwd.netcdf" %(exe,
+               k, k, ti_prmtop, ti_vdw_windows, k, k), shell=True, cwd=workdir)
 
     #transfer the rst file
     print("Transfer the RST file...")
-    os.system("awk 'NR<=2' %d_vdw_fwd.rst > %d_vdw_fwd_merge.rst" %(k, k))
-    os.system("awk 'NR==3' %d_vdw_fwd.rst | awk '{printf( \"%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f\\n\", $1, $2, $3, $1, $2, $3)}' >> %d_vdw_fwd_merge.rst" %(k, k))
-    os.system("awk 'NR>3' %d_vdw_fwd.rst >> %d_vdw_fwd_merge.rst" %(k, k))
+    subprocess.call("awk 'NR<=2' %d_vdw_fwd.rst > %d_vdw_fwd_merge.rst" %(k, k), shell=True, cwd=workdir)
+    subprocess.call("awk 'NR==3' %d_vdw_fwd.rst | awk '{printf( \"%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f\\n\", $1, $2, $3, $1, $2, $3)}' >> %d_vdw_fwd_merge.rst" %(k, k), shell=True, cwd=workdir)
+    subprocess.call("awk 'NR>3' %d_vdw_fwd.rst >> %d_vdw_fwd_merge.rst" %(k, k), shell=True, cwd=workdir)
 
     #2. Charge appearing-------------------------------------------------------
     for i in range(1, ti_chg_windows+1):
         chg_lamada = chg_lamadas[i-1]
-        print_pmemd_2step_mdf(str(i)+'_chg_fwd.in', 'ti', chg_window_steps, chg_lamada, 1, 'c')
+        print_pmemd_2step_mdf(os.path.join(workdir, str(i)+'_chg_fwd.in'), 'ti', chg_window_steps, chg_lamada, 1, 'c')
         print_message('chg', chg_window_steps, 'forward', i)
 
         if i == 1:
-            os.system("%s -O -i %d_chg_fwd.in -o %d_chg_fwd.out -p %s -c %d_vdw_fwd_merge.rst -r %d_chg_fwd.rst -x %d_chg_fwd.netcdf" %(exe, i, i, vdw_prmtop, k, i, i))
+            subprocess.call("%s -O -i %d_chg_fwd.in -o %d_chg_fwd.out -p %s -c %d_vdw_fwd_merge.rst -r %d_chg_fwd.rst -x %d_chg_fwd.netcdf" %(exe, i, i, vdw_prmtop, k, i, i), shell=True, cwd=workdir)
         else:
             j = i - 1
-            os.system("%s -O -i %d_chg_fwd.in -o %d_chg_fwd.out -p %s -c %d_chg_fwd.rst -r %d_chg_fwd.rst -x %d_chg_fwd.netcdf" %(exe, i, i, vdw_prmtop, j, i, i))
+            subprocess.call("%s -O -i %d_chg_fwd.in -o %d_chg_fwd.out -p %s -c %d_chg_fwd.rst -r %d_chg_fwd.rst -x %d_chg_fwd.netcdf" %(exe, i, i, vdw_prmtop, j, i, i), shell=True, cwd=workdir)
 
     if rev == 1:
         #3. Charge disappearing----------------------------------------------------
         for i in range(1, ti_chg_windows+1):
             chg_lamada = chg_lamadas[i-1]
-            print_pmemd_2step_mdf(str(i)+'_chg_bwd.in', 'ti', chg_window_steps, chg_lamada, -1 , 'c')
+            print_pmemd_2step_mdf(os.path.join(workdir, str(i)+'_chg_bwd.in'), 'ti', chg_window_steps, chg_lamada, -1 , 'c')
             print_message('chg', chg_window_steps, 'backward', i)
 
             if i == 1:
-                os.system("%s -O -i %d_chg_bwd.in -o %d_chg_bwd.out -p %s -c %d_chg_fwd.rst -r %d_chg_bwd.rst -x %d_chg_bwd.netcdf" %(exe, i, i, vdw_prmtop, ti_chg_windows, i, i))
+                subprocess.call("%s -O -i %d_chg_bwd.in -o %d_chg_bwd.out -p %s -c %d_chg_fwd.rst -r %d_chg_bwd.rst -x %d_chg_bwd.netcdf" %(exe, i, i, vdw_prmtop, ti_chg_windows, i, i), shell=True, cwd=workdir)
             else:
                 j = i - 1
-                os.system("%s -O -i %d_chg_bwd.in -o %d_chg_bwd.out -p %s -c %d_chg_bwd.rst -r %d_chg_bwd.rst -x %d_chg_bwd.netcdf" %(exe, i, i, vdw_prmtop, j, i, i))
+                subprocess.call("%s -O -i %d_chg_bwd.in -o %d_chg_bwd.out -p %s -c %d_chg_bwd.rst -r %d_chg_bwd.rst -x %d_chg_bwd.netcdf" %(exe, i, i, vdw_prmtop, j, i, i), shell=True, cwd=workdir)
 
         #transfer the rst file
         print("Transfer the RST file...")
-        os.system("awk 'NR<=2' %d_chg_bwd.rst > %d_chg_bwd_merge.rst" %(ti_chg_windows, ti_chg_windows))
-        os.system("awk 'NR==3' %d_chg_bwd.rst | awk '{printf( \"%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f\\n\", $1, $2, $3, $1, $2, $3)}' >> %d_chg_bwd_merge.rst" %(ti_chg_windows, ti_chg_windows))
-        os.system("awk 'NR>3' %d_chg_bwd.rst >> %d_chg_bwd_merge.rst" %(ti_chg_windows, ti_chg_windows))
+        subprocess.call("awk 'NR<=2' %d_chg_bwd.rst > %d_chg_bwd_merge.rst" %(ti_chg_windows, ti_chg_windows), shell=True, cwd=workdir)
+        subprocess.call("awk 'NR==3' %d_chg_bwd.rst | awk '{printf( \"%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f%%12.7f\\n\", $1, $2, $3, $1, $2, $3)}' >> %d_chg_bwd_merge.rst" %(ti_chg_windows, ti_chg_windows), shell=True, cwd=workdir)
+        subprocess.call("awk 'NR>3' %d_chg_bwd.rst >> %d_chg_bwd_merge.rst" %(ti_chg_windows, ti_chg_windows), shell=True, cwd=workdir)
 
         #4. VDW disappearing----------------------------------------------------
         for i in range(1, ti_vdw_windows+1):
             vdw_lamada = vdw_lamadas[i-1]
-            print_pmemd_2step_mdf(str(i)+'_vdw_bwd.in', 'ti', vdw_window_steps, vdw_lamada, -1, 'v')
+            print_pmemd_2step_mdf(os.path.join(workdir, str(i)+'_vdw_bwd.in'), 'ti', vdw_window_steps, vdw_lamada, -1, 'v')
             print_message('vdw', vdw_window_steps, 'backward', i)
 
             if i == 1:
-                os.system("%s -O -i %d_vdw_bwd.in -o %d_vdw_bwd.out -p %s -c %d_chg_bwd_merge.rst -r %d_vdw_bwd.rst -x %d_vdw_bwd.netcdf" %(exe, i, i, ti_prmtop, ti_chg_windows, i, i))
+                subprocess.call("%s -O -i %d_vdw_bwd.in -o %d_vdw_bwd.out -p %s -c %d_chg_bwd_merge.rst -r %d_vdw_bwd.rst -x %d_vdw_bwd.netcdf" %(exe, i, i, ti_prmtop, ti_chg_windows, i, i), shell=True, cwd=workdir)
             else:
                 j = i - 1
-                os.system("%s -O -i %d_vdw_bwd.in -o %d_vdw_bwd.out -p %s -c %d_vdw_bwd.rst -r %d_vdw_bwd.rst -x %d_vdw_bwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i))
+                subprocess.call("%s -O -i %d_vdw_bwd.in -o %d_vdw_bwd.out -p %s -c %d_vdw_bwd.rst -r %d_vdw_bwd.rst -x %d_vdw_bwd.netcdf" %(exe, i, i, ti_prmtop, j, i, i), shell=True, cwd=workdir)
 
     #--------------------------------------------------------------------------
     #                             Obtain the Results
     #--------------------------------------------------------------------------
 
-    dG1 = get_results(ti_vdw_windows, '_vdw_fwd.out', vdw_sample_steps)
-    dG2 = get_results(ti_chg_windows, '_chg_fwd.out', chg_sample_steps)
+    dG1 = get_results(ti_vdw_windows, '_vdw_fwd.out', vdw_sample_steps, workdir)
+    dG2 = get_results(ti_chg_windows, '_chg_fwd.out', chg_sample_steps, workdir)
 
     if rev == 1:
-        dG3 = get_results(ti_chg_windows, '_chg_bwd.out', chg_sample_steps)
-        dG4 = get_results(ti_vdw_windows, '_vdw_bwd.out', vdw_sample_steps)
+        dG3 = get_results(ti_chg_windows, '_chg_bwd.out', chg_sample_steps, workdir)
+        dG4 = get_results(ti_vdw_windows, '_vdw_bwd.out', vdw_sample_steps, workdir)
         dG = (dG1 + dG2 - dG3 - dG4)/2
         dG = round(dG, 2)
     else:
@@ -540,10 +557,18 @@ def print_sander_2step_mdf(file_name, nxt, window_steps, lamada, force, ifc4):
 def TwoStep_sTI(ti_vdw_windows, ti_chg_windows, vdw_window_steps,
             chg_window_steps, vdw_sample_steps, chg_sample_steps,
             minexe, exe, md0_prmtop, md0_inpcrd, mdv_prmtop, mdv_inpcrd,
-            md_prmtop, ti_min_steps, ti_nvt_steps, ti_npt_steps, rev, ifc4):
+            md_prmtop, ti_min_steps, ti_nvt_steps, ti_npt_steps, rev, ifc4,
+            workdir='.'):
 
     prog = exe.split()[-1]
 
+    #The jobs are run in workdir
+    md0_prmtop = os.path.abspath(md0_prmtop)
+    md0_inpcrd = os.path.abspath(md0_inpcrd)
+    mdv_prmtop = os.path.abspath(mdv_prmtop)
+    mdv_inpcrd = os.path.abspath(mdv_inpcrd)
+    md_prmtop = os.path.abspath(md_prmtop)
+
     print("****Perform TI calculation using two step method and %s program" %prog)
 
     #Get lamadas
@@ -556,100 +581,100 @@ def TwoStep_sTI(ti_vdw_windows, ti_chg_windows, vdw_window_steps,
     #1. VDW appearing-------------------------------------------------------
     for i in range(1, ti_vdw_windows+1):
         vdw_lamada = vdw_lamadas[i-1]
-        print_sander_2step_mdf(str(i)+'_vdw1.in', 'ti', vdw_window_steps, vdw_lamada, 'v', 0)
-        os.system("cp %d_vdw1.in %d_vdw2.in" %(i, i))
+        print_sander_2step_mdf(os.path.join(workdir, str(i)+'_vdw1.in'), 'ti', vdw_window_steps, vdw_lamada, 'v', 0)
+        subprocess.call("cp %d_vdw1.in %d_vdw2.in" %(i, i), shell=True, cwd=workdir)
 
         if i == 1:
             #1.1 Minimization
             print_message('min', ti_min_steps, 'preparation')
-            print_sander_2step_mdf('ti_min1.in', 'min', ti_min_steps, vdw_lamada, 'v', 0)
-            os.system("cp ti_min1.in ti_min2.in")
+            print_sander_2step_mdf(os.path.join(workdir, 'ti_min1.in'), 'min', ti_min_steps, vdw_lamada, 'v', 0)
+            subprocess.call("cp ti_min1.in ti_min2.in", shell=True, cwd=workdir)
 
             #Group file
-            groupf = open('ti_min.group', 'w')
+            groupf = open(os.path.join(workdir, 'ti_min.group'), 'w')
             print("-O -i ti_min1.in -o ti_min1.out -p %s -c %s -inf ti_min1.info -x ti_min1.netcdf -r ti_min1.rst" %(md0_prmtop, md0_inpcrd), file=groupf)
             print("-O -i ti_min2.in -o ti_min2.out -p %s -c %s -inf ti_min2.info -x ti_min2.netcdf -r ti_min2.rst" %(mdv_prmtop, mdv_inpcrd), file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile ti_min.group" %minexe)
+            subprocess.call("%s -ng 2 -groupfile ti_min.group" %minexe, shell=True, cwd=workdir)
 
             #1.2 NVT heating
             print_message('heating', ti_nvt_steps, 'preparation')
-            print_sander_2step_mdf('ti_nvt1.in', 'nvt', ti_nvt_steps, vdw_lamada, 'v', 0)
-            os.system("cp ti_nvt1.in ti_nvt2.in")
+            print_sander_2step_mdf(os.path.join(workdir, 'ti_nvt1.in'), 'nvt', ti_nvt_steps, vdw_lamada, 'v', 0)
+            subprocess.call("cp ti_nvt1.in ti_nvt2.in", shell=True, cwd=workdir)
 
             #Group file
-            groupf = open('ti_nvt.group', 'w')
+            groupf = open(os.path.join(workdir, 'ti_nvt.group'), 'w')
             print("-O -i ti_nvt1.in -o ti_nvt1.out -p %s -c ti_min1.rst -inf ti_nvt1.info -x ti_nvt1.netcdf -r ti_nvt1.rst" %md0_prmtop, file=groupf)
             print("-O -i ti_nvt2.in -o ti_nvt2.out -p %s -c ti_min2.rst -inf ti_nvt2.info -x ti_nvt2.netcdf -r ti_nvt2.rst" %mdv_prmtop, file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile ti_nvt.group" %exe)
+            subprocess.call("%s -ng 2 -groupfile ti_nvt.group" %exe, shell=True, cwd=workdir)
 
             #1.3 NPT equil
             print_message('equ', ti_npt_steps, 'preparation')
-            print_sander_2step_mdf('ti_npt1.in', 'npt', ti_npt_steps, vdw_lamada, 'v', 0)
-            os.system("cp ti_npt1.in ti_npt2.in")
+            print_sander_2step_mdf(os.path.join(workdir, 'ti_npt1.in'), 'npt', ti_npt_steps, vdw_lamada, 'v', 0)
+            subprocess.call("cp ti_npt1.in ti_npt2.in", shell=True, cwd=workdir)
 
             #Group file
-            groupf = open('ti_npt.group', 'w')
+            groupf = open(os.path.join(workdir, 'ti_npt.group'), 'w')
             print("-O -i ti_npt1.in -o ti_npt1.out -p %s -c ti_nvt1.rst -inf ti_npt1.info -x ti_npt1.netcdf -r ti_npt1.rst" %md0_prmtop, file=groupf)
             print("-O -i ti_npt2.in -o ti_npt2.out -p %s -c ti_nvt2.rst -inf ti_npt2.info -x ti_npt2.netcdf -r ti_npt2.rst" %mdv_prmtop, file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile ti_npt.group" %exe)
+            subprocess.call("%s -ng 2 -groupfile ti_npt.group" %exe, shell=True, cwd=workdir)
 
             #1.4 TI
             print_message('vdw', vdw_window_steps, 'forward', i)
             #Group file
-            groupf = open(str(i)+'_vdw_fwd.group', 'w')
+            groupf = open(os.path.join(workdir, str(i)+'_vdw_fwd.group'), 'w')
             print("-O -i %d_vdw1.in -o %d_vdw_fwd1.out -p %s -c ti_npt1.rst -inf %d_vdw_fwd1.info -x %d_vdw_fwd1.netcdf -r %d_vdw_fwd1.rst" %(i, i, md0_prmtop, i, i, i), file=groupf)
             print("-O -i %d_vdw2.in -o %d_vdw_fwd2.out -p %s -c ti_npt2.rst -inf %d_vdw_fwd2.info -x %d_vdw_fwd2.netcdf -r %d_vdw_fwd2.rst" %(i, i, mdv_prmtop, i, i, i), file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile %d_vdw_fwd.group" %(exe, i))
+            subprocess.call("%s -ng 2 -groupfile %d_vdw_fwd.group" %(exe, i), shell=True, cwd=workdir)
         else:
             j = i - 1
             print_message('vdw', vdw_window_steps, 'forward', i)
             #Group file
-            groupf = open(str(i)+'_vdw_fwd.group', 'w')
+            groupf = open(os.path.join(workdir, str(i)+'_vdw_fwd.group'), 'w')
             print("-O -i %d_vdw1.in -o %d_vdw_fwd1.out -p %s -c %d_vdw_fwd1.rst -inf %d_vdw_fwd1.info -x %d_vdw_fwd1.netcdf -r %d_vdw_fwd1.rst" %(i, i, md0_prmtop, j, i, i, i), file=groupf)
             print("-O -i %d_vdw2.in -o %d_vdw_fwd2.out -p %s -c %d_vdw_fwd2.rst -inf %d_vdw_fwd2.info -x %d_vdw_fwd2.netcdf -r %d_vdw_fwd2.rst" %(i, i, mdv_prmtop, j, i, i, i), file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile %d_vdw_fwd.group" %(exe, i))
+            subprocess.call("%s -ng 2 -groupfile %d_vdw_fwd.group" %(exe, i), shell=True, cwd=workdir)
 
     #One more step to equ the structure
     k = ti_vdw_windows + 1
     print_message('vdw', vdw_window_steps, 'forward and equ', k)
-    print_sander_2step_mdf(str(k)+'_vdw1.in', 'ti', vdw_window_steps, 0.98000, 'v', 0)
-    os.system("cp %d_vdw1.in %d_vdw2.in" %(k, k))
+    print_sander_2step_mdf(os.path.join(workdir, str(k)+'_vdw1.in'), 'ti', vdw_window_steps, 0.98000, 'v', 0)
+    subprocess.call("cp %d_vdw1.in %d_vdw2.in" %(k, k), shell=True, cwd=workdir)
 
     #Group file
     j = k - 1
-    groupf = open(str(k)+'_vdw_fwd.group', 'w')
+    groupf = open(os.path.join(workdir, str(k)+'_vdw_fwd.group'), 'w')
     print("-O -i %d_vdw1.in -o %d_vdw_fwd1.out -p %s -c %d_vdw_fwd1.rst -inf %d_vdw_fwd1.info -x %d_vdw_fwd1.netcdf -r %d_vdw_fwd1.rst" %(k, k, md0_prmtop, j, k, k, k), file=groupf)
     print("-O -i %d_vdw2.in -o %d_vdw_fwd2.out -p %s -c %d_vdw_fwd2.rst -inf %d_vdw_fwd2.info -x %d_vdw_fwd2.netcdf -r %d_vdw_fwd2.rst" %(k, k, mdv_prmtop, j, k, k, k), file=groupf)
     groupf.close()
-    os.system("%s -ng 2 -groupfile %d_vdw_fwd.group" %(exe, k))
+    subprocess.call("%s -ng 2 -groupfile %d_vdw_fwd.group" %(exe, k), shell=True, cwd=workdir)
 
     #2. Charge appearing-------------------------------------------------------
     for i in range(1, ti_chg_windows+1):
         chg_lamada = chg_lamadas[i-1]
-        print_sander_2step_mdf(str(i)+'_chg1.in', 'ti', chg_window_steps, chg_lamada, 'c', ifc4)
-        os.system("cp %d_chg1.in %d_chg2.in" %(i, i))
+        print_sander_2step_mdf(os.path.join(workdir, str(i)+'_chg1.in'), 'ti', chg_window_steps, chg_lamada, 'c', ifc4)
+        subprocess.call("cp %d_chg1.in %d_chg2.in" %(i, i), shell=True, cwd=workdir)
         print_message('chg', chg_window_steps, 'forward', i)
 
         if i == 1:
             #Group file
-            groupf = open(str(i)+'_chg_fwd.group', 'w')
+            groupf = open(os.path.join(workdir, str(i)+'_chg_fwd.group'), 'w')
             print("-O -i %d_chg1.in -o %d_chg_fwd1.out -p %s -c %d_vdw_fwd1.rst -inf %d_chg_fwd1.info -x %d_chg_fwd1.netcdf -r %d_chg_fwd1.rst" %(i, i, mdv_prmtop, k, i, i, i), file=groupf)
             print("-O -i %d_chg2.in -o %d_chg_fwd2.out -p %s -c %d_vdw_fwd2.rst -inf %d_chg_fwd2.info -x %d_chg_fwd2.netcdf -r %d_chg_fwd2.rst" %(i, i, md_prmtop, k, i, i, i), file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile %d_chg_fwd.group" %(exe, i))
+            subprocess.call("%s -ng 2 -groupfile %d_chg_fwd.group" %(exe, i), shell=True, cwd=workdir)
         else:
             j = i - 1
             #Group file
-            groupf = open(str(i)+'_chg_fwd.group', 'w')
+            groupf = open(os.path.join(workdir, str(i)+'_chg_fwd.group'), 'w')
             print("-O -i %d_chg1.in -o %d_chg_fwd1.out -p %s -c %d_chg_fwd1.rst -inf %d_chg_fwd1.info -x %d_chg_fwd1.netcdf -r %d_chg_fwd1.rst" %(i, i, mdv_prmtop, j, i, i, i), file=groupf)
             print("-O -i %d_chg2.in -o %d_chg_fwd2.out -p %s -c %d_chg_fwd2.rst -inf %d_chg_fwd2.info -x %d_chg_fwd2.netcdf -r %d_chg_fwd2.rst" %(i, i, md_prmtop, j, i, i, i), file=groupf)
             groupf.close()
-            os.system("%s -ng 2 -groupfile %d_chg_fwd.group" %(exe, i))
+            subprocess.call("%s -ng 2 -groupfile %d_chg_fwd.group" %(exe, i), shell=True, cwd=workdir)
 
     if rev == 1:
         #3. Charge disappearing----------------------------------------------------
@@ -657,49 +682,49 @@ def TwoStep_sTI(ti_vdw_windows, ti_chg_windows, vdw_window_steps,
             print_message('chg', chg_window_steps, 'backward', i)
             if i == 1:
                 #Group file
-                groupf = open(str(i)+'_chg_bwd.group', 'w')
+                groupf = open(os.path.join(workdir, str(i)+'_chg_bwd.group'), 'w')
                 print("-O -i %d_chg2.in -o %d_chg_bwd2.out -p %s -c %d_chg_fwd2.rst -inf %d_chg_bwd2.info -x %d_chg_bwd2.netcdf -r %d_chg_bwd2.rst" %(i, i, md_prmtop, ti_chg_windows, i, i, i), file=groupf)
                 print("-O -i %d_chg1.in -o %d_chg_bwd1.out -p %s -c %d_chg_fwd1.rst -inf %d_chg_bwd1.info -x %d_chg_bwd1.netcdf -r %d_chg_bwd1.rst" %(i, i, mdv_prmtop, ti_chg_windows, i, i, i), file=groupf)
                 groupf.close()
-                os.system("%s -ng 2 -groupfile %d_chg_bwd.group" %(exe, i))
+                subprocess.call("%s -ng 2 -groupfile %d_chg_bwd.group" %(exe, i), shell=True, cwd=workdir)
             else:
                 j = i - 1
                 #Group file
-                groupf = open(str(i)+'_chg_bwd.group', 'w')
+                groupf = open(os.path.join(workdir, str(i)+'_chg_bwd.group'), 'w')
                 print("-O -i %d_chg2.in -o %d_chg_bwd2.out -p %s -c %d_chg_bwd2.rst -inf %d_chg_bwd2.info -x %d_chg_bwd2.netcdf -r %d_chg_bwd2.rst" %(i, i, md_prmtop, j, i, i, i), file=groupf)
                 print("-O -i %d_chg1.in -o %d_chg_bwd1.out -p %s -c %d_chg_bwd1.rst -inf %d_chg_bwd1.info -x %d_chg_bwd1.netcdf -r %d_chg_bwd1.rst" %(i, i, mdv_prmtop, j, i, i, i), file=groupf)
                 groupf.close()
-                os.system("%s -ng 2 -groupfile %d_chg_bwd.group" %(exe, i))
+                subprocess.call("%s -ng 2 -groupfile %d_chg_bwd.group" %(exe, i), shell=True, cwd=workdir)
 
         #4. VDW disappearing----------------------------------------------------
         for i in range(1, ti_vdw_windows+1):
             print_message('vdw', vdw_window_steps, 'backward', i)
             if i == 1:
                 #Group file
-                groupf = open(str(i)+'_vdw_bwd.group', 'w')
+                groupf = open(os.path.join(workdir, str(i)+'_vdw_bwd.group'), 'w')
                 print("-O -i %d_vdw2.in -o %d_vdw_bwd2.out -p %s -c %d_chg_bwd2.rst -inf %d_vdw_bwd2.info -x %d_vdw_bwd2.netcdf -r %d_vdw_bwd2.rst" %(i, i, mdv_prmtop, ti_chg_windows, i, i, i), file=groupf)
                 print("-O -i %d_vdw1.in -o %d_vdw_bwd1.out -p %s -c %d_chg_bwd1.rst -inf %d_vdw_bwd1.info -x %d_vdw_bwd1.netcdf -r %d_vdw_bwd1.rst" %(i, i, md0_prmtop, ti_chg_windows, i, i, i), file=groupf)
                 groupf.close()
-                os.system("%s -ng 2 -groupfile %d_vdw_bwd.group" %(exe, i))
+                subprocess.call("%s -ng 2 -groupfile %d_vdw_bwd.group" %(exe, i), shell=True, cwd=workdir)
             else:
                 j = i - 1
                 #Group file
-                groupf = open(str(i)+'_vdw_bwd.group', 'w')
+                groupf = open(os.path.join(workdir, str(i)+'_vdw_bwd.group'), 'w')
                 print("-O -i %d_vdw2.in -o %d_vdw_bwd2.out -p %s -c %d_vdw_bwd2.rst -inf %d_vdw_bwd2.info -x %d_vdw_bwd2.netcdf -r %d_vdw_bwd2.rst" %(i, i, mdv_prmtop, j, i, i, i), file=groupf)
                 print("-O -i %d_vdw1.in -o %d_vdw_bwd1.out -p %s -c %d_vdw_bwd1.rst -inf %d_vdw_bwd1.info -x %d_vdw_bwd1.netcdf -r %d_vdw_bwd1.rst" %(i, i, md0_prmtop, j, i, i, i), file=groupf)
                 groupf.close()
-                os.system("%s -ng 2 -groupfile %d_vdw_bwd.group" %(exe, i))
+                subprocess.call("%s -ng 2 -groupfile %d_vdw_bwd.group" %(exe, i), shell=True, cwd=workdir)
 
     #--------------------------------------------------------------------------
     #                             Obtain the Results
     #--------------------------------------------------------------------------
 
-    dG1 = get_results(ti_vdw_windows, '_vdw_fwd1.out', vdw_sample_steps)
-    dG2 = get_results(ti_chg_windows, '_chg_fwd1.out', chg_sample_steps)
+    dG1 = get_results(ti_vdw_windows, '_vdw_fwd1.out', vdw_sample_steps, workdir)
+    dG2 = get_results(ti_chg_windows, '_chg_fwd1.out', chg_sample_steps, workdir)
 
     if rev == 1:
-        dG3 = get_results(ti_chg_windows, '_chg_bwd1.out', chg_sample_steps)
-        dG4 = get_results(ti_vdw_windows, '_vdw_bwd1.out', vdw_sample_steps)
+        dG3 = get_results(ti_chg_windows, '_chg_bwd1.out', chg_sample_steps, workdir)
+        dG4 = get_results(ti_vdw_windows, '_vdw_bwd1.out', vdw_sample_steps, workdir)
         dG = (dG1 + dG2 - dG3 - dG4)/2
         dG = round(dG, 2)
     else:
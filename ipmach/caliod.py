@@ -4,6 +4,7 @@
 from __future__ import print_function
 import numpy
 import os
+import subprocess
 
 def cal_iod(rs, grs, maxind):
     rlbind = maxind - 10
@@ -83,42 +84,47 @@ def print_md_inputf(file_name, nxt, window_steps, ifc4):
     print("/", file=md_mdf)
     md_mdf.close()
 
-def MD_simulation(exe, md_prmtop, md_inpcrd, md_min_steps, md_nvt_steps, md_npt_steps, md_md_steps, ifc4):
+def MD_simulation(exe, md_prmtop, md_inpcrd, md_min_steps, md_nvt_steps, md_npt_steps, md_md_steps, ifc4,
+                  workdir='.'):
 
     prog = exe.split()[-1]
 
+    #The jobs are run in workdir
+    md_prmtop = os.path.abspath(md_prmtop)
+    md_inpcrd = os.path.abspath(md_inpcrd)
+
     #Normal MD simulation-IOD, CN
     print("****Perform MD simulation using %s program..." %prog)
 
     #MIN
     print("Perform md_min %d steps..." %md_min_steps)
-    print_md_inputf('md_min.in', 'min', md_min_steps, ifc4)
-    os.system("%s -O -i md_min.in -o md_min.out -p %s -c %s -r md_min.rst -x md_min.netcdf" %(exe, md_prmtop, md_inpcrd))
+    print_md_inputf(os.path.join(workdir, 'md_min.in'), 'min', md_min_steps, ifc4)
+    subprocess.call("%s -O -i md_min.in -o md_min.out -p %s -c %s -r md_min.rst -x md_min.netcdf" %(exe, md_prmtop, md_inpcrd), shell=True, cwd=workdir)
 
     #NVT
     print("Perform md_nvt %d steps..." %md_nvt_steps)
-    print_md_inputf('md_nvt.in', 'nvt', md_nvt_steps, ifc4)
-    os.system("%s -O -i md_nvt.in -o md_nvt.out -p %s -c md_min.rst -r md_nvt.rst -x md_nvt.netcdf" %(exe, md_prmtop))
+    print_md_inputf(os.path.join(workdir, 'md_nvt.in'), 'nvt', md_nvt_steps, ifc4)
+    subprocess.call("%s -O -i md_nvt.in -o md_nvt.out -p %s -c md_min.rst -r md_nvt.rst -x md_nvt.netcdf" %(exe, md_prmtop), shell=True, cwd=workdir)
 
     #NPT
     print("Perform md_npt %d steps..." %md_npt_steps)
-    print_md_inputf('md_npt.in', 'npt', md_npt_steps, ifc4)
-    os.system("%s -O -i md_npt.in -o md_npt.out -p %s -c md_nvt.rst -r md_npt.rst -x md_npt.netcdf" %(exe, md_prmtop))
+    print_md_inputf(os.path.join(workdir, 'md_npt.in'), 'npt', md_npt_steps, ifc4)
+    subprocess.call("%s -O -i md_npt.in -o md_npt.out -p %s -c md_nvt.rst -r md_npt.rst -x md_npt.netcdf" %(exe, md_prmtop), shell=True, cwd=workdir)
 
     #MD
     print("Perform md_md %d steps..." %md_md_steps)
-    print_md_inputf('md_md.in', 'md', md_md_steps, ifc4)
-    os.system("%s -O -i md_md.in -o md_md.out -p %s -c md_npt.rst -r md_md.rst -x md_md.netcdf" %(exe, md_prmtop))
+    print_md_inputf(os.path.join(workdir, 'md_md.in'), 'md', md_md_steps, ifc4)
+    subprocess.call("%s -O -i md_md.in -o md_md.out -p %s -c md_npt.rst -r md_md.rst -x md_md.netcdf" %(exe, md_prmtop), shell=True, cwd=workdir)
 
     #Cpptraj input file
-    cpptrajf = open('cpptraj.in', 'w')
+    cpptrajf = open(os.path.join(workdir, 'cpptraj.in'), 'w')
     print("trajin md_md.netcdf 1 100000 1", file=cpptrajf)
     print("radial M_O 0.01 5.0 :1 :WAT@O volume intrdf M_O", file=cpptrajf)
     cpptrajf.close()
 
-    os.system("cpptraj -p %s -i cpptraj.in > cpptraj.out" %md_prmtop)
+    subprocess.call("cpptraj -p %s -i cpptraj.in > cpptraj.out" %md_prmtop, shell=True, cwd=workdir)
     #Get the IOD
-    rdff = open('M_O', 'r')
+    rdff = open(os.path.join(workdir, 'M_O'), 'r')
     dr = 0.005
     rs = []
     grs = []
@@ -1,6 +1,7 @@
 # This module for Generating the TI files
 from __future__ import print_function
 import os
+import subprocess
 
 Mass = {'H':   1.008,  'C':  12.01,  'N':  14.01,  'O':  16.00,  'S':  32.06,
         'P':   30.97,  'F':  19.00, 'Cl':  35.45, 'Br':  79.90,  'I':  126.9,
@@ -36,8 +37,8 @@ def write_frcmod(ion, fname):
     print(" ", file=frcmodf)
     frcmodf.close()
 
-def write_cmd(ion):
-    cmdf = open(ion.resname+'.cmd', 'w')
+def write_cmd(ion, workdir='.'):
+    cmdf = open(os.path.join(workdir, ion.resname+'.cmd'), 'w')
     print("i = createAtom %s %s %3.1f" %(ion.atname, ion.attype, ion.charge), file=cmdf)
     print("set i element \"%s\"" %ion.element, file=cmdf)
     print("set i position { 0 0 0 }", file=cmdf)
@@ -49,9 +50,9 @@ def write_cmd(ion):
     print("quit", file=cmdf)
     cmdf.close()
 
-def write_leapin(ion0, ion1, watermodel):
+def write_leapin(ion0, ion1, watermodel, workdir='.'):
 
-    leapf = open('tleap.in', 'w')
+    leapf = open(os.path.join(workdir, 'tleap.in'), 'w')
 
     print("source leaprc.protein.ff14SB", file=leapf)
     print("loadOff solvents.lib", file=leapf)
@@ -112,81 +113,81 @@ def write_leapin(ion0, ion1, watermodel):
     print("quit", file=leapf)
     leapf.close()
 
-def addc4(ion0, ion1, c4v):
+def addc4(ion0, ion1, c4v, workdir='.'):
 
     # Only for sander
     print("Add C4 parameters...")
 
     #Without charge and VDW
-    c4f0 = open('c4_0.txt', 'w')
+    c4f0 = open(os.path.join(workdir, 'c4_0.txt'), 'w')
     print("%s %f" %(ion0.element+str(int(ion0.charge)), 0.0), file=c4f0)
     c4f0.close()
 
     #Without VDW or charge
-    parmf = open('addc4_0.in', 'w')
+    parmf = open(os.path.join(workdir, 'addc4_0.in'), 'w')
     print("loadRestrt %s_wat_s0.inpcrd" %ion0.element, file=parmf)
     print("setOverwrite True", file=parmf)
     print("add12_6_4 :1@%s c4file c4_0.txt" %ion0.atname, file=parmf)
     print("outparm %s_wat_s0.prmtop %s_wat_s0.inpcrd" %(ion0.element, ion0.element), file=parmf)
     parmf.close()
 
-    os.system("parmed -i addc4_0.in -p %s_wat_s0.prmtop | tail -n 3" %ion0.element)
+    subprocess.call("parmed -i addc4_0.in -p %s_wat_s0.prmtop | tail -n 3" %ion0.element, shell=True, cwd=workdir)
 
     #With VDW but not charge
-    parmf = open('addc4_v.in', 'w')
+    parmf = open(os.path.join(workdir, 'addc4_v.in'), 'w')
     print("loadRestrt %s_wat_sv.inpcrd" %ion0.element, file=parmf)
     print("setOverwrite True", file=parmf)
     print("add12_6_4 :1@%s c4file c4_0.txt" %(ion0.atname), file=parmf)
     print("outparm %s_wat_sv.prmtop %s_wat_sv.inpcrd" %(ion0.element, ion0.element), file=parmf)
     parmf.close()
-    os.system("parmed -i addc4_v.in -p %s_wat_sv.prmtop | tail -n 3" %ion0.element)
+    subprocess.call("parmed -i addc4_v.in -p %s_wat_sv.prmtop | tail -n 3" %ion0.element, shell=True, cwd=workdir)
 
     #With Charge and VDW
-    c4f1 = open('c4_vc.txt', 'w')
+    c4f1 = open(os.path.join(workdir, 'c4_vc.txt'), 'w')
     print("%s %f" %(ion1.element+str(int(ion1.charge)), c4v), file=c4f1)
     c4f1.close()
 
-    parmf = open('addc4_vc.in', 'w')
+    parmf = open(os.path.join(workdir, 'addc4_vc.in'), 'w')
     print("loadRestrt %s_wat_svc.inpcrd" %ion1.element, file=parmf)
     print("setOverwrite True", file=parmf)
     print("add12_6_4 :1@%s c4file c4_vc.txt" %(ion1.atname), file=parmf)
     print("outparm %s_wat_svc.prmtop %s_wat_svc.inpcrd" %(ion1.element, ion1.element), file=parmf)
     parmf.close()
 
-    os.system("parmed -i addc4_vc.in -p %s_wat_svc.prmtop | tail -n 3" %ion1.element)
+    subprocess.call("parmed -i addc4_vc.in -p %s_wat_svc.prmtop | tail -n 3" %ion1.element, shell=True, cwd=workdir)
 
-def gene_topcrd(ion0, ion1, watermodel, ifc4=0, c4v=0.0):
+def gene_topcrd(ion0, ion1, watermodel, ifc4=0, c4v=0.0, workdir='.'):
 
     print("Generate the Topology and Coordinate Files...")
 
     #lib file
-    write_cmd(ion0)
-    write_cmd(ion1)
-    os.system("tleap -s -f %s.cmd > %s.out" %(ion0.resname, ion0.resname))
-    os.system("tleap -s -f %s.cmd > %s.out" %(ion1.resname, ion1.resname))
+    write_cmd(ion0, workdir)
+    write_cmd(ion1, workdir)
+    subprocess.call("tleap -s -f %s.cmd > %s.out" %(ion0.resname, ion0.resname), shell=True, cwd=workdir)
+    subprocess.call("tleap -s -f %s.cmd > %s.out" %(ion1.resname, ion1.resname), shell=True, cwd=workdir)
 
     #pdb file
-    pdbf = open('ION.pdb', 'w')
+    pdbf = open(os.path.join(workdir, 'ION.pdb'), 'w')
     print("HETATM 2032 %2s    %2s A   1       0.000   0.000   0.000  1.00  0.00" %(ion0.atname, ion0.resname), file=pdbf)
     print("TER", file=pdbf)
     print("HETATM 2032 %2s    %2s A   1       0.000   0.000   0.000  1.00  0.00" %(ion1.atname, ion1.resname), file=pdbf)
     pdbf.close()
 
     #frcmod file
-    write_frcmod(ion0, ion0.attype + '.frcmod')
-    write_frcmod(ion1, ion1.attype + '.frcmod')
+    write_frcmod(ion0, os.path.join(workdir, ion0.attype + '.frcmod'))
+    write_frcmod(ion1, os.path.join(workdir, ion1.attype + '.frcmod'))
 
     ion0.rmin = ion1.rmin
     ion0.ep = ion1.ep
 
-    write_frcmod(ion0, ion0.attype + '_vdw.frcmod')
+    write_frcmod(ion0, os.path.join(workdir, ion0.attype + '_vdw.frcmod'))
 
     #tleap file
-    write_leapin(ion0, ion1, watermodel)
-    os.system("tleap -s -f tleap.in > tleap.out")
+    write_leapin(ion0, ion1, watermodel, workdir)
+    subprocess.call("tleap -s -f tleap.in > tleap.out", shell=True, cwd=workdir)
 
     #add c4 parameters
     if ifc4 == 1:
-        addc4(ion0, ion1, c4v)
+        addc4(ion0, ion1, c4v, workdir)
 
 
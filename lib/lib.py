@@ -159,12 +159,9 @@ elif ambv == 16:
 # About the force field lib parameters
 #-----------------------------------------------------------------------------
 
-def get_lib_dict(ff_choice):
+def read_lib_file(fname):
 
-    if ff_choice in list(FF_DICT.keys()):
-        mol, atids, resids = get_atominfo(FF_DICT[ff_choice].mol2f)
-    else:
-        mol, atids, resids = get_atominfo(ff_choice)
+    mol, atids, resids = get_atominfo(fname)
 
     libdict = {} #resname + atname : atom type, atom charge
     chargedict = {} #resname : charge
@@ -190,6 +187,13 @@ def get_lib_dict(ff_choice):
         #  libdict[mol.residues[i].resname + '-H']
     return libdict, chargedict
 
+def get_lib_dict(ff_choice):
+
+    if ff_choice in list(FF_DICT.keys()):
+        return read_lib_file(FF_DICT[ff_choice].mol2f)
+    else:
+        return read_lib_file(ff_choice)
+
 #-----------------------------------------------------------------------------
 # About the force field params parameters
 #-----------------------------------------------------------------------------
@@ -580,8 +584,6 @@ def expf(x, a, b, c):
 
 def getfc(fname, dis):
 
-    global libadd
-
     lengthl = []
     fcl = []
     fcf = open(libadd + fname, 'r')
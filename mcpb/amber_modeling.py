@@ -12,16 +12,17 @@ from mcpb.rename_residues import rename_res, get_diS_bond
 from pymsmtexp import *
 import warnings
 import os
+import subprocess
 
 ##############################################################################
 # Related functions
 ##############################################################################
-def gene_ion_libfile(resname, atname, element, charge):
+def gene_ion_libfile(resname, atname, element, charge, workdir='.'):
 
     atomtyp = element + str(charge) + '+'
     ionfname = '%s.cmd' %resname
 
-    ionf = open(ionfname, 'w')
+    ionf = open(os.path.join(workdir, ionfname), 'w')
     print('i = createAtom   %s  %s  %s' %(atname, atomtyp, str(charge)), file=ionf)
     print('set i    element %s' %element, file=ionf)
     print('set i    position { 0 0 0 }', file=ionf)
@@ -33,7 +34,8 @@ def gene_ion_libfile(resname, atname, element, charge):
     print('quit', file=ionf)
     ionf.close()
 
-    os.system('tleap -s -f %s.cmd > %s.log' %(resname, resname))
+    subprocess.call('tleap -s -f %s.cmd > %s.log' %(resname, resname),
+                    shell=True, cwd=workdir)
 
 def get_frcmod_fname(element, charge, watermodel, paraset):
     """Get the frcmod file name which need to be loaded."""
@@ -104,7 +106,7 @@ def get_frcmod_fname(element, charge, watermodel, paraset):
 def gene_leaprc(gname, orpdbf, fipdbf, stpdbf, stfpf, ionids,\
                 ionmol2fs, ioninf, mcresname, naamol2fs, ff_choice, gaff,
                 frcmodfs, finfcdf, ileapf, model, watermodel='tip3p',
-                paraset='cm'):
+                paraset='cm', workdir='.'):
 
     print("******************************************************************")
     print("*                                                                *")
@@ -112,6 +114,9 @@ def gene_leaprc(gname, orpdbf, fipdbf, stpdbf, stfpf, ionids,\
     print("*                                                                *")
     print("******************************************************************")
 
+    #The frcmod files of the ions are added to a copy of the list
+    frcmodfs = list(frcmodfs)
+
     #---------------------Generate the new pdb file--------------------------
     #mol0 is the old mol while mol is new mol file with new names
 
@@ -147,7 +152,7 @@ def gene_leaprc(gname, orpdbf, fipdbf, stpdbf, stfpf, ionids,\
         for i in resndict.keys():
             mol.residues[i].resname = resndict[i]
 
-    writepdb(mol, atids, fipdbf)
+    writepdb(mol, atids, os.path.join(workdir, fipdbf))
     #----------------------------get the atom names which changed atom type
     if model in [1, 2]:
         atomdefs = {}
@@ -210,7 +215,8 @@ def gene_leaprc(gname, orpdbf, fipdbf, stpdbf, stfpf, ionids,\
 
         for i in range(0, len(metresns)):
             if metchgs[i] > 1: #if it is -1 or +1 ions, no need to create the lib file
-                gene_ion_libfile(metresns[i], metatns[i], metelmts[i], metchgs[i])
+                gene_ion_libfile(metresns[i], metatns[i], metelmts[i], metchgs[i],
+                                 workdir)
                 frcmodf = get_frcmod_fname(metelmts[i], metchgs[i], watermodel, paraset)
                 if frcmodf not in frcmodfs:
                     frcmodfs.append(frcmodf)
@@ -220,7 +226,7 @@ def gene_leaprc(gname, orpdbf, fipdbf, stpdbf, stfpf, ionids,\
     print('Generating the leap input file...')
 
     # Source the protein force field
-    lp = open(ileapf, 'w')
+    lp = open(os.path.join(workdir, ileapf), 'w')
 
     #Load leaprc files
     print("source %s" %FF_DICT[ff_choice].sleaprcf, file=lp)
@@ -0,0 +1,381 @@
+"""
+This module was written for running MCPB.py on a batch of structures. Each
+structure (job) is run in its own working directory, so that the fixed output
+file names of MCPB.py (e.g. resp1.in, *_sqm.out) do not collide between jobs,
+and the jobs are run in parallel with a bounded process pool.
+
+The manifest file has one job per line:
+  input_file [step1 step2 ...]
+The steps are the MCPB.py step numbers run in order for this job, if no
+step is given the default steps are used. The file paths in the MCPB.py input
+file are relative to the directory of the input file.
+"""
+from __future__ import absolute_import, print_function
+from mcpb.gene_model_files import get_ms_resnames
+from pymsmtexp import *
+from multiprocessing import Pool
+import os
+import shutil
+import subprocess
+import time
+
+#Variables in the MCPB.py input file which are input file names
+FILE_KEYS = ['original_pdb', 'ion_mol2files', 'naa_mol2files', 'frcmod_files']
+
+#Files of the group (named as group_name + suffix) which are read and written
+#by each step of MCPB.py, only those read by the steps of a job (and not
+#written by an earlier step of it) are copied into the job directory. The
+#RES_MOL2 entry is the mol2 files of the renamed metal site residues (e.g.
+#ZN1.mol2), which are named by the residue names instead of the group name
+RES_MOL2 = '<resname>.mol2'
+STEP_FILES = [
+ (['1', '1n', '1m', '1a'], [],
+  ['_small.pdb', '_standard.pdb', '_large.pdb', '_standard.fingerprint',
+   '_large.fingerprint', '_small.res']),
+ (['2', '2s'],
+  ['_standard.pdb', '_standard.fingerprint', '_small.res', '_small.pdb',
+   '_small_opt.fchk', '_small_fc.log'],
+  ['_mcpbpy_pre.frcmod', '_mcpbpy.frcmod']),
+ (['2e'],
+  ['_standard.pdb', '_standard.fingerprint', '_small.res', '_small.pdb'],
+  ['_mcpbpy_pre.frcmod', '_mcpbpy.frcmod']),
+ (['2z'],
+  ['_standard.pdb', '_standard.fingerprint', '_small.res', '_small.pdb',
+   '_small_fc.log'],
+  ['_mcpbpy_pre.frcmod', '_mcpbpy.frcmod']),
+ (['3', '3a', '3b', '3c', '3d'],
+  ['_standard.pdb', '_large.pdb', '_standard.fingerprint',
+   '_large.fingerprint', '_large_mk.log'], [RES_MOL2]),
+ (['4', '4b', '4n1'],
+  ['_standard.pdb', '_standard.fingerprint', '_mcpbpy.frcmod', RES_MOL2],
+  ['_mcpbpy.pdb', '_tleap.in']),
+ (['4n2'], ['_mcpbpy.frcmod'], ['_mcpbpy.pdb', '_tleap.in']),
+]
+
+#Name of the job status file in the job directory
+STATUS_FILE = 'MCPBBatch.status'
+
+class BatchJob:
+    def __init__(self, name, inputf, steps):
+        self.name = name
+        self.inputf = inputf
+        self.steps = steps
+        self.status = 'pending'
+        self.donesteps = []
+        self.failstep = ''
+        self.time = 0.0
+        self.error = ''
+
+#-----------------------------------------------------------------------------
+# Read the manifest and prepare the job directories
+#-----------------------------------------------------------------------------
+
+def read_manifest(manifestf, steps):
+
+    jobs = []
+    names = []
+    fp = open(manifestf, 'r')
+    for line in fp:
+        line = line.split()
+        if (len(line) == 0) or (line[0][0] == '#'):
+            continue
+        inputf = os.path.abspath(os.path.join(os.path.dirname(manifestf),
+                                              line[0]))
+        if not os.path.exists(inputf):
+            raise pymsmtError('File %s in the manifest does not exist.'
+                              %line[0])
+        if len(line) > 1:
+            jobsteps = [i.lower() for i in line[1:]]
+        else:
+            jobsteps = list(steps)
+
+        #Job name from the input file name, which should be unique
+        name = os.path.splitext(os.path.basename(inputf))[0]
+        if name in names:
+            i = 2
+            while name + '_' + str(i) in names:
+                i = i + 1
+            name = name + '_' + str(i)
+        names.append(name)
+        jobs.append(BatchJob(name, inputf, jobsteps))
+    fp.close()
+    return jobs
+
+def get_input_files(inputf):
+    """Get the group name and the files used in the MCPB.py input file."""
+
+    gname = 'MOL'
+    fnames = []
+    fp = open(inputf, 'r')
+    for line in fp:
+        line = line.split()
+        if (len(line) == 0) or (line[0][0] == '#'):
+            continue
+        elif line[0].lower() in FILE_KEYS:
+            fnames = fnames + line[1:]
+        elif (line[0].lower() == 'group_name') and (len(line) == 2):
+            gname = line[1]
+    fp.close()
+    return gname, fnames
+
+def get_site_resnames(inputf):
+    """Get the new names of the metal site residues (e.g. ZN1, CY1), which
+       MCPB.py gets from the original PDB file and the metal site variables
+       in the input file."""
+
+    orpdbf = None
+    ionids = []
+    addres = []
+    addbpairs = []
+    cutoff = 2.8
+    fp = open(inputf, 'r')
+    for line in fp:
+        line = line.split()
+        if (len(line) < 2) or (line[0][0] == '#'):
+            continue
+        key = line[0].lower()
+        try:
+            if key == 'original_pdb':
+                orpdbf = line[1]
+            elif key == 'ion_ids':
+                ionids = [int(i) for i in line[1:]]
+            elif key == 'additional_resids':
+                addres = [int(i) for i in line[1:]]
+            elif key == 'add_bonded_pairs':
+                addbpairs = [tuple([int(j) for j in i.split('-')])
+                             for i in line[1:]]
+            elif key == 'cut_off':
+                cutoff = float(line[1])
+        except ValueError:
+            raise pymsmtError('Wrong value of %s in %s.' %(line[0], inputf))
+    fp.close()
+
+    if (orpdbf is None) or (not ionids):
+        raise pymsmtError('The original_pdb and ion_ids are needed in %s to '
+                          'get the mol2 files of the metal site residues.'
+                          %inputf)
+    orpdbf = os.path.join(os.path.dirname(inputf), orpdbf)
+    return get_ms_resnames(orpdbf, ionids, cutoff, addres, addbpairs)[1]
+
+def get_step_files(steps):
+    """Get the suffixes of the group files which the steps read and which
+       are not written by an earlier step of them."""
+    infs = []
+    outfs = []
+    for step in steps:
+        for stepnames, stepinfs, stepoutfs in STEP_FILES:
+            if step in stepnames:
+                infs = infs + [i for i in stepinfs
+                               if (i not in outfs) and (i not in infs)]
+                outfs = outfs + stepoutfs
+    return infs
+
+def setup_job_dir(job, jobdir):
+    """Copy the input file and the files it uses into the job directory.
+       The input file is rewritten to use the copied files, and the group
+       files (e.g. MOL_small_fc.log) and metal site residue mol2 files
+       which the steps of the job read are copied too."""
+
+    if not os.path.isdir(jobdir):
+        os.makedirs(jobdir)
+
+    inpdir = os.path.dirname(job.inputf)
+    gname, fnames = get_input_files(job.inputf)
+
+    for fname in fnames:
+        srcf = os.path.join(inpdir, fname)
+        if not os.path.exists(srcf):
+            raise pymsmtError('File %s used in %s does not exist.'
+                              %(fname, job.inputf))
+        shutil.copyfile(srcf, os.path.join(jobdir, os.path.basename(fname)))
+
+    for suffix in get_step_files(job.steps):
+        if suffix == RES_MOL2:
+            #The mol2 files written by step 3 are needed by step 4
+            for resname in get_site_resnames(job.inputf):
+                srcf = os.path.join(inpdir, resname + '.mol2')
+                if not os.path.isfile(srcf):
+                    raise pymsmtError('File %s.mol2 of the metal site '
+                                      'residue, which is written by step 3, '
+                                      'is needed by the steps of %s but does '
+                                      'not exist.' %(resname, job.inputf))
+                shutil.copyfile(srcf, os.path.join(jobdir, resname + '.mol2'))
+            continue
+        srcf = os.path.join(inpdir, gname + suffix)
+        if os.path.isfile(srcf):
+            shutil.copyfile(srcf, os.path.join(jobdir, gname + suffix))
+
+    #Rewrite the input file with the file names in the job directory
+    w_inputf = open(os.path.join(jobdir, os.path.basename(job.inputf)), 'w')
+    fp = open(job.inputf, 'r')
+    for line in fp:
+        items = line.split()
+        if (len(items) > 1) and (items[0].lower() in FILE_KEYS):
+            items = items[0:1] + [os.path.basename(i) for i in items[1:]]
+            line = ' '.join(items) + '\n'
+        w_inputf.write(line)
+    fp.close()
+    w_inputf.close()
+
+#-----------------------------------------------------------------------------
+# Job status
+#-----------------------------------------------------------------------------
+
+def write_job_status(job, jobdir):
+    w_statf = open(os.path.join(jobdir, STATUS_FILE), 'w')
+    print('status', job.status, file=w_statf)
+    print('steps', ' '.join(job.steps), file=w_statf)
+    print('donesteps', ' '.join(job.donesteps), file=w_statf)
+    print('failstep', job.failstep, file=w_statf)
+    print('time', '%.1f' %job.time, file=w_statf)
+    print('error', job.error, file=w_statf)
+    w_statf.close()
+
+def read_job_status(job, jobdir):
+    """Read the status of a job from a previous run, return False if the
+       job was not run before."""
+
+    statf = os.path.join(jobdir, STATUS_FILE)
+    if not os.path.exists(statf):
+        return False
+    fp = open(statf, 'r')
+    for line in fp:
+        line = line.rstrip('\n').split(' ', 1)
+        if len(line) == 1:
+            line.append('')
+        if line[0] == 'status':
+            job.status = line[1]
+        elif line[0] == 'donesteps':
+            job.donesteps = line[1].split()
+        elif line[0] == 'failstep':
+            job.failstep = line[1]
+        elif line[0] == 'time':
+            job.time = float(line[1])
+        elif line[0] == 'error':
+            job.error = line[1]
+    fp.close()
+    return True
+
+def get_error_msg(logf):
+    """Get the error message from the log file of a failed step."""
+    lines = [i.strip() for i in open(logf, 'r') if i.strip()]
+    for line in lines[::-1]:
+        if 'Error' in line:
+            return line
+    if lines:
+        return lines[-1]
+    return 'Unknown error'
+
+#-----------------------------------------------------------------------------
+# Run the jobs
+#-----------------------------------------------------------------------------
+
+def run_job(args):
+    """Run the steps of one job in its directory, the steps which were
+       done in a previous run of the job are skipped."""
+
+    job, jobdir, mcpbcmd, cachedir = args
+
+    t0 = time.time()
+    try:
+        setup_job_dir(job, jobdir)
+    except Exception as e:
+        job.status = 'failed'
+        job.failstep = 'setup'
+        job.error = str(e)
+        write_job_status(job, jobdir)
+        return job
+
+    job.status = 'running'
+    job.failstep = ''
+    job.error = ''
+    for step in job.steps:
+        if step in job.donesteps:
+            continue
+        cmd = mcpbcmd + ['-i', os.path.basename(job.inputf), '-s', step]
+        if cachedir is not None:
+            cmd = cmd + ['--cache', cachedir]
+        logf = os.path.join(jobdir, 'MCPB_step%s.log' %step)
+        w_logf = open(logf, 'w')
+        try:
+            errc = subprocess.call(cmd, cwd=jobdir, stdout=w_logf,
+                                   stderr=subprocess.STDOUT)
+        except OSError as e:
+            errc = 1
+            print(e, file=w_logf)
+        w_logf.close()
+        if errc != 0:
+            job.status = 'failed'
+            job.failstep = step
+            job.error = get_error_msg(logf)
+            break
+        job.donesteps.append(step)
+    else:
+        job.status = 'done'
+
+    job.time = job.time + time.time() - t0
+    write_job_status(job, jobdir)
+    return job
+
+def run_batch(jobs, batchdir, mcpbcmd, nproc=1, cachedir=None,
+              failedonly=False, names=None):
+    """Run the jobs with a pool of nproc processes. If failedonly is True,
+       only the jobs which failed or were not finished in a previous run
+       are run, from the step which failed. If names is given, only the
+       jobs with these names are run."""
+
+    if not os.path.isdir(batchdir):
+        os.makedirs(batchdir)
+    if cachedir is not None:
+        cachedir = os.path.abspath(cachedir)
+
+    runjobs = []
+    for job in jobs:
+        jobdir = os.path.join(batchdir, job.name)
+        prerun = read_job_status(job, jobdir)
+        if (names is not None) and (job.name not in names):
+            continue
+        if failedonly and prerun and (job.status == 'done'):
+            continue
+        if not failedonly:
+            job.donesteps = []
+            job.time = 0.0
+        runjobs.append((job, jobdir, mcpbcmd, cachedir))
+
+    print("Running %d of %d jobs with %d processes..."
+          %(len(runjobs), len(jobs), nproc))
+
+    results = {}
+    pool = Pool(nproc)
+    for job in pool.imap_unordered(run_job, runjobs):
+        results[job.name] = job
+        print("Job %s is %s (%.1f s)." %(job.name, job.status, job.time))
+    pool.close()
+    pool.join()
+
+    jobs = [results.get(i.name, i) for i in jobs]
+    return jobs
+
+def print_summary(jobs, sumf):
+    """Print the status, timing and error of each job into the summary
+       file and the screen."""
+
+    w_sumf = open(sumf, 'w')
+    print("%-20s %-8s %-20s %-6s %10s  %s" %('JOB', 'STATUS', 'DONE_STEPS',
+          'FAILED', 'TIME(s)', 'ERROR'), file=w_sumf)
+    for job in jobs:
+        donesteps = ','.join(job.donesteps)
+        if not donesteps:
+            donesteps = '-'
+        failstep = job.failstep
+        if not failstep:
+            failstep = '-'
+        print("%-20s %-8s %-20s %-6s %10.1f  %s" %(job.name, job.status,
+              donesteps, failstep, job.time, job.error), file=w_sumf)
+    w_sumf.close()
+
+    ndone = len([i for i in jobs if i.status == 'done'])
+    nfail = len([i for i in jobs if i.status == 'failed'])
+    print("%d jobs done, %d jobs failed, %d jobs not run." %(ndone, nfail,
+          len(jobs) - ndone - nfail))
+    print("The summary table is written to %s" %sumf)
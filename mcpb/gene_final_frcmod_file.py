@@ -26,6 +26,7 @@ from pymsmtexp import *
 from numpy import average, array, dot, cross, std
 from numpy.linalg import eigvals, eig, norm
 import math
+import os
 
 #-----------------------------------------------------------------------------
 # Related fuctions
@@ -216,7 +217,7 @@ def get_coord_num(blist, atn):
             cn = cn + 1
     return cn
 
-def gene_by_empirical_way(smpdbf, ionids, stfpf, pref, finf):
+def gene_by_empirical_way(smpdbf, ionids, stfpf, pref, finf, workdir='.'):
 
     print("******************************************************************")
     print("*                                                                *")
@@ -310,7 +311,8 @@ def gene_by_empirical_way(smpdbf, ionids, stfpf, pref, finf):
         finalparmdict[misangat123] = ang_para
 
     #Print out the final frcmod file
-    print_frcmod_file(pref, finf, finalparmdict, 'empirical')
+    print_frcmod_file(pref, os.path.join(workdir, finf), finalparmdict,
+                      'empirical')
 
 #-----------------------------------------------------------------------------
 # Seminario method Ref: Calculation of intramolecular force fields from
@@ -631,7 +633,8 @@ def get_imp_fc_with_sem(crds, fcmatrix, nat1, nat2, nat3, nat4, scalef):
     return fcfinal, disAtoBCD
 
 def gene_by_QM_fitting_sem(smpdbf, ionids, stfpf, pref, finf, chkfname,
-                           logfile, g0x, scalef, bondavg, angavg):
+                           logfile, g0x, scalef, bondavg, angavg,
+                           workdir='.'):
 
     print("==================Using the Seminario method to solve the problem.")
 
@@ -727,7 +730,8 @@ def gene_by_QM_fitting_sem(smpdbf, ionids, stfpf, pref, finf, chkfname,
         finalparmdict[misangat123] = ang_para
 
     #Print out the final frcmod file
-    print_frcmod_file(pref, finf, finalparmdict, 'Seminario')
+    print_frcmod_file(pref, os.path.join(workdir, finf), finalparmdict,
+                      'Seminario')
 
 #-----------------------------------------------------------------------------
 # Z-matrix method: obtain the force constant from the entire Hessian matrix
@@ -792,7 +796,7 @@ def get_all_fc_with_zmatrix(pdbf, logfname, scalef):
             print_dih_inf(at1_rep, at2_rep, at3_rep, at4_rep, fcfinal, dihval)
 
 def gene_by_QM_fitting_zmatrix(smpdbf, ionids, stfpf, pref, finf, logfname,
-                               scalef):
+                               scalef, workdir='.'):
 
     print("=============Using the Z-matrix method to generate the parameters.")
 
@@ -866,5 +870,6 @@ def gene_by_QM_fitting_zmatrix(smpdbf, ionids, stfpf, pref, finf, logfname,
         finalparmdict[misangat123] = ang_para
 
     #Print out the final frcmod file
-    print_frcmod_file(pref, finf, finalparmdict, 'Z-matrix')
+    print_frcmod_file(pref, os.path.join(workdir, finf), finalparmdict,
+                      'Z-matrix')
 
@@ -4,7 +4,7 @@ standard and large models and Gaussian input file of small (for bond and
 angle parameter fitting) and large models(for RESP charge fitting).
 """
 from __future__ import absolute_import, print_function
-from msmtmol.readpdb import get_atominfo_fpdb, writepdbatm
+from msmtmol.readpdb import get_atominfo_fpdb, writepdbatm, BufferedWriter
 from msmtmol.cal import calc_bond
 from msmtmol.mol import pdbatm, gauatm, get_reslist
 from msmtmol.element import (Atnum, CoRadiiDict,
@@ -16,6 +16,7 @@ from msmtmol.gmsio import (write_gmsatm, write_gms_optf, write_gms_fcf,
 from msmtmol.sqmio import get_crdinfo_from_sqm, write_sqm_optf
 from lib.lib import get_lib_dict
 import os
+import subprocess
 
 H_NAMES = ['HH31', 'HH32', 'HH33']  #hydrogen names for ACE and NME methyl group
 SH_NAMES = ['H1', 'H2', 'H3'] #The names of the three Hs in the methyl group
@@ -26,23 +27,19 @@ BIND_ATOMS = ['N', 'O', 'S', 'F', 'Cl', 'Br', 'I']
 def del_files(fnamel):
     for fname in fnamel:
         if os.path.exists(fname):
-            os.system("rm %s" %fname)
+            os.remove(fname)
 
 def count_lines(fname):
     ln = 0
     fp = open(fname, 'r')
     for line in fp:
         ln = ln + 1
-    return ln
     fp.close()
+    return ln
 
-#-------------------Get metal center residue names-----------------------------
-def get_ms_resnames(pdbfile, ionids, cutoff, addres, addbpairs):
-
-    global BIND_ATOMS
+#-------------------Get metal center residue ids-------------------------------
+def get_ms_resids(mol, atids, ionids, cutoff, addres, addbpairs):
 
-    mol, atids, resids = get_atominfo_fpdb(pdbfile)
-    ionids = ionids #metal ion atom id
     metresids = [] #metal ion residue id
 
     #Get the metal ion id
@@ -71,6 +68,15 @@ def get_ms_resnames(pdbfile, ionids, cutoff, addres, addbpairs):
 
     msresids.sort()
 
+    return msresids, metresids
+
+#-------------------Get metal center residue names-----------------------------
+def get_ms_resnames(pdbfile, ionids, cutoff, addres, addbpairs):
+
+    mol, atids, resids = get_atominfo_fpdb(pdbfile)
+    msresids, metresids = get_ms_resids(mol, atids, ionids, cutoff, addres,
+                                        addbpairs)
+
     mcresnames = [] #New names of the metal site residues
     tmpl = []
     for i in msresids:
@@ -96,8 +102,6 @@ def get_ms_resnames(pdbfile, ionids, cutoff, addres, addbpairs):
 #--------------------Get metal site bonded atom ids--------------------------
 def get_ms_ids(mol, atids, ionids, cutoff, addbpairs):
 
-    global BIND_ATOMS
-
     bdatmids = []
     bdatnams = []
 
@@ -124,6 +128,8 @@ def get_ms_ids(mol, atids, ionids, cutoff, addbpairs):
 
 #-----------------------------------------------------------------------------
 #-----------------------------------------------------------------------------
+# In the following functions, pdbf is the PDB file name or a BufferedWriter,
+# fpf is the BufferedWriter (or file object) of the fingerprint file
 #-----------------------------------------------------------------------------
 #---------------------Write ACE residue into the PDB file---------------------
 def write_ace(mol, i, gatms, pdbf, fpf=None):
@@ -140,8 +146,6 @@ def write_ace(mol, i, gatms, pdbf, fpf=None):
     If there is a PRO was treated as ACE, there will be no influence.
     """
 
-    global H_NAMES, SH_NAMES, GH_NAMES
-
     print("Creating the residue " + str(i) + '-' + \
           mol.residues[i].resname +  " into ACE...")
 
@@ -211,9 +215,7 @@ def write_ace(mol, i, gatms, pdbf, fpf=None):
 
             #fingerprint file
             if fpf is not None:
-                fpff = open(fpf, 'a')
-                print(str(resid) + '-' + 'ACE-' + atname, file=fpff)
-                fpff.close()
+                print(str(resid) + '-' + 'ACE-' + atname, file=fpf)
 
 #---------------------Write CH3NH2 residue into the PDB file-------------------
 def write_ant(mol, i, gatms, pdbf, fpf=None):
@@ -228,8 +230,6 @@ def write_ant(mol, i, gatms, pdbf, fpf=None):
     If there is a PRO was treated as ACT, there will be no influence.
     """
 
-    global H_NAMES, SH_NAMES, GH_NAMES
-
     #If the resname is not PRO, keep the NH2 or NH3 group, delete the sidechain
     #and change CA to CH3, HA, CB and C to HH31, HH32, HH33
     if mol.residues[i].resname != 'PRO':
@@ -318,9 +318,7 @@ def write_ant(mol, i, gatms, pdbf, fpf=None):
 
                 #fingerprint file
                 if fpf is not None:
-                    fpff = open(fpf, 'a')
-                    print(str(resid) + '-' + 'ANT-' + atname, file=fpff)
-                    fpff.close()
+                    print(str(resid) + '-' + 'ANT-' + atname, file=fpf)
 
     #If the resname is PRO, change HA, C to HA2, HA3 and keep the ring
     elif mol.residues[i].resname == 'PRO':
@@ -404,9 +402,7 @@ def write_ant(mol, i, gatms, pdbf, fpf=None):
 
                 #fingerprint file
                 if fpf is not None:
-                    fpff = open(fpf, 'a')
-                    print(str(resid) + '-' + 'PNT-' + atname, file=fpff)
-                    fpff.close()
+                    print(str(resid) + '-' + 'PNT-' + atname, file=fpf)
 
 #---------------------Write CH3CO2- residue into the PDB file---------------------
 def write_act(mol, i, gatms, pdbf, fpf=None):
@@ -421,8 +417,6 @@ def write_act(mol, i, gatms, pdbf, fpf=None):
     If there is a PRO was treated as ACT, there will be no influence.
     """
 
-    global H_NAMES, SH_NAMES, GH_NAMES
-
     print("Creating the residue " + str(i) + '-' + \
           mol.residues[i].resname + " into ACT...")
 
@@ -494,9 +488,7 @@ def write_act(mol, i, gatms, pdbf, fpf=None):
 
             #fingerprint file
             if fpf is not None:
-                fpff = open(fpf, 'a')
-                print(str(resid) + '-' + 'ACT-' + atname, file=fpff)
-                fpff.close()
+                print(str(resid) + '-' + 'ACT-' + atname, file=fpf)
 
 #---------------------Write NME residue into the PDB file---------------------
 def write_nme(mol, i, gatms, pdbf, fpf=None):
@@ -513,8 +505,6 @@ def write_nme(mol, i, gatms, pdbf, fpf=None):
        atom H.
     """
 
-    global H_NAMES, SH_NAMES, GH_NAMES
-
     print("Creating the residue " + str(i) + '-' + \
           mol.residues[i].resname + " into NME...")
 
@@ -592,9 +582,7 @@ def write_nme(mol, i, gatms, pdbf, fpf=None):
 
                 #fingerprint file
                 if fpf is not None:
-                    fpff = open(fpf, 'a')
-                    print(str(resid) + '-' + 'NME-' + atname, file=fpff)
-                    fpff.close()
+                    print(str(resid) + '-' + 'NME-' + atname, file=fpf)
 
     #If the resname is PRO
     else:
@@ -673,9 +661,7 @@ def write_nme(mol, i, gatms, pdbf, fpf=None):
 
                 #fingerprint file
                 if fpf is not None:
-                    fpff = open(fpf, 'a')
-                    print(str(resid) + '-' + 'NME-' + atname, file=fpff)
-                    fpff.close()
+                    print(str(resid) + '-' + 'NME-' + atname, file=fpf)
 
 #---------------------Write GLY residue into the PDB file---------------------
 def write_gly(mol, i, gatms, pdbf, fpf=None):
@@ -689,8 +675,6 @@ def write_gly(mol, i, gatms, pdbf, fpf=None):
     atom H as well.
     """
 
-    global H_NAMES, SH_NAMES, GH_NAMES
-
     #get the coordinates of the CA atom
     print("Creating the residue " + str(i) + '-' + \
           mol.residues[i].resname + " into GLY...")
@@ -789,9 +773,7 @@ def write_gly(mol, i, gatms, pdbf, fpf=None):
 
                 #fingerprint file
                 if fpf is not None:
-                    fpff = open(fpf, 'a')
-                    print(str(resid) + '-' + 'GLY-' + atname, file=fpff)
-                    fpff.close()
+                    print(str(resid) + '-' + 'GLY-' + atname, file=fpf)
 
     #If the resname is PRO
     else:
@@ -883,9 +865,7 @@ def write_gly(mol, i, gatms, pdbf, fpf=None):
 
                 #fingerprint file
                 if fpf is not None:
-                    fpff = open(fpf, 'a')
-                    print(str(resid) + '-' + 'GLY-' + atname, file=fpff)
-                    fpff.close()
+                    print(str(resid) + '-' + 'GLY-' + atname, file=fpf)
 
 #---------------------Write normal residue into the PDB file---------------------
 def write_normal(mol, reslist, i, gatms, pdbf, fpf=None):
@@ -926,15 +906,11 @@ def write_normal(mol, reslist, i, gatms, pdbf, fpf=None):
 
         #Fingerprint file
         if fpf is not None:
-            fpff = open(fpf, 'a')
-            print(str(resid) + '-' + resname + '-' + atname, file=fpff)
-            fpff.close()
+            print(str(resid) + '-' + resname + '-' + atname, file=fpf)
 
 #-----------------------Write Sidechain residues-------------------------------
 def write_sc(mol, i, gatms, smpdbf):
 
-    global H_NAMES, SH_NAMES, GH_NAMES
-
     print("It contains the residue " + str(i) + '-' + \
           mol.residues[i].resname + " as sidechain coordinated.")
 
@@ -1008,8 +984,6 @@ def write_sc(mol, i, gatms, smpdbf):
 
 def write_sc_knh(mol, i, gatms, smpdbf):
 
-    global H_NAMES, SH_NAMES, GH_NAMES, SH_NAMES2
-
     print("It contains the residue " + str(i) + '-' + \
           mol.residues[i].resname + " as keeping sidechain and NH group.")
 
@@ -1090,8 +1064,6 @@ def write_sc_knh(mol, i, gatms, smpdbf):
 
 def write_sc_kco(mol, i, gatms, smpdbf):
 
-    global H_NAMES, SH_NAMES, GH_NAMES, SH_NAMES2
-
     print("It contains the residue " + str(i) + '-' + \
           mol.residues[i].resname + " as keeping sidechain and CO group.")
 
@@ -1160,7 +1132,8 @@ def write_sc_kco(mol, i, gatms, smpdbf):
 
 #------------------------------Sidechain------------------------------------
 def build_small_model(mol, reslist, smresids, smresace, smresnme,
-    smresgly, smresant, smresact, smresknh, smreskco, smchg, outf, sqmopt):
+    smresgly, smresant, smresact, smresknh, smreskco, smchg, outf, sqmopt,
+    workdir='.'):
 
     """
     For building the small model
@@ -1174,18 +1147,21 @@ def build_small_model(mol, reslist, smresids, smresace, smresnme,
     will be no influence since H was not considered in this modeling.
     """
 
+    #The model files are written in workdir
+    fpre = os.path.join(workdir, outf)
+
     #Sidechain model file
-    smpdbf = outf + '_small.pdb'
+    smpdbf = fpre + '_small.pdb'
 
     #Gaussian
-    goptf = outf + '_small_opt.com'
-    gfcf = outf + '_small_fc.com'
+    goptf = fpre + '_small_opt.com'
+    gfcf = fpre + '_small_fc.com'
 
     #GAMESS
-    goptf2 = outf + '_small_opt.inp'
-    gfcf2 = outf + '_small_fc.inp'
+    goptf2 = fpre + '_small_opt.inp'
+    gfcf2 = fpre + '_small_fc.inp'
 
-    #SQM
+    #SQM, which is run in workdir
     siopf = outf + '_small_sqm.in'
     soopf = outf + '_small_sqm.out'
 
@@ -1199,35 +1175,38 @@ def build_small_model(mol, reslist, smresids, smresace, smresnme,
     print("***Creating the small model...")
 
     gatms = [] #gaussian atom list
+    smpdbw = BufferedWriter(smpdbf) #Written at the end
 
     for i in smresids:
         #1) For residue switching to ACE
         if i in smresace:
-            write_ace(mol, i, gatms, smpdbf)
+            write_ace(mol, i, gatms, smpdbw)
         #2) For residue switching to NME
         elif i in smresnme:
-            write_nme(mol, i, gatms, smpdbf)
+            write_nme(mol, i, gatms, smpdbw)
         #3) For residue switching to GLY
         elif i in smresgly:
-            write_gly(mol, i, gatms, smpdbf)
+            write_gly(mol, i, gatms, smpdbw)
         #4) For residue switching to CH3NH3+
         elif i in smresant:
-            write_ant(mol, i, gatms, smpdbf)
+            write_ant(mol, i, gatms, smpdbw)
         #5) For residue switching to CH3CO2-
         elif i in smresact:
-            write_act(mol, i, gatms, smpdbf)
+            write_act(mol, i, gatms, smpdbw)
         #6) For residue which keep N and H in the model
         elif i in smresknh:
-            write_sc_knh(mol, i, gatms, smpdbf)
+            write_sc_knh(mol, i, gatms, smpdbw)
         #7) For residue which keep C and O in the model
         elif i in smreskco:
-            write_sc_kco(mol, i, gatms, smpdbf)
+            write_sc_kco(mol, i, gatms, smpdbw)
         #8) For normal amino acid residues, keep the small
         elif i in reslist.std:
-            write_sc(mol, i, gatms, smpdbf)
+            write_sc(mol, i, gatms, smpdbw)
         #9) For speical residue
         else:
-            write_normal(mol, reslist, i, gatms, smpdbf)
+            write_normal(mol, reslist, i, gatms, smpdbw)
+
+    smpdbw.close()
 
     ln = count_lines(smpdbf)
     print("Totally there are " + str(ln) + " atoms in the small model.")
@@ -1258,13 +1237,14 @@ def build_small_model(mol, reslist, smresids, smresace, smresnme,
     #Perform the SQM calcualtion under PM6 first
     if (sqmopt == 1) or (sqmopt == 3):
         #Delete the possible existing file
-        del_files([siopf, soopf])
-        write_sqm_optf(siopf, smchg, gatms)
+        del_files([fpre + '_small_sqm.in', fpre + '_small_sqm.out'])
+        write_sqm_optf(fpre + '_small_sqm.in', smchg, gatms)
         if SpinNum == 1:
             print("Performing SQM optimization of small model, please wait...")
             #Run SQM to optimize the coordinates
-            os.system("sqm -i %s -o %s" %(siopf, soopf))
-            gatms2 = get_crdinfo_from_sqm(soopf)
+            subprocess.call("sqm -i %s -o %s" %(siopf, soopf), shell=True,
+                            cwd=workdir)
+            gatms2 = get_crdinfo_from_sqm(fpre + '_small_sqm.out')
             write_gau_optf(outf, goptf, smchg, SpinNum, gatms2, 4)
             write_gms_optf(goptf2, smchg, SpinNum, gatms2, 4)
         else:
@@ -1273,11 +1253,11 @@ def build_small_model(mol, reslist, smresids, smresace, smresnme,
 
 #------------------------------------Standard model---------------------------
 def build_standard_model(mol, reslist, cutoff, msresids, outf, ionids,
-                         bdedatms, libdict, autoattyp):
+                         bdedatms, libdict, autoattyp, workdir='.'):
 
     #Standard model file
-    stf = outf + '_standard.pdb'
-    stpf = outf + '_standard.fingerprint'
+    stf = os.path.join(workdir, outf + '_standard.pdb')
+    stpf = os.path.join(workdir, outf + '_standard.fingerprint')
     del_files([stf, stpf])
 
     #-------------------------------------------------------------------------
@@ -1286,6 +1266,10 @@ def build_standard_model(mol, reslist, cutoff, msresids, outf, ionids,
 
     print("***Creating the standard model...")
 
+    #The model files are written at the end
+    stw = BufferedWriter(stf)
+    stpw = BufferedWriter(stpf)
+
     for i in msresids:
         print("It contains the residue " + str(i) + '-' + \
               mol.residues[i].resname + " as normal.")
@@ -1321,8 +1305,7 @@ def build_standard_model(mol, reslist, cutoff, msresids, outf, ionids,
             atmi = pdbatm(tiker, atid, atname, resname, chainid, resid,
                           crdx, crdy, crdz, occp, tempfac)
 
-            writepdbatm(atmi, stf)
-            stpff = open(stpf, 'a')
+            writepdbatm(atmi, stw)
 
             #assign new atom types to atoms inside the metal site
             attype2 = attype
@@ -1365,18 +1348,17 @@ def build_standard_model(mol, reslist, cutoff, msresids, outf, ionids,
                         attype2 = 'B' + str(k7)
 
             print(str(resid) + '-' + resname + '-' + atname,
-                  str(atid), attype, '->', attype2, file=stpff)
-            stpff.close()
+                  str(atid), attype, '->', attype2, file=stpw)
 
     #Print the link information into small fingerprint file
-    stpff = open(stpf, 'a')
     for met in ionids:
         for i in bdedatms:
             dis = calc_bond(mol.atoms[met].crd, mol.atoms[i].crd)
             if (dis <= cutoff):
                 print("LINK", str(met)+'-'+mol.atoms[met].atname,
-                      str(i)+'-'+mol.atoms[i].atname, file=stpff)
-    stpff.close()
+                      str(i)+'-'+mol.atoms[i].atname, file=stpw)
+    stw.close()
+    stpw.close()
 
     ln = count_lines(stf)
     print("Totally there are " + str(ln) + " atoms in the standard model.")
@@ -1384,13 +1366,18 @@ def build_standard_model(mol, reslist, cutoff, msresids, outf, ionids,
 #---------------------------------Large model---------------------------------
 def build_large_model(mol, reslist, lmsresids, lmsresace, lmsresnme,
                       lmsresgly, ionids, chargedict, lgchg, outf,
-                      watermodel, largeopt, sqmopt):
+                      watermodel, largeopt, sqmopt, workdir='.'):
+
+    #The model files are written in workdir
+    fpre = os.path.join(workdir, outf)
 
     #Large model file
-    lgpdbf = outf + '_large.pdb'
-    lfpf = outf + '_large.fingerprint'
-    gmkf = outf + '_large_mk.com'
-    gmsf = outf + '_large_mk.inp'
+    lgpdbf = fpre + '_large.pdb'
+    lfpf = fpre + '_large.fingerprint'
+    gmkf = fpre + '_large_mk.com'
+    gmsf = fpre + '_large_mk.inp'
+
+    #SQM, which is run in workdir
     simkf = outf + '_large_sqm.in'
     somkf = outf + '_large_sqm.out'
     del_files([lgpdbf, lfpf, gmkf])
@@ -1401,19 +1388,24 @@ def build_large_model(mol, reslist, lmsresids, lmsresace, lmsresnme,
 
     print("***Creating the large model...")
     gatms = []
+    lgpdbw = BufferedWriter(lgpdbf) #Written at the end
+    lfpw = BufferedWriter(lfpf)
     for i in lmsresids:
         #1) for atoms in ACE ---------------------------------------------------
         if i in lmsresace:
-            write_ace(mol, i, gatms, lgpdbf, lfpf)
+            write_ace(mol, i, gatms, lgpdbw, lfpw)
         #2) for atoms in NME ---------------------------------------------------
         elif i in lmsresnme:
-            write_nme(mol, i, gatms, lgpdbf, lfpf)
+            write_nme(mol, i, gatms, lgpdbw, lfpw)
         #3) for atoms in GLY ---------------------------------------------------
         elif i in lmsresgly:
-            write_gly(mol, i, gatms, lgpdbf, lfpf)
+            write_gly(mol, i, gatms, lgpdbw, lfpw)
         #4) for atoms in other residues ----------------------------------------
         else:
-            write_normal(mol, reslist, i, gatms, lgpdbf, lfpf)
+            write_normal(mol, reslist, i, gatms, lgpdbw, lfpw)
+
+    lgpdbw.close()
+    lfpw.close()
 
     ln = count_lines(lgpdbf)
     print("Totally there are " + str(ln) + " atoms in the large model.")
@@ -1447,12 +1439,13 @@ def build_large_model(mol, reslist, lmsresids, lmsresace, lmsresnme,
     # Doing SQM Optimization
     #-------------------------------------------------------------------------
     if (sqmopt == 2) or (sqmopt == 3):
-        del_files([simkf, somkf])
-        write_sqm_optf(simkf, lgchg, gatms)
+        del_files([fpre + '_large_sqm.in', fpre + '_large_sqm.out'])
+        write_sqm_optf(fpre + '_large_sqm.in', lgchg, gatms)
         if SpinNum == 1:
             print("Performing SQM optimization of large model, please wait...")
-            os.system("sqm -i %s -o %s" %(simkf, somkf))
-            gatms2 = get_crdinfo_from_sqm(somkf)
+            subprocess.call("sqm -i %s -o %s" %(simkf, somkf), shell=True,
+                            cwd=workdir)
+            gatms2 = get_crdinfo_from_sqm(fpre + '_large_sqm.out')
             write_gau_mkf(outf, gmkf, lgchg, SpinNum, gatms, ionnames,
                           chargedict, IonLJParaDict, largeopt, 4)
             write_gms_mkf(gmsf, lgchg, SpinNum, gatms2, 4)
@@ -1461,7 +1454,8 @@ def build_large_model(mol, reslist, lmsresids, lmsresace, lmsresnme,
                   "with spin number not equal to 1.")
 
 def gene_model_files(pdbfile, ionids, addres, addbpairs, outf, ffchoice, naamol2f, cutoff, \
-                     watermodel, autoattyp, largeopt, sqmopt, smchg, lgchg):
+                     watermodel, autoattyp, largeopt, sqmopt, smchg, lgchg,
+                     workdir='.'):
 
     mol, atids, resids = get_atominfo_fpdb(pdbfile)
 
@@ -1658,7 +1652,7 @@ def gene_model_files(pdbfile, ionids, addres, addbpairs, outf, ffchoice, naamol2
     smresids = list(set(smresids))
     smresids.sort()
 
-    smresf = outf + '_small.res'
+    smresf = os.path.join(workdir, outf + '_small.res')
 
     w_smresf = open(smresf, 'w')
     for i in smresace:
@@ -1736,13 +1730,15 @@ def gene_model_files(pdbfile, ionids, addres, addbpairs, outf, ffchoice, naamol2
     print("******************************************************************")
 
     build_small_model(mol, reslist, smresids, smresace, smresnme, smresgly,
-                   smresant, smresact, smresknh, smreskco, smchg, outf, sqmopt)
+                   smresant, smresact, smresknh, smreskco, smchg, outf, sqmopt,
+                   workdir)
 
     build_standard_model(mol, reslist, cutoff, msresids, outf, ionids,
-                         bdedatms, libdict, autoattyp)
+                         bdedatms, libdict, autoattyp, workdir)
 
     build_large_model(mol, reslist, lmsresids, lmsresace, lmsresnme, lmsresgly,
-              ionids, chargedict, lgchg, outf, watermodel, largeopt, sqmopt)
+              ionids, chargedict, lgchg, outf, watermodel, largeopt, sqmopt,
+              workdir)
 
     #Using the automatically detect bond method for the backup
     #else:
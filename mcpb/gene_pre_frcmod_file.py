@@ -34,7 +34,7 @@ def seq_imp(imp):
     return new_imp
 
 def gene_pre_frcmod_file(ionids, naamol2f, stpdbf, stfpf, smresf, prefcdf,
-                         ffchoice, gaff, frcmodfs, watermodel):
+                         ffchoice, gaff, frcmodfs, watermodel, workdir='.'):
 
     print("******************************************************************")
     print("*                                                                *")
@@ -110,6 +110,7 @@ def gene_pre_frcmod_file(ionids, naamol2f, stpdbf, stfpf, smresf, prefcdf,
 
     #-------------------------------------------------------------------------
 
+    prefcdf = os.path.join(workdir, prefcdf)
     fmf = open(prefcdf, 'w')
 
     #for atoms which changed atom types
@@ -530,7 +531,13 @@ def gene_pre_frcmod_file(ionids, naamol2f, stpdbf, stfpf, smresf, prefcdf,
     fmf.close()
     #--------------------------------------------------------------------------
 
-    #Move the file, delete the repeat parts
-    os.system("mv %s temp" %prefcdf)
-    os.system("uniq temp > %s" %prefcdf)
-    os.system("rm temp")
+    #Delete the repeat parts, as uniq does for the adjacent same lines
+    fmf = open(prefcdf, 'r')
+    lines = fmf.readlines()
+    fmf.close()
+
+    fmf = open(prefcdf, 'w')
+    for i in range(0, len(lines)):
+        if (i == 0) or (lines[i] != lines[i-1]):
+            fmf.write(lines[i])
+    fmf.close()
@@ -12,6 +12,7 @@ from msmtmol.gmsio import get_esp_from_gms
 from lib.lib import get_lib_dict
 from pymsmtexp import *
 import os
+import subprocess
 
 def read_resp_file(fname):
     chgs = []
@@ -26,7 +27,7 @@ def read_resp_file(fname):
     return chgs
 
 def print_mol2f(resid, resname1, resname2, resconter, mol, iddict1, sddict, \
-                stdict, blist_each):
+                stdict, blist_each, workdir='.'):
 
     #iddict1: atom id
     #mol: atname, crd
@@ -34,7 +35,7 @@ def print_mol2f(resid, resname1, resname2, resconter, mol, iddict1, sddict, \
     #stdict: atom charge
     #blist_each: bond information
 
-    mol2f = open(resname2 + '.mol2', 'w')
+    mol2f = open(os.path.join(workdir, resname2 + '.mol2'), 'w')
 
     print('***Generating the ' + resname2 + '.mol2 file...')
 
@@ -86,7 +87,7 @@ def get_equ_for_ang(mol, angresids, resids, iddict):
     gly1st = 0
 
     for resid in resids:
-        if (resid in angresids) and (mol.residues[i].resname == 'ACE'):
+        if (resid in angresids) and (mol.residues[resid].resname == 'ACE'):
             if ace1st < 1:
             #get the ids in the first ACE group
                 for j in mol.residues[resid].resconter:
@@ -104,7 +105,7 @@ def get_equ_for_ang(mol, angresids, resids, iddict):
                     elif (atname in ['HH32', 'HH33']):
                         iddict[j] = (iddict[j][0], iddict[j][1], acedict['HH31'])
             ace1st = ace1st + 1
-        elif (resid in angresids) and (mol.residues[i].resname == 'NME'):
+        elif (resid in angresids) and (mol.residues[resid].resname == 'NME'):
             if nme1st < 1:
             #get the ids in the first ACE group
                 for j in mol.residues[resid].resconter:
@@ -123,7 +124,7 @@ def get_equ_for_ang(mol, angresids, resids, iddict):
                         iddict[j] = (iddict[j][0], iddict[j][1], nmedict['HH31'])
             nme1st = nme1st + 1
         #for GLY residues
-        elif (resid in angresids) and (mol.residues[i].resname == 'GLY'):
+        elif (resid in angresids) and (mol.residues[resid].resname == 'GLY'):
             if gly1st < 1:
             #get the ids of the first GLY group
                 for j in mol.residues[resid].resconter:
@@ -142,7 +143,7 @@ def get_equ_for_ang(mol, angresids, resids, iddict):
                         iddict[j] = (iddict[j][0], iddict[j][1], glydict['HA2'])
             gly1st = gly1st + 1
 
-def frozen_ang(mol, angresids):
+def frozen_ang(mol, angresids, iddict):
     ##forzen the CH2 and CH3 groups in ACE, NME and GLY
     for i in angresids:
         if mol.residues[i].resname == 'ACE':
@@ -268,7 +269,7 @@ def add_restriction(frespin, libdict, mol, resids, reslist, mcresids, bnoresids,
     fresp.close()
 
 def gene_resp_input_file(lgpdbf, ionids, stfpf, ffchoice, mol2fs,
-                         chgmod, fixchg_resids, lgchg):
+                         chgmod, fixchg_resids, lgchg, workdir='.'):
 
     libdict, chargedict = get_lib_dict(ffchoice)
 
@@ -337,7 +338,8 @@ def gene_resp_input_file(lgpdbf, ionids, stfpf, ffchoice, mol2fs,
     print("***Generating the 1st stage resp charge fitting input file...")
 
     #print the 1st part, the title
-    fresp1 = open('resp1.in', 'w')
+    frespin1 = os.path.join(workdir, 'resp1.in')
+    fresp1 = open(frespin1, 'w')
     print("Resp charges for organic molecule", file=fresp1)
     print(" ", file=fresp1)
     print(" &cntrl", file=fresp1)
@@ -382,7 +384,7 @@ def gene_resp_input_file(lgpdbf, ionids, stfpf, ffchoice, mol2fs,
         #  print >> fresp1, "%4s" %iddict[i][2]
     fresp1.close()
 
-    add_restriction('resp1.in', libdict, mol, resids, reslist, mcresids,
+    add_restriction(frespin1, libdict, mol, resids, reslist, mcresids,
                     bnoresids, angresids, iddict, chgmod, fixchg_resids)
 
     #-------------------------------------------------------------------------
@@ -391,7 +393,8 @@ def gene_resp_input_file(lgpdbf, ionids, stfpf, ffchoice, mol2fs,
     print("***Generating the 2nd stage resp charge fitting input file...")
 
     #1. print the 1st part, the title------------------------------------------
-    fresp2 = open('resp2.in', 'w')
+    frespin2 = os.path.join(workdir, 'resp2.in')
+    fresp2 = open(frespin2, 'w')
     print("Resp charges for organic molecule", file=fresp2)
     print(" ", file=fresp2)
     print(" &cntrl", file=fresp2)
@@ -414,11 +417,12 @@ def gene_resp_input_file(lgpdbf, ionids, stfpf, ffchoice, mol2fs,
         print("%4s" %iddict[i][2], file=fresp2)
     fresp2.close()
 
-    add_restriction('resp2.in', libdict, mol, resids, reslist, mcresids,
+    add_restriction(frespin2, libdict, mol, resids, reslist, mcresids,
                     bnoresids, angresids, iddict, chgmod, fixchg_resids)
 
 def resp_fitting(stpdbf, lgpdbf, stfpf, lgfpf, mklogf, ionids,\
-           ffchoice, mol2fs, metcenres2, chgmod, fixchg_resids, g0x, lgchg):
+           ffchoice, mol2fs, metcenres2, chgmod, fixchg_resids, g0x, lgchg,
+           workdir='.'):
 
     print("******************************************************************")
     print("*                                                                *")
@@ -427,7 +431,7 @@ def resp_fitting(stpdbf, lgpdbf, stfpf, lgfpf, mklogf, ionids,\
     print("******************************************************************")
 
     gene_resp_input_file(lgpdbf, ionids, stfpf, ffchoice, mol2fs,
-                         chgmod, fixchg_resids, lgchg)
+                         chgmod, fixchg_resids, lgchg, workdir)
 
     #-------------------------------------------------------------------------
     ####################RESP charge fitting###################################
@@ -435,17 +439,18 @@ def resp_fitting(stpdbf, lgpdbf, stfpf, lgfpf, mklogf, ionids,\
 
     print('***Doing the RESP charge fiting...')
 
-    espf = mklogf.strip('.log') + '.esp'
+    #The esp file and the resp files are in workdir, where resp is run
+    espf = os.path.basename(mklogf).strip('.log') + '.esp'
 
     if g0x in ['g03', 'g09']:
-        get_esp_from_gau(mklogf, espf)
+        get_esp_from_gau(mklogf, os.path.join(workdir, espf))
     elif g0x == 'gms':
-        get_esp_from_gms(mklogf, espf)
+        get_esp_from_gms(mklogf, os.path.join(workdir, espf))
 
-    os.system("resp -O -i resp1.in -o resp1.out -p resp1.pch -t resp1.chg \
-               -e %s -s resp1_calc.esp" %espf)
-    os.system("resp -O -i resp2.in -o resp2.out -p resp2.pch -q resp1.chg \
-              -t resp2.chg -e %s -s resp2_calc.esp" %espf)
+    subprocess.call("resp -O -i resp1.in -o resp1.out -p resp1.pch -t resp1.chg \
+               -e %s -s resp1_calc.esp" %espf, shell=True, cwd=workdir)
+    subprocess.call("resp -O -i resp2.in -o resp2.out -p resp2.pch -q resp1.chg \
+              -t resp2.chg -e %s -s resp2_calc.esp" %espf, shell=True, cwd=workdir)
 
     #-------------------------------------------------------------------------
     ####################Collecting the atom type and charge data##############
@@ -465,7 +470,7 @@ def resp_fitting(stpdbf, lgpdbf, stfpf, lgfpf, mklogf, ionids,\
     r_stfpf.close()
 
     #------------Charge-------------
-    chgs = read_resp_file('resp2.chg')
+    chgs = read_resp_file(os.path.join(workdir, 'resp2.chg'))
 
     metcenres1 = [] #original name of the metal center residue
     stlist = [] #get the atom name list from the standard model
@@ -578,4 +583,4 @@ def resp_fitting(stpdbf, lgpdbf, stfpf, lgfpf, mklogf, ionids,\
                 blist_each.append((iddict1[k[0]], iddict1[k[1]]))
 
         print_mol2f(resids[i], resname1, resname2, resconter, mol, iddict1, \
-                    sddict, stdict, blist_each)
+                    sddict, stdict, blist_each, workdir)
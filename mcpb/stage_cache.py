@@ -0,0 +1,266 @@
+"""
+This module was written for the content-addressed cache of the MCPB.py
+stages. Each stage computes a hash of its exact inputs (input variables,
+the PDB atoms involved, the force field files and the program version) and
+the output files of the stage are stored in a local cache under that hash,
+so that a stage with identical inputs is served from the cache instead of
+being recomputed.
+
+Layout of the cache directory:
+  * objects/ab/abcdef... : output file contents, named by their sha256 hash
+  * stages/<key>         : one manifest per stage, a line per output file
+                           with "sha256 size file_name"
+  * stats                : counters of the cache hits, misses and stores
+"""
+from __future__ import absolute_import, print_function
+from msmtmol.readpdb import get_atominfo_fpdb
+from msmtmol.readcif import is_cif_file
+from mcpb.gene_model_files import get_ms_resids
+from msmtmol.filehash import hash_file
+from pymsmtexp import *
+import hashlib
+import os
+import shutil
+import time
+
+CACHE_FORMAT = '1'
+
+#-----------------------------------------------------------------------------
+# Hash of the stage inputs
+#-----------------------------------------------------------------------------
+
+def get_pdb_records(pdbfile, resids=None):
+    """Get the ATOM/HETATM records of a PDB file, the header and remark
+       lines do not change the results of the stages so they are skipped.
+       If resids is given, only the records of these residues are kept."""
+
+    records = []
+    fp = open(pdbfile, 'r')
+    for line in fp:
+        if (line[0:4] == "ATOM") or (line[0:6] == "HETATM"):
+            if (resids is None) or (int(line[22:26]) in resids):
+                records.append(line.rstrip())
+    fp.close()
+    return records
+
+def get_site_pdb_records(pdbfile, ionids, cutoff, addres, addbpairs):
+    """Get the PDB records of the atoms involved in modeling the metal site:
+       the residues from the one before the first metal site residue to the
+       one after the last metal site residue, which covers the ACE, NME and
+       GLY caps of the small and large models."""
+
+    mol, atids, resids = get_atominfo_fpdb(pdbfile)
+    msresids, metresids = get_ms_resids(mol, atids, ionids, cutoff, addres,
+                                        addbpairs)
+    siteresids = set(range(min(msresids)-1, max(msresids)+2))
+    records = ['MSRESIDS ' + ' '.join([str(i) for i in msresids])]
+    if is_cif_file(pdbfile):
+        #The residues of an mmCIF file are numbered when it is read
+        for i in sorted(siteresids):
+            if i not in mol.residues:
+                continue
+            for j in mol.residues[i].resconter:
+                atm = mol.atoms[j]
+                records.append('%s %d %s %s %d %.3f %.3f %.3f' %(atm.gtype,
+                               j, atm.atname, atm.resname, i, atm.crd[0],
+                               atm.crd[1], atm.crd[2]))
+    else:
+        records = records + get_pdb_records(pdbfile, siteresids)
+    return records
+
+def get_stage_key(stage, version, fields, fnames=[], records=[]):
+    """Get the content hash of the inputs of one stage.
+       stage   : stage name, e.g. '1a', '2s'
+       version : program version string
+       fields  : list of (name, value) of the input variables used
+       fnames  : input files which are hashed by their contents
+       records : additional lines (e.g. the PDB atoms involved)"""
+
+    sha = hashlib.sha256()
+
+    def add(item):
+        sha.update((item + '\n').encode('utf-8'))
+
+    add('FORMAT ' + CACHE_FORMAT)
+    add('STAGE ' + stage)
+    add('VERSION ' + version)
+    for name, value in fields:
+        add('FIELD %s %r' %(name, value))
+    for fname in fnames:
+        if not os.path.exists(fname):
+            raise pymsmtError('Input file %s of step %s does not exist.'
+                              %(fname, stage))
+        add('FILE %s %s' %(os.path.basename(fname), hash_file(fname)))
+    for line in records:
+        add(line)
+
+    return sha.hexdigest()
+
+#-----------------------------------------------------------------------------
+# Cache of the stage outputs
+#-----------------------------------------------------------------------------
+
+def makedirs(dname):
+    if not os.path.isdir(dname):
+        try:
+            os.makedirs(dname)
+        except OSError:
+            if not os.path.isdir(dname):
+                raise
+
+class StageCache:
+
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        self.objdir = os.path.join(cachedir, 'objects')
+        self.stgdir = os.path.join(cachedir, 'stages')
+        self.statf = os.path.join(cachedir, 'stats')
+        makedirs(self.objdir)
+        makedirs(self.stgdir)
+
+    def get_objf(self, sha):
+        return os.path.join(self.objdir, sha[0:2], sha[2:])
+
+    def get_stgf(self, key):
+        return os.path.join(self.stgdir, key)
+
+    def read_stats(self):
+        stats = {'hits': 0, 'misses': 0, 'stores': 0}
+        if os.path.exists(self.statf):
+            fp = open(self.statf, 'r')
+            for line in fp:
+                line = line.split()
+                if len(line) == 2:
+                    stats[line[0]] = int(line[1])
+            fp.close()
+        return stats
+
+    def count(self, name):
+        stats = self.read_stats()
+        stats[name] = stats[name] + 1
+        tmpf = self.statf + '.%d' %os.getpid()
+        w_statf = open(tmpf, 'w')
+        for i in sorted(stats.keys()):
+            print(i, stats[i], file=w_statf)
+        w_statf.close()
+        os.rename(tmpf, self.statf)
+
+    def read_manifest(self, key):
+        outfs = []
+        fp = open(self.get_stgf(key), 'r')
+        for line in fp:
+            line = line.split(None, 2)
+            if len(line) == 3:
+                outfs.append((line[0], int(line[1]), line[2].rstrip('\n')))
+        fp.close()
+        return outfs
+
+    def fetch(self, key, workdir='.'):
+        """Copy the cached output files of a stage into the working
+           directory, return True if the stage is in the cache."""
+
+        stgf = self.get_stgf(key)
+        if not os.path.exists(stgf):
+            self.count('misses')
+            return False
+
+        outfs = self.read_manifest(key)
+        for sha, size, fname in outfs:
+            objf = self.get_objf(sha)
+            if (not os.path.exists(objf)) or \
+               (os.path.getsize(objf) != size):
+                self.count('misses')
+                return False
+
+        for sha, size, fname in outfs:
+            print('Restoring %s from the cache...' %fname)
+            shutil.copyfile(self.get_objf(sha), os.path.join(workdir, fname))
+
+        #Record the time of the last use for the garbage collection
+        os.utime(stgf, None)
+        self.count('hits')
+        return True
+
+    def store(self, key, fnames, since=0.0, workdir='.'):
+        """Store the output files of a stage in the cache, the files which
+           were not generated by the stage (not existing or not modified
+           since the stage started at time since) are skipped."""
+
+        outfs = []
+        for fname in fnames:
+            fname2 = os.path.join(workdir, fname)
+            if (not os.path.exists(fname2)) or \
+               (os.path.getmtime(fname2) < since):
+                continue
+            sha = hash_file(fname2)
+            objf = self.get_objf(sha)
+            if not os.path.exists(objf):
+                makedirs(os.path.dirname(objf))
+                tmpf = objf + '.%d' %os.getpid()
+                shutil.copyfile(fname2, tmpf)
+                os.rename(tmpf, objf)
+            outfs.append((sha, os.path.getsize(objf), fname))
+
+        stgf = self.get_stgf(key)
+        tmpf = stgf + '.%d' %os.getpid()
+        w_stgf = open(tmpf, 'w')
+        for sha, size, fname in outfs:
+            print(sha, size, fname, file=w_stgf)
+        w_stgf.close()
+        os.rename(tmpf, stgf)
+        self.count('stores')
+
+    def get_keys(self):
+        return [i for i in os.listdir(self.stgdir) if '.' not in i]
+
+    def get_objs(self):
+        objs = []
+        for i in os.listdir(self.objdir):
+            for j in os.listdir(os.path.join(self.objdir, i)):
+                if '.' not in j:
+                    objs.append(i + j)
+        return objs
+
+    def print_stats(self):
+        stats = self.read_stats()
+        objs = self.get_objs()
+        size = sum([os.path.getsize(self.get_objf(i)) for i in objs])
+        looks = stats['hits'] + stats['misses']
+        print("The cache directory is : %s" %self.cachedir)
+        print("Number of cached stages : %d" %len(self.get_keys()))
+        print("Number of cached files : %d" %len(objs))
+        print("Size of the cached files : %.2f MB" %(size/1048576.0))
+        print("Cache hits : %d" %stats['hits'])
+        print("Cache misses : %d" %stats['misses'])
+        print("Cache stores : %d" %stats['stores'])
+        if looks > 0:
+            print("Hit rate : %.1f%%" %(100.0*stats['hits']/looks))
+
+    def gc(self, maxage):
+        """Delete the stages which were not used in the last maxage days
+           and the cached files which no stage refers to."""
+
+        now = time.time()
+        nstg = 0
+        for key in self.get_keys():
+            stgf = self.get_stgf(key)
+            if now - os.path.getmtime(stgf) > maxage * 86400.0:
+                os.remove(stgf)
+                nstg = nstg + 1
+
+        used = set()
+        for key in self.get_keys():
+            for sha, size, fname in self.read_manifest(key):
+                used.add(sha)
+
+        nobj = 0
+        size = 0
+        for sha in self.get_objs():
+            if sha not in used:
+                objf = self.get_objf(sha)
+                size = size + os.path.getsize(objf)
+                os.remove(objf)
+                nobj = nobj + 1
+
+        print("Removed %d stages and %d files (%.2f MB) from the cache."
+              %(nstg, nobj, size/1048576.0))
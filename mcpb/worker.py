@@ -0,0 +1,600 @@
+"""
+This module was written for running MCPB.py as a long-lived worker service.
+The service starts a pool of worker processes once, each worker preloads the
+modules and the force field library and parameter files, and then runs the
+MCPB.py steps of the submitted jobs in-process, so that a small job does not
+pay the interpreter start-up, the imports and the force field file parsing.
+
+The jobs are submitted by a directory-based queue or a local socket:
+  1) Queue: a job file <name>.job is put into the incoming directory of the
+     queue directory, it is moved to the running directory when it is taken
+     and to the done or failed directory when it is finished, together with
+     a <name>.result file.
+  2) Socket: a TCP socket on 127.0.0.1, each request and reply is one line of
+     JSON, the requests are submit, status, stats and shutdown.
+The job file and the submit request have the same JSON format:
+  {"dir": job_directory, "input": input_file, "steps": ["1", "2s", ...]}
+The input file path is relative to the job directory, which is the working
+directory of MCPB.py.
+"""
+from __future__ import absolute_import, print_function
+from mcpb.batch import get_error_msg
+from lib.lib import FF_DICT, parmadd, get_lib_dict, get_parm_dict
+from pymsmtexp import *
+from multiprocessing import Pool, Queue
+import copy
+import json
+import lib.lib
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+#Sub-directories of the queue directory
+QUEUE_DIRS = ['incoming', 'running', 'done', 'failed']
+
+#Metrics file in the queue directory
+METRICS_FILE = 'metrics.json'
+
+class WorkerJob:
+    def __init__(self, jobid, jobdir, inputf, steps, jobf=None):
+        self.jobid = jobid
+        self.jobdir = jobdir
+        self.inputf = inputf
+        self.steps = steps
+        self.jobf = jobf #Job file in the queue, None for socket jobs
+        self.status = 'queued'
+        self.donesteps = []
+        self.failstep = ''
+        self.error = ''
+        self.submit = time.time()
+        self.start = 0.0
+        self.end = 0.0
+
+class WorkerService:
+    def __init__(self, mcpbf, queuedir, nproc=1, ffchoices=None,
+                 cachedir=None):
+        self.mcpbf = os.path.abspath(mcpbf)
+        self.queuedir = os.path.abspath(queuedir)
+        self.nproc = nproc
+        if ffchoices is None:
+            ffchoices = sorted(FF_DICT.keys())
+        self.ffchoices = ffchoices
+        if cachedir is not None:
+            cachedir = os.path.abspath(cachedir)
+        self.cachedir = cachedir
+        self.jobs = {}
+        self.order = [] #Job ids in the submit order
+        self.lock = threading.Lock()
+        self.startq = None
+        self.pool = None
+        self.server = None
+        self.stop = False
+        self.uptime = time.time()
+
+#-----------------------------------------------------------------------------
+# Worker process
+#-----------------------------------------------------------------------------
+
+#State of the worker process, set by init_worker
+_worker = {}
+
+#The readers of lib.lib which are cached in the worker processes
+CACHED_READERS = ['read_lib_file', 'read_dat_file', 'read_frcmod_file']
+
+def get_cached_reader(readfunc, files):
+    """Wrap a reader of the library or parameter files with the file cache
+       of the worker, a file is read again if its modification time or size
+       changes. A copy of the cached result is returned as the callers update
+       the returned objects."""
+    def read_cached(fname):
+        st = os.stat(fname)
+        key = (readfunc.__name__, os.path.abspath(fname), st.st_mtime,
+               st.st_size)
+        if key not in files:
+            files[key] = readfunc(fname)
+        return copy.deepcopy(files[key])
+    return read_cached
+
+def preload_ff(ffchoices):
+    """Read the library and parameter files of the force fields into the
+       file cache, the files which do not exist are skipped."""
+
+    nlib = 0
+    nparm = 0
+    for ff in ffchoices:
+        fffiles = FF_DICT[ff]
+        if os.path.exists(fffiles.mol2f):
+            get_lib_dict(ff)
+            nlib = nlib + 1
+        parmfs = [fffiles.datf] + fffiles.frcmodfs
+        if all([os.path.exists(i) for i in parmfs]):
+            try:
+                get_parm_dict(ff, 0, [])
+                nparm = nparm + 1
+            except Exception:
+                pass
+    for i in ['gaff.dat', 'gaff2.dat']:
+        if os.path.exists(parmadd + i):
+            try:
+                lib.lib.read_dat_file(parmadd + i)
+                nparm = nparm + 1
+            except Exception:
+                pass
+    return nlib, nparm
+
+def init_worker(mcpbf, ffchoices, startq):
+    """Initializer of the worker processes: import the modules used by
+       MCPB.py, compile MCPB.py and preload the force field files."""
+
+    _worker['startq'] = startq
+    _worker['mcpbf'] = mcpbf
+    _worker['code'] = compile(open(mcpbf, 'r').read(), mcpbf, 'exec',
+                              0, True)
+
+    #Modules imported by MCPB.py and the optional ones used by the tools
+    import mcpb.gene_model_files
+    import mcpb.resp_fitting
+    import mcpb.gene_pre_frcmod_file
+    import mcpb.gene_final_frcmod_file
+    import mcpb.amber_modeling
+    import mcpb.stage_cache
+    for mod in ['parmed', 'scipy.optimize']:
+        try:
+            __import__(mod)
+        except ImportError:
+            pass
+
+    #The file cache only lives in the worker processes, the readers of
+    #lib.lib are replaced by the cached ones in this process
+    _worker['files'] = {}
+    for name in CACHED_READERS:
+        setattr(lib.lib, name, get_cached_reader(getattr(lib.lib, name),
+                                                 _worker['files']))
+    _worker['preload'] = preload_ff(ffchoices)
+
+def run_mcpb_step(jobdir, inputf, step, cachedir, logf):
+    """Run one step of MCPB.py in this process, with the job directory as the
+       working directory and the output redirected into the log file.
+       Return True if the step finished without error."""
+
+    argv = [_worker['mcpbf'], '-i', inputf, '-s', step]
+    if cachedir is not None:
+        argv = argv + ['--cache', cachedir]
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+    w_logf = open(logf, 'w')
+    #Redirect the file descriptors, so the output of the external programs
+    #called by MCPB.py is in the log file too
+    oldout = os.dup(1)
+    olderr = os.dup(2)
+    os.dup2(w_logf.fileno(), 1)
+    os.dup2(w_logf.fileno(), 2)
+    oldargv = sys.argv
+    olddir = os.getcwd()
+    globs = {'__name__': '__main__', '__file__': _worker['mcpbf']}
+    ok = True
+    try:
+        os.chdir(jobdir)
+        sys.argv = argv
+        exec(_worker['code'], globs)
+    except SystemExit as e:
+        if e.code not in [None, 0]:
+            ok = False
+    except BaseException:
+        traceback.print_exc()
+        ok = False
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        sys.argv = oldargv
+        os.chdir(olddir)
+        os.dup2(oldout, 1)
+        os.dup2(olderr, 2)
+        os.close(oldout)
+        os.close(olderr)
+        w_logf.close()
+    return ok
+
+def run_job(args):
+    """Run the steps of a job in the worker process, return the result."""
+
+    jobid, jobdir, inputf, steps, cachedir = args
+
+    start = time.time()
+    status = 'done'
+    donesteps = []
+    failstep = ''
+    error = ''
+    step = 'setup'
+    #The job is always finished with a result, even if the worker fails
+    #outside of MCPB.py (e.g. the log file can not be written)
+    try:
+        _worker['startq'].put((jobid, start))
+        if not os.path.isdir(jobdir):
+            status = 'failed'
+            failstep = 'setup'
+            error = 'Job directory %s does not exist.' %jobdir
+        else:
+            for step in steps:
+                logf = os.path.join(jobdir, 'MCPB_step%s.log' %step)
+                if not run_mcpb_step(jobdir, inputf, step, cachedir, logf):
+                    status = 'failed'
+                    failstep = step
+                    error = get_error_msg(logf)
+                    break
+                donesteps.append(step)
+    except Exception as e:
+        status = 'failed'
+        failstep = step
+        error = '%s: %s' %(type(e).__name__, e)
+
+    return jobid, status, donesteps, failstep, error, start, time.time()
+
+#-----------------------------------------------------------------------------
+# Job submission and results
+#-----------------------------------------------------------------------------
+
+def check_request(req):
+    """Check a job request and return the job directory, input file and
+       steps of it."""
+
+    if not isinstance(req, dict):
+        raise pymsmtError('The job request should be a JSON object.')
+    for key in ['dir', 'input', 'steps']:
+        if key not in req:
+            raise pymsmtError('The job request does not have the %s key.'
+                              %key)
+    steps = req['steps']
+    if not isinstance(steps, list):
+        steps = str(steps).replace(',', ' ').split()
+    steps = [str(i).lower() for i in steps]
+    if not steps:
+        raise pymsmtError('The job request does not have any step.')
+    return os.path.abspath(req['dir']), req['input'], steps
+
+def submit_job(service, jobdir, inputf, steps, name=None, jobf=None):
+    """Add a job to the service and send it to the worker pool, return the
+       job id."""
+
+    service.lock.acquire()
+    try:
+        if name is None:
+            name = 'job%d' %(len(service.order) + 1)
+        jobid = name
+        i = 2
+        while jobid in service.jobs:
+            jobid = name + '_' + str(i)
+            i = i + 1
+        job = WorkerJob(jobid, jobdir, inputf, steps, jobf)
+        service.jobs[jobid] = job
+        service.order.append(jobid)
+    finally:
+        service.lock.release()
+
+    service.pool.apply_async(run_job,
+                             ((jobid, jobdir, inputf, steps,
+                               service.cachedir),),
+                             callback=lambda res: finish_job(service, res))
+    return jobid
+
+def finish_job(service, result):
+    """Record the result of a finished job, which is called in the result
+       thread of the pool."""
+
+    jobid, status, donesteps, failstep, error, start, end = result
+
+    service.lock.acquire()
+    try:
+        job = service.jobs[jobid]
+        job.status = status
+        job.donesteps = donesteps
+        job.failstep = failstep
+        job.error = error
+        job.start = start
+        job.end = end
+    finally:
+        service.lock.release()
+
+    if job.jobf is not None:
+        write_job_result(service, job)
+    print("Job %s is %s (wait %.2f s, run %.2f s)." %(jobid, status,
+          start - job.submit, end - start))
+    sys.stdout.flush()
+
+def get_job_info(job):
+    info = {'id': job.jobid, 'dir': job.jobdir, 'input': job.inputf,
+            'steps': job.steps, 'status': job.status,
+            'donesteps': job.donesteps, 'failstep': job.failstep,
+            'error': job.error}
+    if job.start:
+        info['wait'] = round(job.start - job.submit, 3)
+    if job.end:
+        info['run'] = round(job.end - job.start, 3)
+        info['latency'] = round(job.end - job.submit, 3)
+    return info
+
+def drain_startq(service):
+    """Mark the jobs started by the workers as running."""
+    while True:
+        try:
+            jobid, start = service.startq.get_nowait()
+        except queue.Empty:
+            break
+        service.lock.acquire()
+        job = service.jobs[jobid]
+        if job.status == 'queued':
+            job.status = 'running'
+            job.start = start
+        service.lock.release()
+
+#-----------------------------------------------------------------------------
+# Metrics
+#-----------------------------------------------------------------------------
+
+def get_time_stats(vals):
+    """Mean, median, 95th percentile and maximum of a list of times."""
+    if not vals:
+        return {'n': 0}
+    vals = sorted(vals)
+    nval = len(vals)
+    return {'n': nval, 'mean': round(sum(vals)/nval, 3),
+            'p50': round(vals[(nval-1)//2], 3),
+            'p95': round(vals[int(0.95 * (nval-1))], 3),
+            'max': round(vals[-1], 3)}
+
+def get_stats(service):
+    """Queue depth, job counts and the wait, run and total latency of the
+       finished jobs."""
+
+    drain_startq(service)
+    service.lock.acquire()
+    jobs = [service.jobs[i] for i in service.order]
+    service.lock.release()
+
+    counts = {}
+    for i in ['queued', 'running', 'done', 'failed']:
+        counts[i] = len([j for j in jobs if j.status == i])
+    fjobs = [i for i in jobs if i.end]
+
+    stats = {'nproc': service.nproc,
+             'uptime': round(time.time() - service.uptime, 1),
+             'submitted': len(jobs),
+             'queue_depth': counts['queued'],
+             'running': counts['running'],
+             'done': counts['done'],
+             'failed': counts['failed'],
+             'wait': get_time_stats([i.start - i.submit for i in fjobs]),
+             'run': get_time_stats([i.end - i.start for i in fjobs]),
+             'latency': get_time_stats([i.end - i.submit for i in fjobs])}
+    return stats
+
+def write_metrics(service):
+    """Write the metrics into the metrics file of the queue directory."""
+    metricsf = os.path.join(service.queuedir, METRICS_FILE)
+    w_metf = open(metricsf + '.tmp', 'w')
+    json.dump(get_stats(service), w_metf, indent=1, sort_keys=True)
+    w_metf.close()
+    os.rename(metricsf + '.tmp', metricsf)
+
+#-----------------------------------------------------------------------------
+# Directory-based queue
+#-----------------------------------------------------------------------------
+
+def setup_queue_dir(queuedir):
+    """Create the queue directories. The job files left in the running
+       directory by a stopped service are put back into the queue."""
+
+    for i in QUEUE_DIRS:
+        qdir = os.path.join(queuedir, i)
+        if not os.path.isdir(qdir):
+            os.makedirs(qdir)
+
+    rundir = os.path.join(queuedir, 'running')
+    for fname in os.listdir(rundir):
+        if fname.endswith('.job'):
+            os.rename(os.path.join(rundir, fname),
+                      os.path.join(queuedir, 'incoming', fname))
+
+def poll_queue(service):
+    """Take the job files in the incoming directory, in the order of their
+       modification time, and submit them. Return the number of jobs."""
+
+    indir = os.path.join(service.queuedir, 'incoming')
+    fnames = [i for i in os.listdir(indir) if i.endswith('.job')]
+    fnames.sort(key=lambda i: (os.path.getmtime(os.path.join(indir, i)), i))
+
+    njob = 0
+    for fname in fnames:
+        jobf = os.path.join(service.queuedir, 'running', fname)
+        try:
+            #The job file is taken by moving it
+            os.rename(os.path.join(indir, fname), jobf)
+        except OSError:
+            continue
+        name = fname[:-4]
+        try:
+            fp = open(jobf, 'r')
+            req = json.load(fp)
+            fp.close()
+            jobdir, inputf, steps = check_request(req)
+        except Exception as e:
+            job = WorkerJob(name, '', '', [], jobf)
+            job.status = 'failed'
+            job.failstep = 'submit'
+            job.error = str(e)
+            write_job_result(service, job)
+            print("Job file %s is not valid: %s" %(fname, e))
+            continue
+        #The job directory is relative to the queue directory
+        if not os.path.isabs(req['dir']):
+            jobdir = os.path.join(service.queuedir, req['dir'])
+        submit_job(service, jobdir, inputf, steps, name, jobf)
+        njob = njob + 1
+    return njob
+
+def write_job_result(service, job):
+    """Move the job file to the done or failed directory and write the result
+       file beside it."""
+
+    if job.status == 'done':
+        resdir = os.path.join(service.queuedir, 'done')
+    else:
+        resdir = os.path.join(service.queuedir, 'failed')
+    fname = os.path.basename(job.jobf)
+    resf = os.path.join(resdir, fname[:-4] + '.result')
+    w_resf = open(resf, 'w')
+    json.dump(get_job_info(job), w_resf, indent=1, sort_keys=True)
+    w_resf.close()
+    os.rename(job.jobf, os.path.join(resdir, fname))
+
+def submit_to_queue(queuedir, jobdir, inputf, steps, name=None):
+    """Put a job file into the incoming directory of the queue directory,
+       return the job file name."""
+
+    indir = os.path.join(queuedir, 'incoming')
+    if not os.path.isdir(indir):
+        os.makedirs(indir)
+    if name is None:
+        name = 'job%d_%d' %(int(time.time() * 1000), os.getpid())
+    jobf = os.path.join(indir, name + '.job')
+    #Write it as a hidden file first, the service only takes *.job files
+    tmpf = os.path.join(indir, '.' + name + '.tmp')
+    w_jobf = open(tmpf, 'w')
+    json.dump({'dir': os.path.abspath(jobdir), 'input': inputf,
+               'steps': steps}, w_jobf)
+    w_jobf.close()
+    os.rename(tmpf, jobf)
+    return jobf
+
+#-----------------------------------------------------------------------------
+# Local socket
+#-----------------------------------------------------------------------------
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                reply = handle_request(service, json.loads(line))
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+            self.wfile.flush()
+
+def handle_request(service, req):
+    """Handle a request from the socket, return the reply."""
+
+    cmd = req.get('cmd', '')
+    if cmd == 'submit':
+        jobdir, inputf, steps = check_request(req)
+        jobid = submit_job(service, jobdir, inputf, steps, req.get('name'))
+        return {'ok': True, 'id': jobid}
+    elif cmd == 'status':
+        drain_startq(service)
+        service.lock.acquire()
+        job = service.jobs.get(req.get('id'))
+        service.lock.release()
+        if job is None:
+            raise pymsmtError('There is no job with id %s.' %req.get('id'))
+        return {'ok': True, 'job': get_job_info(job)}
+    elif cmd == 'stats':
+        return {'ok': True, 'stats': get_stats(service)}
+    elif cmd == 'shutdown':
+        service.stop = True
+        return {'ok': True}
+    else:
+        raise pymsmtError('Unknown request %s.' %cmd)
+
+def start_server(service, port):
+    """Start the socket server on 127.0.0.1 in a thread, return the port."""
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', port),
+                                             RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    service.server = server
+    return server.server_address[1]
+
+def send_request(port, req, timeout=60.0):
+    """Send a request to the service on the local port, return the reply."""
+
+    sock = socket.create_connection(('127.0.0.1', port), timeout)
+    try:
+        sock.sendall((json.dumps(req) + '\n').encode())
+        reply = b''
+        while not reply.endswith(b'\n'):
+            data = sock.recv(65536)
+            if not data:
+                break
+            reply = reply + data
+    finally:
+        sock.close()
+    if not reply:
+        raise pymsmtError('No reply from the MCPB.py worker service.')
+    return json.loads(reply.decode())
+
+#-----------------------------------------------------------------------------
+# Run the service
+#-----------------------------------------------------------------------------
+
+def start_service(service, port=None):
+    """Start the worker pool, the queue and the socket server, return the
+       port of the socket server or None."""
+
+    setup_queue_dir(service.queuedir)
+    service.startq = Queue()
+    service.pool = Pool(service.nproc, initializer=init_worker,
+                        initargs=(service.mcpbf, service.ffchoices,
+                                  service.startq))
+    if port is not None:
+        port = start_server(service, port)
+    return port
+
+def serve(service, interval=1.0):
+    """Poll the queue and update the metrics file until the service is
+       stopped by a shutdown request or a stop file in the queue directory.
+       The submitted jobs are finished before it returns."""
+
+    stopf = os.path.join(service.queuedir, 'stop')
+    try:
+        while not service.stop:
+            poll_queue(service)
+            write_metrics(service)
+            if os.path.exists(stopf):
+                os.remove(stopf)
+                service.stop = True
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Interrupted, the running jobs are terminated.")
+        service.pool.terminate()
+        service.pool.join()
+        write_metrics(service)
+        return
+
+    print("Stopping the service after the submitted jobs are finished...")
+    if service.server is not None:
+        service.server.shutdown()
+    service.pool.close()
+    service.pool.join()
+    write_metrics(service)
@@ -81,6 +81,32 @@ def calc_dih_fix(bond12, bond23, bond34, ang123, ang234):
     else:
         return "Error"
 
+##The functions for the arrays of bonds, angles and dihedrals, crds is an
+##(N, 3) array and ids is an (M, 2), (M, 3) or (M, 4) array of the indexes
+def calc_bonds(crds, ids):
+    vecs = crds[ids[:,0]] - crds[ids[:,1]]
+    return numpy.sqrt(numpy.sum(vecs**2, axis=1))
+
+def calc_angles(crds, ids):
+    #Use cosine law, as calc_angle
+    d12 = calc_bonds(crds, ids[:,[0, 1]])
+    d23 = calc_bonds(crds, ids[:,[1, 2]])
+    d13 = calc_bonds(crds, ids[:,[0, 2]])
+    tempval = (d23**2+d12**2-d13**2)/(2*d12*d23)
+    tempval = numpy.clip(tempval, -1.0, 1.0)
+    return numpy.degrees(numpy.arccos(tempval))
+
+def calc_dihs(crds, ids):
+    b1 = crds[ids[:,1]] - crds[ids[:,0]]
+    b2 = crds[ids[:,2]] - crds[ids[:,1]]
+    b3 = crds[ids[:,3]] - crds[ids[:,2]]
+    b12 = numpy.cross(b1, b2)
+    b23 = numpy.cross(b2, b3)
+    b2v = b2 / numpy.sqrt(numpy.sum(b2**2, axis=1))[:,None]
+    term1 = numpy.sum(numpy.cross(b12, b23) * b2v, axis=1)
+    term2 = numpy.sum(b12 * b23, axis=1)
+    return numpy.degrees(numpy.arctan2(term1, term2))
+
 def get_angles(metcrd, crds):
 
     angles = []
@@ -132,6 +132,16 @@ for i in METAL_PDB:
 ionnamel2 = [i[0] + i[1].upper() for i in ionnamel if len(i) > 1]
 ionnamel = ionnamel + ionnamel2
 
+def get_pdb_element(resname, atname):
+    """Element of an atom in a PDB or mmCIF file by its residue and atom
+       names."""
+    if (resname, atname) in METAL_PDB:
+        return METAL_PDB[(resname, atname)][0]
+    elif atname[0:2].upper() in ['CL', 'BR']:
+        return atname[0].upper() + atname[1].lower()
+    else:
+        return atname[0]
+
 #-----------------------------------------------------------------------------
 
 #Residue names and their letters
@@ -475,6 +485,8 @@ IonIODparal = list(set(IonLJparal) - \
 #-----------------------------------------------------------------------------
 Atnum = AtomicNum
 
-AtnumRev = dict([ (v, k) for k, v in list(Atnum.items())])
+#The isotopes (D and T) have the same atomic number as H
+AtnumRev = dict([ (v, k) for k, v in list(Atnum.items())
+                  if k not in ['D', 'T']])
 
 bdld = {'CH': 1.090, 'NH': 1.010}
@@ -0,0 +1,19 @@
+"""
+This module was written for the hash of the file contents, which is used by
+the manifest of PdbSearcher.py, the stage cache of MCPB.py and the objective
+function cache of OptC4.py to find the changed input files.
+"""
+from __future__ import absolute_import
+import hashlib
+
+def hash_file(fname):
+    """Get the sha256 hash of the content of a file."""
+    sha = hashlib.sha256()
+    fp = open(fname, 'rb')
+    while True:
+        block = fp.read(1048576)
+        if not block:
+            break
+        sha.update(block)
+    fp.close()
+    return sha.hexdigest()
@@ -0,0 +1,461 @@
+"""
+This module is for the molecular mechanics energy and gradient of a local
+region (e.g. a metal site) of an Amber topology, without OpenMM. The region is
+taken as an isolated system in the gas phase: the bonds, angles, dihedrals and
+impropers with all of their atoms in the region, and the 12-6(-4) LJ and
+Coulomb interactions (no cutoff) between the atoms of the region are
+calculated with NumPy arrays. The coordinates are in angstrom, the energies in
+kcal/mol and the gradients in kcal/(mol*angstrom).
+
+The parameters are copied from the topology when the region is built, and can
+then be changed with the C4 terms or an frcmod file (e.g. the one of MCPB.py),
+so that the energy of the same structure can be calculated with many sets of
+parameters in a short time.
+"""
+from __future__ import absolute_import, print_function
+from pymsmtexp import *
+import math
+import numpy
+
+SCEE = 1.2 #Default 1-4 electrostatic scaling factor
+SCNB = 2.0 #Default 1-4 van der Waals scaling factor
+CHARGE_SCALE = 18.2223 #Charge unit of Amber, sqrt(kcal/mol*A)
+
+ENE_TERMS = ['bond', 'angle', 'dihedral', 'improper', 'vdw', 'eel', 'vdw14',
+             'eel14']
+
+#------------------------------------------------------------------------------
+# The energy terms, ids are the index arrays of the atoms (starting from 0)
+# and grad is the gradient array which the gradients are added to (if it is
+# not None)
+#------------------------------------------------------------------------------
+
+def add_grad(grad, ids, vecs):
+    #Add the gradient of each atom in a term to the gradient array
+    for i in range(0, 3):
+        grad[:,i] += numpy.bincount(ids, vecs[:,i], minlength=len(grad))
+
+def calc_bond_ene(crds, ids, kbs, reqs, grad=None):
+    #E = k * (r - req)^2
+    vecs = crds[ids[:,0]] - crds[ids[:,1]]
+    dists = numpy.sqrt(numpy.sum(vecs**2, axis=1))
+    dr = dists - reqs
+    if grad is not None:
+        gvecs = (2.0 * kbs * dr / dists)[:,None] * vecs
+        add_grad(grad, ids[:,0], gvecs)
+        add_grad(grad, ids[:,1], -gvecs)
+    return numpy.sum(kbs * dr**2)
+
+def calc_angle_ene(crds, ids, kas, teqs, grad=None):
+    #E = k * (theta - theq)^2, the angles are in radian
+    vec1 = crds[ids[:,0]] - crds[ids[:,1]]
+    vec2 = crds[ids[:,2]] - crds[ids[:,1]]
+    d1 = numpy.sqrt(numpy.sum(vec1**2, axis=1))
+    d2 = numpy.sqrt(numpy.sum(vec2**2, axis=1))
+    coss = numpy.clip(numpy.sum(vec1 * vec2, axis=1) / (d1 * d2), -1.0, 1.0)
+    thetas = numpy.arccos(coss)
+    dtheta = thetas - teqs
+    if grad is not None:
+        sins = numpy.maximum(numpy.sqrt(1.0 - coss**2), 1.0e-8)
+        fac = -2.0 * kas * dtheta / sins
+        g1 = fac[:,None] * (vec2 / (d1 * d2)[:,None] -
+                            (coss / d1**2)[:,None] * vec1)
+        g3 = fac[:,None] * (vec1 / (d1 * d2)[:,None] -
+                            (coss / d2**2)[:,None] * vec2)
+        add_grad(grad, ids[:,0], g1)
+        add_grad(grad, ids[:,2], g3)
+        add_grad(grad, ids[:,1], -g1-g3)
+    return numpy.sum(kas * dtheta**2)
+
+def calc_dih_ene(crds, ids, pks, pns, phases, grad=None):
+    #E = pk * (1 + cos(pn * phi - phase)), the angles are in radian
+    b1 = crds[ids[:,1]] - crds[ids[:,0]]
+    b2 = crds[ids[:,2]] - crds[ids[:,1]]
+    b3 = crds[ids[:,3]] - crds[ids[:,2]]
+    m = numpy.cross(b1, b2)
+    n = numpy.cross(b2, b3)
+    b2v = numpy.sqrt(numpy.sum(b2**2, axis=1))
+    phis = numpy.arctan2(b2v * numpy.sum(b1 * n, axis=1),
+                         numpy.sum(m * n, axis=1))
+    angs = pns * phis - phases
+    if grad is not None:
+        dedphi = -pks * pns * numpy.sin(angs)
+        m2 = numpy.maximum(numpy.sum(m**2, axis=1), 1.0e-16)
+        n2 = numpy.maximum(numpy.sum(n**2, axis=1), 1.0e-16)
+        g1 = (-dedphi * b2v / m2)[:,None] * m
+        g4 = (dedphi * b2v / n2)[:,None] * n
+        p = (numpy.sum(b1 * b2, axis=1) / b2v**2)[:,None]
+        q = (numpy.sum(b3 * b2, axis=1) / b2v**2)[:,None]
+        g2 = -(p + 1.0) * g1 + q * g4
+        g3 = p * g1 - (q + 1.0) * g4
+        add_grad(grad, ids[:,0], g1)
+        add_grad(grad, ids[:,1], g2)
+        add_grad(grad, ids[:,2], g3)
+        add_grad(grad, ids[:,3], g4)
+    return numpy.sum(pks * (1.0 + numpy.cos(angs)))
+
+def calc_pair_ene(crds, ids, acoefs, bcoefs, ccoefs, qqs, grad=None):
+    #E(vdw) = A/r^12 - B/r^6 - C/r^4, E(eel) = qi*qj/r
+    vecs = crds[ids[:,0]] - crds[ids[:,1]]
+    r2 = numpy.sum(vecs**2, axis=1)
+    rinv2 = 1.0 / r2
+    rinv = numpy.sqrt(rinv2)
+    rinv4 = rinv2 * rinv2
+    rinv6 = rinv4 * rinv2
+    rinv12 = rinv6 * rinv6
+    evdw = acoefs * rinv12 - bcoefs * rinv6
+    if ccoefs is not None:
+        evdw = evdw - ccoefs * rinv4
+    eeel = qqs * rinv
+    if grad is not None:
+        #dE/dr / r
+        fac = (-12.0 * acoefs * rinv12 + 6.0 * bcoefs * rinv6 - eeel) * rinv2
+        if ccoefs is not None:
+            fac = fac + 4.0 * ccoefs * rinv4 * rinv2
+        gvecs = fac[:,None] * vecs
+        add_grad(grad, ids[:,0], gvecs)
+        add_grad(grad, ids[:,1], -gvecs)
+    return numpy.sum(evdw), numpy.sum(eeel)
+
+#------------------------------------------------------------------------------
+# The local region
+#------------------------------------------------------------------------------
+
+def get_parm_array(parm_data, flag, ids, default=None):
+    if flag in parm_data:
+        return numpy.array(parm_data[flag], dtype=float)[ids]
+    return numpy.ones(len(ids)) * default
+
+class MMRegion(object):
+
+    def __init__(self, prmtop, atids=None):
+        """The prmtop is an AmberFormat (or AmberParm) and the atids are the
+           IDs (starting from 1) of the atoms in the region, all the atoms are
+           in the region if it is None."""
+
+        pdata = prmtop.parm_data
+        natom = len(pdata['ATOM_NAME'])
+        if atids is None:
+            atids = list(range(1, natom+1))
+        self.atids = numpy.array(sorted(atids), dtype=int)
+        self.natom = natom
+        nreg = len(self.atids)
+        if nreg == 0:
+            raise pymsmtError('There is no atom in the region.')
+
+        #Local index of each atom, -1 if it is not in the region
+        loc = -numpy.ones(natom, dtype=int)
+        loc[self.atids-1] = numpy.arange(nreg)
+        self.atyps = numpy.array(pdata['AMBER_ATOM_TYPE'])[self.atids-1]
+
+        #Bonds
+        bonds = numpy.array(pdata['BONDS_INC_HYDROGEN'] +
+                            pdata['BONDS_WITHOUT_HYDROGEN'],
+                            dtype=int).reshape(-1, 3)
+        bids = loc[bonds[:,0:2]//3]
+        sel = numpy.all(bids >= 0, axis=1)
+        self.bondids = bids[sel]
+        typs = bonds[sel,2] - 1
+        self.kbs = get_parm_array(pdata, 'BOND_FORCE_CONSTANT', typs)
+        self.reqs = get_parm_array(pdata, 'BOND_EQUIL_VALUE', typs)
+
+        #Angles
+        angs = numpy.array(pdata['ANGLES_INC_HYDROGEN'] +
+                           pdata['ANGLES_WITHOUT_HYDROGEN'],
+                           dtype=int).reshape(-1, 4)
+        aids = loc[angs[:,0:3]//3]
+        sel = numpy.all(aids >= 0, axis=1)
+        self.angids = aids[sel]
+        typs = angs[sel,3] - 1
+        self.kas = get_parm_array(pdata, 'ANGLE_FORCE_CONSTANT', typs)
+        self.teqs = get_parm_array(pdata, 'ANGLE_EQUIL_VALUE', typs)
+
+        #Dihedrals and impropers, a negative third index means the 1-4 pair
+        #is not calculated and a negative fourth index means an improper
+        dihs = numpy.array(pdata['DIHEDRALS_INC_HYDROGEN'] +
+                           pdata['DIHEDRALS_WITHOUT_HYDROGEN'],
+                           dtype=int).reshape(-1, 5)
+        dids = loc[numpy.abs(dihs[:,0:4])//3]
+        sel = numpy.all(dids >= 0, axis=1)
+        dihs = dihs[sel]
+        dids = dids[sel]
+        typs = dihs[:,4] - 1
+        self.dihids = dids
+        self.imps = dihs[:,3] < 0
+        self.pks = get_parm_array(pdata, 'DIHEDRAL_FORCE_CONSTANT', typs)
+        self.pns = get_parm_array(pdata, 'DIHEDRAL_PERIODICITY', typs)
+        self.phases = get_parm_array(pdata, 'DIHEDRAL_PHASE', typs)
+
+        #1-4 pairs, each pair is calculated once
+        sel = (dihs[:,2] >= 0) & (dihs[:,3] >= 0)
+        pids = numpy.sort(dids[sel][:,[0, 3]], axis=1)
+        keys, first = numpy.unique(pids[:,0] * nreg + pids[:,1],
+                                   return_index=True)
+        self.pair14ids = pids[first]
+        typs = typs[sel][first]
+        self.scees = get_parm_array(pdata, 'SCEE_SCALE_FACTOR', typs, SCEE)
+        self.scnbs = get_parm_array(pdata, 'SCNB_SCALE_FACTOR', typs, SCNB)
+
+        #The nonbonded pairs except the excluded ones (which are the 1-2, 1-3
+        #and 1-4 pairs)
+        numex = numpy.array(pdata['NUMBER_EXCLUDED_ATOMS'], dtype=int)
+        exlist = numpy.array(pdata['EXCLUDED_ATOMS_LIST'], dtype=int) - 1
+        exatoms = numpy.repeat(numpy.arange(natom), numex)
+        sel = (exlist >= 0) & (loc[exatoms] >= 0)
+        exids = numpy.array([loc[exatoms[sel]], loc[exlist[sel]]]).T
+        exids = numpy.sort(exids[exids[:,1] >= 0], axis=1)
+        exkeys = numpy.concatenate([exids[:,0] * nreg + exids[:,1], keys])
+        ii, jj = numpy.triu_indices(nreg, 1)
+        sel = ~numpy.isin(ii * nreg + jj, exkeys)
+        self.pairids = numpy.array([ii[sel], jj[sel]]).T
+        if len(self.pairids) == 0:
+            self.pairids = numpy.zeros((0, 2), dtype=int)
+
+        #LJ parameters, the pairs are indexed in the LENNARD_JONES_*COEF
+        #flags, the negative indexes (10-12 terms) are not supported
+        self.ntypes = pdata['POINTERS'][1]
+        self.typinds = numpy.array(pdata['ATOM_TYPE_INDEX'],
+                                   dtype=int)[self.atids-1] - 1
+        self.nbidx = numpy.array(pdata['NONBONDED_PARM_INDEX'], dtype=int) - 1
+        self.acoef = numpy.array(pdata['LENNARD_JONES_ACOEF'], dtype=float)
+        self.bcoef = numpy.array(pdata['LENNARD_JONES_BCOEF'], dtype=float)
+        if 'LENNARD_JONES_CCOEF' in pdata:
+            self.ccoef = numpy.array(pdata['LENNARD_JONES_CCOEF'],
+                                     dtype=float)
+        else:
+            self.ccoef = None
+        self.pairidxs = self.get_lj_idxs(self.pairids)
+        self.pair14idxs = self.get_lj_idxs(self.pair14ids)
+        if numpy.any(self.pairidxs < 0) or numpy.any(self.pair14idxs < 0):
+            raise pymsmtError('The 10-12 LJ terms are not supported.')
+
+        #Charges, ParmEd reads them in e, they are changed back to the unit
+        #of Amber
+        chgs = numpy.array(pdata['CHARGE'], dtype=float)[self.atids-1] * \
+               CHARGE_SCALE
+        self.qqs = chgs[self.pairids[:,0]] * chgs[self.pairids[:,1]]
+        self.qq14s = chgs[self.pair14ids[:,0]] * chgs[self.pair14ids[:,1]]
+
+    def get_lj_idxs(self, pids):
+        ti = self.typinds[pids[:,0]]
+        tj = self.typinds[pids[:,1]]
+        return self.nbidx[self.ntypes * ti + tj]
+
+    def set_c4(self, idxs, c4terms):
+        """Set the C4 terms (in kcal/mol*A^4) of the indexes in the
+           LENNARD_JONES_CCOEF flag."""
+        if self.ccoef is None:
+            self.ccoef = numpy.zeros(len(self.acoef))
+        self.ccoef[list(idxs)] = c4terms
+
+    def get_energy(self, crds, grad=False):
+        """Get the energy terms of the coordinates, which are those of the
+           region or the whole topology. Return a dict of the energy terms
+           (and the total energy), and the gradient array of the region atoms
+           if grad is True."""
+
+        crds = numpy.asarray(crds, dtype=float)
+        if len(crds) != len(self.atids):
+            if len(crds) != self.natom:
+                raise pymsmtError('The coordinates do not have the atom '
+                                  'number of the region or the topology.')
+            crds = crds[self.atids-1]
+
+        garr = None
+        if grad:
+            garr = numpy.zeros((len(crds), 3))
+
+        enes = {}
+        enes['bond'] = calc_bond_ene(crds, self.bondids, self.kbs, self.reqs,
+                                     garr)
+        enes['angle'] = calc_angle_ene(crds, self.angids, self.kas, self.teqs,
+                                       garr)
+        sel = ~self.imps
+        enes['dihedral'] = calc_dih_ene(crds, self.dihids[sel], self.pks[sel],
+                                        self.pns[sel], self.phases[sel], garr)
+        sel = self.imps
+        enes['improper'] = calc_dih_ene(crds, self.dihids[sel], self.pks[sel],
+                                        self.pns[sel], self.phases[sel], garr)
+
+        ccoefs = None
+        if self.ccoef is not None:
+            ccoefs = self.ccoef[self.pairidxs]
+        enes['vdw'], enes['eel'] = calc_pair_ene(crds, self.pairids,
+            self.acoef[self.pairidxs], self.bcoef[self.pairidxs], ccoefs,
+            self.qqs, garr)
+
+        #The 1-4 pairs do not have the C4 terms
+        enes['vdw14'], enes['eel14'] = calc_pair_ene(crds, self.pair14ids,
+            self.acoef[self.pair14idxs] / self.scnbs,
+            self.bcoef[self.pair14idxs] / self.scnbs, None,
+            self.qq14s / self.scees, garr)
+
+        enes['total'] = sum([enes[i] for i in ENE_TERMS])
+
+        if grad:
+            return enes, garr
+        return enes
+
+    #--------------------------------------------------------------------------
+    # Apply the parameters of an frcmod file
+    #--------------------------------------------------------------------------
+
+    def get_typs(self, ids):
+        #Atom types of the terms, with two characters as in the frcmod files
+        return [tuple([str(self.atyps[j]).ljust(2) for j in i]) for i in ids]
+
+    def apply_frcmod(self, frcmodf):
+        """Replace the parameters of the bonds, angles, dihedrals, impropers
+           and LJ terms of the region which are in the frcmod file."""
+
+        #lib requires $AMBERHOME, which is only needed here
+        from lib.lib import read_frcmod_file
+        parms = read_frcmod_file(frcmodf)
+
+        #Bonds
+        for i, typs in enumerate(self.get_typs(self.bondids)):
+            parm = get_frcmod_parm(parms.bond, typs)
+            if parm is not None:
+                parm = parm.split()
+                self.kbs[i] = float(parm[0])
+                self.reqs[i] = float(parm[1])
+
+        #Angles
+        for i, typs in enumerate(self.get_typs(self.angids)):
+            parm = get_frcmod_parm(parms.ang, typs)
+            if parm is not None:
+                parm = parm.split()
+                self.kas[i] = float(parm[0])
+                self.teqs[i] = math.radians(float(parm[1]))
+
+        #Dihedrals, all the terms of a dihedral are replaced by the ones in
+        #the frcmod file
+        diharr = [self.dihids, self.pks, self.pns, self.phases, self.imps]
+        keep = numpy.ones(len(self.dihids), dtype=bool)
+        news = []
+        done = set()
+        for i, typs in enumerate(self.get_typs(self.dihids)):
+            if self.imps[i]:
+                parm = get_frcmod_imp(parms.imp, typs)
+                if parm is not None:
+                    parm = parm.split()
+                    keep[i] = False
+                    news.append((self.dihids[i], float(parm[0]),
+                                 abs(float(parm[2])),
+                                 math.radians(float(parm[1])), True))
+                continue
+            parm = get_frcmod_parm(parms.dih, typs, wild=True)
+            if parm is None:
+                continue
+            keep[i] = False
+            dihkey = tuple(self.dihids[i])
+            if dihkey in done:
+                continue
+            done.add(dihkey)
+            for j in range(0, len(parm), 3):
+                idivf, vn, phase = [float(k) for k in parm[j].split()]
+                news.append((self.dihids[i], vn / idivf, abs(parm[j+1]),
+                             math.radians(phase), False))
+
+        if not keep.all():
+            diharr = [k[keep] for k in diharr]
+            if news:
+                for k in range(0, 5):
+                    diharr[k] = numpy.concatenate([diharr[k],
+                        numpy.array([new[k] for new in news],
+                                    dtype=diharr[k].dtype)])
+            self.dihids, self.pks, self.pns, self.phases, self.imps = diharr
+
+        #LJ terms
+        if parms.nb or parms.ljed:
+            self.apply_lj(parms.nb, parms.ljed)
+
+    def apply_lj(self, nbparms, ljedparms):
+        #The R* and epsilon of the LJ types, from the diagonal terms
+        diag = self.nbidx[numpy.arange(self.ntypes) * (self.ntypes + 1)]
+        aii = self.acoef[diag]
+        bii = self.bcoef[diag]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            rstars = numpy.where(aii > 0, (2.0 * aii / bii)**(1.0/6.0) / 2.0,
+                                 0.0)
+            epss = numpy.where(aii > 0, bii**2 / (4.0 * aii), 0.0)
+
+        #The LJ types of the Amber atom types in the region
+        typdict = {}
+        for atyp, typind in zip(self.atyps, self.typinds):
+            typdict.setdefault(str(atyp).ljust(2), set()).add(typind)
+        newnb = {}
+        for atyp in nbparms.keys():
+            if atyp not in typdict:
+                continue
+            rstar, eps = [float(i) for i in nbparms[atyp].split()[0:2]]
+            for typind in typdict[atyp]:
+                if typind in newnb and newnb[typind] != (rstar, eps):
+                    raise pymsmtError('The atom types with the LJ type %d '
+                                      'get different LJ parameters from the '
+                                      'frcmod file.' %(typind+1))
+                newnb[typind] = (rstar, eps)
+
+        for typind in newnb.keys():
+            rstars[typind], epss[typind] = newnb[typind]
+        for typi in newnb.keys():
+            for typj in range(0, self.ntypes):
+                idx = self.nbidx[self.ntypes * typi + typj]
+                rij = rstars[typi] + rstars[typj]
+                epsij = math.sqrt(epss[typi] * epss[typj])
+                self.acoef[idx] = epsij * rij**12
+                self.bcoef[idx] = 2.0 * epsij * rij**6
+
+        #The off-diagonal LJ terms
+        for typs in ljedparms.keys():
+            if (typs[0] not in typdict) or (typs[1] not in typdict):
+                continue
+            ri, ei, rj, ej = [float(i) for i in ljedparms[typs].split()[0:4]]
+            rij = ri + rj
+            epsij = math.sqrt(ei * ej)
+            for typi in typdict[typs[0]]:
+                for typj in typdict[typs[1]]:
+                    idx = self.nbidx[self.ntypes * typi + typj]
+                    self.acoef[idx] = epsij * rij**12
+                    self.bcoef[idx] = 2.0 * epsij * rij**6
+
+def get_frcmod_parm(parms, typs, wild=False):
+    """Get the parameter of the atom types (or the reversed ones), with the
+       wildcard X at the two ends if wild is True."""
+    for key in [typs, typs[::-1]]:
+        if key in parms:
+            return parms[key]
+    if wild:
+        for key in [typs, typs[::-1]]:
+            key = ('X ',) + key[1:-1] + ('X ',)
+            if key in parms:
+                return parms[key]
+    return None
+
+def get_frcmod_imp(parms, typs):
+    """Get the improper parameter of the atom types, the third atom is the
+       center and the order of the other three does not matter."""
+    others = [typs[0], typs[1], typs[3]]
+    for key in parms.keys():
+        if key[2] != typs[2]:
+            continue
+        kothers = [key[0], key[1], key[3]]
+        rest = list(others)
+        for k in kothers:
+            if k in rest:
+                rest.remove(k)
+            elif k != 'X ':
+                break
+        else:
+            return parms[key]
+    return None
+
+def read_mm_region(pfile, atids=None, frcmodfs=None):
+    """Read the topology file into an MMRegion of the atom IDs, and apply the
+       frcmod files in order."""
+    from parmed.amber import AmberFormat
+    region = MMRegion(AmberFormat(pfile), atids)
+    if frcmodfs is not None:
+        for frcmodf in frcmodfs:
+            region.apply_frcmod(frcmodf)
+    return region
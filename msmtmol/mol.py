@@ -37,9 +37,10 @@ class Residue:
 
 class Molecule:
 
-    def __init__(self, atoms, residues):
+    def __init__(self, atoms, residues, header=None):
         self.atoms = atoms
         self.residues = residues
+        self.header = header #pdbheader of a molecule read from a PDB file
 
     def renum(self):
         #atom id and resid dict
@@ -64,7 +65,7 @@ class Molecule:
             Residues[i] = self.residues[nresids[i-1]]
 
         #return the molecule
-        mol1 = Molecule(Atoms, Residues)
+        mol1 = Molecule(Atoms, Residues, self.header)
         return mol1
 
     def delwaterion(self):
@@ -133,6 +134,15 @@ class pdbatm:
         self.occp = occp
         self.tempfac = tempfac
 
+class pdbheader:
+    def __init__(self, exptyp='UNKNOWN', reso='UNKNOWN', method='UNKNOWN',
+                 depdate='UNKNOWN', rfree='UNKNOWN'):
+        self.exptyp = exptyp #Experiment type in REMARK 200/210
+        self.reso = reso #Resolution in REMARK 2
+        self.method = method #Experimental method in the EXPDTA record
+        self.depdate = depdate #Deposition date in the HEADER record
+        self.rfree = rfree #Free R value in REMARK 3
+
 class gauatm:
     def __init__(self, element, crdx, crdy, crdz):
         self.element = element
@@ -162,16 +172,17 @@ def get_reslist(mol, resids):
         for j in mol.residues[i].resconter:
             atnamej = mol.atoms[j].atname
             atnames.append(atnamej)
+        atnames = set(atnames)
 
-        if (set(['CA', 'N', 'C', 'O', 'OXT', 'H2', 'H3']) < set(atnames)) or \
-           (set(['CA', 'N', 'C', 'O', 'OXT', 'HN2', 'HN3']) < set(atnames)):
+        if (set(['CA', 'N', 'C', 'O', 'OXT', 'H2', 'H3']) < atnames) or \
+           (set(['CA', 'N', 'C', 'O', 'OXT', 'HN2', 'HN3']) < atnames):
             nonstd.append(i)
-        elif (set(['CA', 'N', 'C', 'O', 'H2', 'H3']) < set(atnames)) or \
-             (set(['CA', 'N', 'C', 'O', 'HN2', 'HN3']) < set(atnames)):
+        elif (set(['CA', 'N', 'C', 'O', 'H2', 'H3']) < atnames) or \
+             (set(['CA', 'N', 'C', 'O', 'HN2', 'HN3']) < atnames):
             nterm.append(i)
-        elif set(['CA', 'N', 'C', 'O', 'OXT']) < set(atnames):
+        elif set(['CA', 'N', 'C', 'O', 'OXT']) < atnames:
             cterm.append(i)
-        elif set(['CA', 'N', 'C', 'O']) < set(atnames):
+        elif set(['CA', 'N', 'C', 'O']) < atnames:
             std.append(i)
         else:
             nonstd.append(i)
@@ -0,0 +1,54 @@
+"""
+This module was written for reading the PDB files in tar or zip archives
+without extracting them. The PDB files in an archive can be gzipped, e.g. a
+tar shard of a PDB mirror with the pdb1abc.ent.gz (or mmCIF 1abc.cif.gz)
+members. The members are read in their order in the archive.
+"""
+from __future__ import absolute_import
+import gzip
+import io
+import tarfile
+import zipfile
+
+ARCHIVE_EXTS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz',
+                '.zip')
+PDB_EXTS = ('.pdb', '.ent', '.pdb.gz', '.ent.gz', '.cif', '.cif.gz')
+
+def is_archive(fname):
+    return fname.lower().endswith(ARCHIVE_EXTS)
+
+def is_pdb_member(name):
+    return name.lower().endswith(PDB_EXTS)
+
+def get_member_text(fp, name):
+    """Text file of an archive member, which is unzipped if it is gzipped.
+       The member is read into memory first, the member files of a streamed
+       tar (and those of a zip in Python 2) can not be wrapped directly."""
+    bfp = io.BytesIO(fp.read())
+    fp.close()
+    if name.lower().endswith('.gz'):
+        bfp = gzip.GzipFile(fileobj=bfp, mode='rb')
+    return io.TextIOWrapper(bfp, encoding='latin-1')
+
+def iter_archive(archf):
+    """Yield the name and the open text file of each PDB file in the archive,
+       the file should be read before the next one is yielded."""
+
+    if archf.lower().endswith('.zip'):
+        zipf = zipfile.ZipFile(archf, 'r')
+        try:
+            for name in zipf.namelist():
+                if is_pdb_member(name) and not name.endswith('/'):
+                    yield name, get_member_text(zipf.open(name, 'r'), name)
+        finally:
+            zipf.close()
+    else:
+        #The tar file is read as a stream
+        tarf = tarfile.open(archf, 'r|*')
+        try:
+            for tinfo in tarf:
+                if tinfo.isfile() and is_pdb_member(tinfo.name):
+                    yield tinfo.name, get_member_text(tarf.extractfile(tinfo),
+                                                      tinfo.name)
+        finally:
+            tarf.close()
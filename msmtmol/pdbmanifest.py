@@ -0,0 +1,134 @@
+"""
+This module was written for the manifest of the PDB files (or archives of
+PDB files) processed by PdbSearcher.py, which makes the runs resumable and
+incremental. The manifest is a SQLite file with one record for each processed
+PDB file or archive: the path, size, modification time and sha256 hash of the
+file, and the outputs of the file (the lines of the summary and environment
+files and the metal center PDB file names). A file with the same size and
+modification time (or the same hash) as in the manifest is not processed
+again, and its outputs are taken from the manifest. The search settings (the
+ion elements and the cutoff) are also saved, and all the files are processed
+again if they are changed.
+"""
+from __future__ import absolute_import, print_function
+from msmtmol.filehash import hash_file
+import os
+import sqlite3
+
+def get_file_stamp(fname):
+    """Size, modification time and hash of a file."""
+    st = os.stat(fname)
+    return st.st_size, st.st_mtime, hash_file(fname)
+
+def open_manifest(mftfname):
+    conn = sqlite3.connect(mftfname)
+    conn.execute("""CREATE TABLE IF NOT EXISTS files (
+                    fname TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime REAL,
+                    sha256 TEXT,
+                    nsite INTEGER,
+                    sumlines TEXT,
+                    envlines TEXT,
+                    mcpdbs TEXT)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT)""")
+    conn.commit()
+    return conn
+
+def check_settings(conn, settings):
+    """Compare the search settings (a dict of the names and values which
+       change the outputs, e.g. the ion elements and cutoff) with those of the
+       last run. If they are different, all the files in the manifest are
+       removed and their metal center PDB file names are returned, so that
+       all the files are processed again. Return None if the settings are the
+       same or the manifest is new."""
+
+    settings = dict([(k, repr(v)) for k, v in settings.items()])
+    old = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    nfile = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    mcpdbs = None
+    if old != settings and (old or nfile):
+        mcpdbs = []
+        for row in conn.execute("SELECT mcpdbs FROM files"):
+            if row[0]:
+                mcpdbs = mcpdbs + row[0].split('\n')
+        conn.execute("DELETE FROM files")
+
+    conn.execute("DELETE FROM meta")
+    for key in sorted(settings.keys()):
+        conn.execute("INSERT INTO meta VALUES (?, ?)", (key, settings[key]))
+    conn.commit()
+    return mcpdbs
+
+def check_manifest(conn, pdbfnl):
+    """Compare the files with the manifest. Return the files which are new or
+       modified, the files in the manifest which are not in the list any more,
+       and the number of the unchanged files."""
+
+    entries = {}
+    for row in conn.execute("SELECT fname, size, mtime, sha256 FROM files"):
+        entries[row[0]] = row[1:]
+
+    todo = []
+    nsame = 0
+    for fname in pdbfnl:
+        if (fname not in entries) or (not os.path.isfile(fname)):
+            todo.append(fname)
+            continue
+        size, mtime, sha = entries[fname]
+        st = os.stat(fname)
+        if (st.st_size == size) and (st.st_mtime == mtime):
+            nsame = nsame + 1
+        elif (st.st_size == size) and (hash_file(fname) == sha):
+            #Only the modification time is changed
+            conn.execute("UPDATE files SET mtime = ? WHERE fname = ?",
+                         (st.st_mtime, fname))
+            nsame = nsame + 1
+        else:
+            todo.append(fname)
+    conn.commit()
+
+    fnameset = set(pdbfnl)
+    delfs = [i for i in entries if i not in fnameset]
+    return todo, delfs, nsame
+
+def save_entry(conn, fname, stamp, results):
+    """Save the outputs of a processed file or archive, which are committed
+       at the next checkpoint. The results are of the PDB files in it."""
+    size, mtime, sha = stamp
+    nsite = 0
+    sumlines = []
+    envlines = []
+    mcpdbs = []
+    for res in results:
+        nsite = nsite + res.nsite
+        sumlines = sumlines + res.sumlines
+        envlines = envlines + res.envlines
+        mcpdbs = mcpdbs + [i[0] for i in res.mcpdbs] + res.mcpdbfs
+    conn.execute("INSERT OR REPLACE INTO files VALUES "
+                 "(?, ?, ?, ?, ?, ?, ?, ?)",
+                 (fname, size, mtime, sha, nsite, '\n'.join(sumlines),
+                  '\n'.join(envlines), '\n'.join(mcpdbs)))
+
+def remove_entry(conn, fname):
+    """Remove a file from the manifest, return its metal center PDB file
+       names."""
+    row = conn.execute("SELECT mcpdbs FROM files WHERE fname = ?",
+                       (fname,)).fetchone()
+    conn.execute("DELETE FROM files WHERE fname = ?", (fname,))
+    if (row is None) or (not row[0]):
+        return []
+    return row[0].split('\n')
+
+def get_entry_lines(conn, fname):
+    """Get the lines of the summary and environment files of a file."""
+    row = conn.execute("SELECT sumlines, envlines FROM files WHERE fname = ?",
+                       (fname,)).fetchone()
+    if row is None:
+        return [], []
+    sumlines = [i for i in row[0].split('\n') if i]
+    envlines = [i for i in row[1].split('\n') if i]
+    return sumlines, envlines
@@ -0,0 +1,575 @@
+"""
+This module was written for searching the metal centers in PDB files, which
+is used by the PdbSearcher.py program. Each PDB file is processed
+independently, so the files can be processed by a pool of processes, the
+results are merged in the order of the file list so that the summary and
+environment files do not depend on the number of processes.
+"""
+from __future__ import absolute_import, print_function
+from msmtmol.readpdb import (get_atominfo_fpdb, get_models_fpdb, writepdbatm,
+                             BufferedWriter)
+from msmtmol.element import METAL_PDB, CoRadiiDict, resdict
+from msmtmol.mol import pdbatm
+from msmtmol.cal import calc_bond, det_geo
+from msmtmol.sitedb import open_site_db, insert_results, delete_structure
+from msmtmol.readcif import is_cif_file
+from msmtmol.pdbarchive import is_archive, iter_archive
+from msmtmol.pdbmanifest import (open_manifest, check_settings, check_manifest,
+                                 save_entry, remove_entry, get_entry_lines,
+                                 get_file_stamp)
+from multiprocessing import Pool
+from scipy.spatial import cKDTree
+import io
+import numpy
+import os
+import sys
+import tarfile
+import time
+
+class SearchResult:
+    def __init__(self, fname, source=None):
+        self.fname = fname
+        if source is None:
+            source = fname
+        self.source = source #The file or archive in the list
+        self.sumlines = [] #Lines of the summary file
+        self.envlines = [] #Lines of the environment file
+        self.msgs = [] #Messages printed on the screen
+        self.mcpdbs = [] #Metal center PDB file names and texts for archive
+        self.mcpdbfs = [] #Metal center PDB files written
+        self.stamp = None #Size, modification time and hash for manifest
+        self.struct = None #Structure record for the database
+        self.sites = [] #Metal center records for the database
+        self.modellines = [] #Lines of the model file
+        self.nsite = 0
+        self.error = ''
+
+def format_line(items):
+    """Format a line of the summary or environment file, the items are
+       separated as the print function does."""
+    return ' '.join([str(i) for i in items])
+
+def print_sum_title(sf, ioncol=False):
+    if ioncol:
+        print('PDB_ID,', 'ION,', 'EXP_TECH,', 'RESOLUTION,', 'ATOM_NUMBER,', \
+              'ION_NUMBER,', 'RES_ID,', 'RES_NAME,', 'ATOM_ID,', \
+              'ATOM_NAME,', 'COORD_SPHERE,', 'GEOMETRY,','GEO_RMS', file=sf)
+        return
+    print('PDB_ID,', 'EXP_TECH,', 'RESOLUTION,', 'ATOM_NUMBER,', \
+          'ION_NUMBER,', 'RES_ID,', 'RES_NAME,', 'ATOM_ID,', 'ATOM_NAME,', \
+          'COORD_SPHERE,', 'GEOMETRY,','GEO_RMS', file=sf)
+
+def print_env_title(ef, ioncol=False):
+    if ioncol:
+        print('PDB,', 'ION,', 'ION_RESID,', 'ION_RESNAME,', 'ION_ATOM_ID,', \
+              'ION_ATOM_NAME,', 'RESID,', 'RESNAME,', 'ATOM_ID,', \
+              'ATOM_NAME,', 'DISTANCE,', 'GEOMETRY,', 'GEO_RMS,', \
+              'COORDINATE_SPHERE,', 'EXP_TECH,', 'RESOLUTION', file=ef)
+        return
+    print('PDB,', 'ION_RESID,', 'ION_RESNAME,', 'ION_ATOM_ID,', \
+          'ION_ATOM_NAME,', 'RESID,', 'RESNAME,', 'ATOM_ID,', 'ATOM_NAME,',\
+          'DISTANCE,', 'GEOMETRY,', 'GEO_RMS,', 'COORDINATE_SPHERE,', \
+          'EXP_TECH,', 'RESOLUTION', file=ef)
+
+def print_model_title(mf, ioncol=False):
+    if ioncol:
+        print('PDB_ID,', 'MODEL,', 'ION,', 'RES_ID,', 'RES_NAME,', \
+              'ATOM_ID,', 'ATOM_NAME,', 'COORD_SPHERE,', 'COORD_NUMBER,', \
+              'GEOMETRY,', 'GEO_RMS', file=mf)
+        return
+    print('PDB_ID,', 'MODEL,', 'RES_ID,', 'RES_NAME,', 'ATOM_ID,', \
+          'ATOM_NAME,', 'COORD_SPHERE,', 'COORD_NUMBER,', 'GEOMETRY,', \
+          'GEO_RMS', file=mf)
+
+#------------------------------------------------------------------------------
+# Process one PDB file
+#------------------------------------------------------------------------------
+
+def get_metal_list(mol, atids, ionnames):
+    """Get the atom IDs of the metal ions with the elements in ionnames."""
+    metallist = []
+    for i in atids:
+        resname = mol.residues[mol.atoms[i].resid].resname
+        atname = mol.atoms[i].atname
+        if (resname, atname) in METAL_PDB:
+            if METAL_PDB[(resname, atname)][0] in ionnames:
+                metallist.append(i)
+    return metallist
+
+def is_bonded(disij, radiusij, elmtj, cutoff):
+    if cutoff is None:
+        return (disij >= 0.1) and (disij <= radiusij) and (elmtj != 'H')
+    else:
+        return (disij >= 0.1) and (disij <= cutoff) and (elmtj != 'H')
+
+def get_metal_neighbors(mol, atids, metallist, cutoff=None, crds=None):
+    """Get the bonded atoms of each metal ion with one radius search of all
+       the metal ions in a KD-tree of the atoms. Return a dict of the metal
+       ion atom ID and its list of (atom ID, distance), in the atom order.
+       The crds are the coordinates in the order of atids (e.g. of a model),
+       the coordinates in mol are used if they are not given."""
+
+    nbdict = {}
+    if not metallist:
+        return nbdict
+
+    if crds is None:
+        crds = numpy.array([mol.atoms[i].crd for i in atids])
+        crdl = [mol.atoms[i].crd for i in atids]
+    else:
+        crdl = crds.tolist()
+    atidx = dict([(j, k) for k, j in enumerate(atids)])
+    tree = cKDTree(crds)
+    if cutoff is None:
+        maxrad = max([CoRadiiDict[mol.atoms[i].element] for i in metallist]) \
+                 + max(CoRadiiDict.values()) + 0.40
+    else:
+        maxrad = cutoff
+    #A small tolerance, the distances are checked again with calc_bond
+    mcrds = crds[[atidx[i] for i in metallist]]
+    nbidxs = tree.query_ball_point(mcrds, maxrad + 1.0e-3)
+
+    for i, idxs in zip(metallist, nbidxs):
+        crdi = crdl[atidx[i]]
+        radiusi = CoRadiiDict[mol.atoms[i].element]
+        nbdict[i] = []
+        for k in sorted(idxs):
+            j = atids[k]
+            if j == i:
+                continue
+            elmtj = mol.atoms[j].element
+            radiusij = radiusi + CoRadiiDict[elmtj] + 0.40
+            disij = calc_bond(crdi, crdl[k])
+            if is_bonded(disij, radiusij, elmtj, cutoff):
+                nbdict[i].append((j, disij))
+    return nbdict
+
+def get_site_geometry(mol, i, nbs, crddict=None):
+    """Get the ligating residue IDs, ligating residue letters, geometry and
+       geometry rms of the metal ion i with the bonded atoms nbs. The crddict
+       has the coordinates of the atoms (e.g. of a model), the coordinates in
+       mol are used if it is not given."""
+
+    if crddict is None:
+        crdi = mol.atoms[i].crd
+    else:
+        crdi = crddict[i]
+
+    mccrds = [] #The crds of metal site
+    mcresids = [] #MetalCenter residue IDs
+
+    #Get the residues which is the metal site
+    for j, disij in nbs:
+        residj = mol.atoms[j].resid
+        mccrds.append(crdi)
+        if crddict is None:
+            mccrds.append(mol.atoms[j].crd)
+        else:
+            mccrds.append(crddict[j])
+        if (residj not in mcresids):
+            mcresids.append(residj)
+
+    #Getting the ligating reidue letters
+    reslets = ''
+    for j in mcresids:
+        resname = mol.residues[j].resname
+        if resname in list(resdict.keys()):
+            reslet = resdict[resname]
+        else:
+            reslet = 'X'
+        reslets = reslets + reslet
+    nospace = ''
+    reslets = nospace.join(sorted(reslets))
+
+    #Get the geometry and geometry rms
+    geo, georms = det_geo(mccrds)
+
+    return mcresids, reslets, geo, georms
+
+def get_model_lines(pdbid, imodel, mol, atids, metallist, crds, cutoff=None,
+                    ioncol=False):
+    """Get the lines of the model file for the metal sites in a model with
+       the coordinates crds."""
+
+    nbdict = get_metal_neighbors(mol, atids, metallist, cutoff, crds)
+    crddict = dict(zip(atids, crds.tolist()))
+
+    lines = []
+    for i in metallist:
+        residi = mol.atoms[i].resid
+        mcresids, reslets, geo, georms = get_site_geometry(mol, i, nbdict[i],
+                                                           crddict)
+        line = [pdbid, ',', imodel, ',', residi, ',',
+          mol.residues[residi].resname, ',', i, ',', mol.atoms[i].atname, ',',
+          reslets, ',', len(nbdict[i]), ',', geo, ',', round(georms, 3)]
+        if ioncol:
+            line[4:4] = [mol.atoms[i].element, ',']
+        lines.append(format_line(line))
+    return lines
+
+def search_metal_centers(fname, ionnames, cutoff=None, archive=False,
+                         fp=None, pdbname=None, source=None, models=False):
+    """Find the metal centers of the ions in a PDB file, write the metal
+       center PDB files and return the lines of the summary and environment
+       files. If more than one element is in ionnames, all of them are found
+       in one read of the file and the ion element is a column of the lines.
+       If archive is True, the metal center PDB files are returned in the
+       result instead of being written. For a member of an archive, fp is the
+       open member file and pdbname is used for the PDB ID and the metal
+       center PDB file names. The metal centers are those of the first model,
+       if models is True, the metal sites in each model are also returned as
+       the lines of the model file, with the models read one by one."""
+
+    res = SearchResult(fname, source)
+    res.msgs.append("***Performing the " + fname + " file")
+    if pdbname is None:
+        pdbname = fname
+
+    #get the metal list, with the resolution and method in the header
+    if models:
+        mol, atids, resids, crditer = get_models_fpdb(fname, fp)
+    else:
+        mol, atids, resids = get_atominfo_fpdb(fname, fp)
+    exptyp = mol.header.exptyp
+    reso = mol.header.reso
+
+    #Get the metal ions which are the ions user want to process
+    metallist = get_metal_list(mol, atids, ionnames)
+    ioncol = (len(ionnames) > 1)
+    res.nsite = len(metallist)
+
+    #Bonded atoms of the metal ions
+    nbdict = get_metal_neighbors(mol, atids, metallist, cutoff)
+
+    #PDB ID in the outputs, a gzipped file has the same ID as the archive
+    #member of it
+    pdbid = pdbname
+    if pdbid.endswith('.gz'):
+        pdbid = pdbid[:-3]
+    if is_cif_file(pdbname):
+        pdbid = os.path.splitext(pdbid)[0]
+    else:
+        pdbid = pdbid.strip('.pdb')
+
+    res.struct = (pdbid, exptyp, reso, mol.header.rfree,
+                  mol.header.depdate, len(atids), len(metallist))
+
+    #for each metal ion in the metal list, print the metal center
+    for i in metallist:
+
+        residi = mol.atoms[i].resid
+        atnamei = mol.atoms[i].atname
+        resnamei = mol.residues[residi].resname
+        elmti = mol.atoms[i].element
+
+        #Ligating residues and geometry of the metal site
+        mcresids, reslets, geo, georms = get_site_geometry(mol, i, nbdict[i])
+        res.msgs.append('   Find metal center ' + reslets)
+
+        #add the metal ions into the mcresids
+        if mol.atoms[i].resid not in mcresids:
+            mcresids.append(mol.atoms[i].resid)
+
+        mcpdbfn = pdbid + '_res_' + str(i) + '_MetalCenter.pdb'
+        if (not archive) and os.path.isfile(mcpdbfn):
+            res.msgs.append("Overwritting the metal center pdb file: " +
+                            mcpdbfn)
+            os.remove(mcpdbfn)
+
+        #print the residue which is in the cut off into the pdb file
+        mcpdbw = BufferedWriter(mcpdbfn)
+        for j in mcresids:
+            for k in mol.residues[j].resconter:
+                tiker = mol.atoms[k].gtype
+                atid = mol.atoms[k].atid
+                atname = mol.atoms[k].atname
+                resname = mol.atoms[k].resname
+                chainid = 'A'
+                resid = mol.atoms[k].resid
+                crdx = round(mol.atoms[k].crd[0], 3)
+                crdy = round(mol.atoms[k].crd[1], 3)
+                crdz = round(mol.atoms[k].crd[2], 3)
+                occp = 1.00
+                tempfac = 0.00
+                atmj = pdbatm(tiker, atid, atname, resname, chainid, resid,
+                              crdx, crdy, crdz, occp, tempfac)
+                writepdbatm(atmj, mcpdbw)
+        if archive:
+            res.mcpdbs.append((mcpdbfn, mcpdbw.getvalue()))
+        else:
+            mcpdbw.close()
+            res.mcpdbfs.append(mcpdbfn)
+
+        #Print the environment
+        for j, disij in nbdict[i]:
+            atnamej = mol.atoms[j].atname
+            residj = mol.atoms[j].resid
+            resnamej = mol.residues[residj].resname
+            #for each bond in the metal site
+            line = [pdbid, ',', residi, ',', resnamei, ',',
+              i, ',', atnamei, ',', residj, ',', resnamej, ',', j, ',',
+              atnamej, ',', round(disij, 3), ',', geo, ',', round(georms, 3),
+              ',', reslets, ',', exptyp, ',', reso]
+            if ioncol:
+                line[2:2] = [elmti, ',']
+            res.envlines.append(format_line(line))
+
+        contacts = [(mol.atoms[j].resid,
+                     mol.residues[mol.atoms[j].resid].resname, j,
+                     mol.atoms[j].atname, mol.atoms[j].element,
+                     round(disij, 3)) for j, disij in nbdict[i]]
+        res.sites.append((elmti, residi, resnamei, i, atnamei,
+                          reslets, geo, georms, contacts))
+
+        #for each metal site
+        line = [pdbid, ',', exptyp, ',', reso, ',',
+          len(atids), ',', len(metallist), ',', residi, ',', resnamei, ',', i,
+          ',', atnamei, ',', reslets, ',', geo, ',', round(georms, 3)]
+        if ioncol:
+            line[2:2] = [elmti, ',']
+        res.sumlines.append(format_line(line))
+
+    #Metal sites in each model
+    if models:
+        for imodel, crds in enumerate(crditer):
+            res.modellines = res.modellines + get_model_lines(pdbid,
+                imodel + 1, mol, atids, metallist, crds, cutoff, ioncol)
+
+    return res
+
+def search_pdb_item(args):
+    """Worker function of search_metal_centers for a PDB file or an archive
+       of PDB files in the list. Return the item, its stamp for the manifest
+       and the results of its PDB files. An error in a PDB file is returned in
+       its result instead of stopping the other files."""
+
+    item, ionnames, cutoff, archive, stamp, models = args
+    results = []
+    fstamp = None
+    try:
+        #The file is stamped before it is read
+        if stamp:
+            fstamp = get_file_stamp(item)
+        if is_archive(item):
+            archdir = os.path.dirname(item)
+            for name, fp in iter_archive(item):
+                fname = item + ':' + name
+                pdbname = os.path.basename(name)
+                if pdbname.endswith('.gz'):
+                    pdbname = pdbname[:-3]
+                pdbname = os.path.join(archdir, pdbname)
+                try:
+                    res = search_metal_centers(fname, ionnames, cutoff,
+                                               archive, fp, pdbname, item,
+                                               models)
+                except Exception as e:
+                    res = SearchResult(fname, item)
+                    res.msgs.append("***Performing the " + fname + " file")
+                    res.error = '%s: %s' %(type(e).__name__, e)
+                results.append(res)
+        else:
+            results.append(search_metal_centers(item, ionnames, cutoff,
+                                                archive, models=models))
+    except Exception as e:
+        #The file or archive could not be read
+        res = SearchResult(item)
+        res.msgs.append("***Performing the " + item + " file")
+        res.error = '%s: %s' %(type(e).__name__, e)
+        results.append(res)
+    return item, fstamp, results
+
+#------------------------------------------------------------------------------
+# Process a list of PDB files
+#------------------------------------------------------------------------------
+
+def print_progress(nitem, totitem, nfile, nsite, t0):
+    dt = max(time.time() - t0, 1.0e-6)
+    print("Processed %d/%d files or archives, %d PDB files, %d metal sites, "
+          "%.1f files/s, %.1f sites/s" %(nitem, totitem, nfile, nsite,
+          nfile/dt, nsite/dt))
+    sys.stdout.flush()
+
+def add_to_tar(tarf, fname, text):
+    """Add a text file into the open tar archive."""
+    data = text.encode()
+    tinfo = tarfile.TarInfo(fname.lstrip('/'))
+    tinfo.size = len(data)
+    tinfo.mtime = time.time()
+    tarf.addfile(tinfo, io.BytesIO(data))
+
+def search_pdb_files(pdbfnl, ionnames, sumf, envf, cutoff=None, nproc=1,
+                     chunksize=8, interval=10.0, tarfname=None, dbfname=None,
+                     mftfname=None, batch=500, modelf=None):
+    """Search the metal centers in the PDB files with nproc processes, the
+       files are dispatched to the processes in chunks of chunksize files.
+       The metal ions of all the elements in ionnames are found in one read
+       of each file, the ion element is a column of the summary and
+       environment files if there is more than one element.
+       A tar or zip archive of PDB files (which can be gzipped) in the list
+       is read by one process without extracting it.
+       The progress is reported every interval seconds. If tarfname is given,
+       the metal center PDB files are packed into this tar archive (gzipped
+       if the name ends with gz) instead of being written one by one. If
+       dbfname is given, the results are also saved into this SQLite
+       database, batch files in a transaction.
+       If mftfname is given, only the files which are new or modified since
+       the last run recorded in this manifest are processed, the files which
+       are not in the list any more are removed from the outputs, and the
+       manifest is saved every batch files, so an interrupted run can be
+       resumed. The summary and environment files are written at the end from
+       the manifest in this case.
+       If modelf is given, the metal sites in each model of the PDB files
+       are written into this file. The tarfname and modelf can not be used
+       with the manifest.
+       Return the numbers of the processed files, metal sites and failed
+       files."""
+
+    if isinstance(ionnames, str):
+        ionnames = [ionnames]
+    ioncol = (len(ionnames) > 1)
+
+    mft = None
+    todofs = pdbfnl
+    if mftfname is not None:
+        mft = open_manifest(mftfname)
+        oldmcpdbs = check_settings(mft, {'ions': list(ionnames),
+                                         'cutoff': cutoff})
+        if oldmcpdbs is not None:
+            print("The ion elements or the cutoff are different from the "
+                  "last run, all the files are processed again.")
+            for mcpdbfn in oldmcpdbs:
+                if os.path.isfile(mcpdbfn):
+                    os.remove(mcpdbfn)
+        todofs, delfs, nsame = check_manifest(mft, pdbfnl)
+        print("%d files are unchanged, %d files are new or modified, %d "
+              "files are removed since the last run." %(nsame, len(todofs),
+              len(delfs)))
+
+    tarf = None
+    if tarfname is not None:
+        if tarfname.endswith('gz'):
+            tarf = tarfile.open(tarfname, 'w:gz')
+        else:
+            tarf = tarfile.open(tarfname, 'w')
+
+    conn = None
+    if dbfname is not None:
+        conn = open_site_db(dbfname)
+
+    #Remove the outputs of the files which are not in the list
+    if mft is not None:
+        for fname in delfs:
+            for mcpdbfn in remove_entry(mft, fname):
+                if os.path.isfile(mcpdbfn):
+                    os.remove(mcpdbfn)
+            if conn is not None:
+                delete_structure(conn, fname)
+        mft.commit()
+        if conn is not None:
+            conn.commit()
+
+    if mft is None:
+        sf = open(sumf, 'w')
+        print_sum_title(sf, ioncol)
+        ef = open(envf, 'w')
+        print_env_title(ef, ioncol)
+
+    if modelf is not None:
+        mf = open(modelf, 'w')
+        print_model_title(mf, ioncol)
+
+    #The archives are read by the processes in parallel, one archive a time
+    args = [(i, ionnames, cutoff, tarf is not None, mft is not None,
+             modelf is not None) for i in todofs]
+    if nproc > 1:
+        pool = Pool(nproc)
+        resiter = pool.imap(search_pdb_item, args, chunksize)
+    else:
+        pool = None
+        resiter = (search_pdb_item(i) for i in args)
+
+    t0 = time.time()
+    tprog = t0
+    nitem = 0
+    nfile = 0
+    nsite = 0
+    failfs = []
+    results = []
+    #The results are in the order of the file list
+    for item, fstamp, itemres in resiter:
+        itemfail = False
+        for res in itemres:
+            for msg in res.msgs:
+                print(msg)
+            if res.error:
+                print("Error in processing the file %s: %s" %(res.fname,
+                      res.error))
+                failfs.append(res.fname)
+                #An archive with a failed member is processed again too
+                itemfail = True
+            elif mft is None:
+                for line in res.envlines:
+                    print(line, file=ef)
+                for line in res.sumlines:
+                    print(line, file=sf)
+            if modelf is not None:
+                for line in res.modellines:
+                    print(line, file=mf)
+            for mcpdbfn, text in res.mcpdbs:
+                add_to_tar(tarf, mcpdbfn, text)
+            nfile = nfile + 1
+            nsite = nsite + res.nsite
+
+        if mft is not None:
+            if itemfail:
+                #Processed again in the next run
+                remove_entry(mft, item)
+            else:
+                save_entry(mft, item, fstamp, itemres)
+
+        #Checkpoint
+        results = results + itemres
+        if len(results) >= batch:
+            if conn is not None:
+                insert_results(conn, results)
+            if mft is not None:
+                mft.commit()
+            results = []
+
+        nitem = nitem + 1
+        if time.time() - tprog >= interval:
+            print_progress(nitem, len(todofs), nfile, nsite, t0)
+            tprog = time.time()
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if conn is not None:
+        insert_results(conn, results)
+        conn.close()
+    if tarf is not None:
+        tarf.close()
+
+    if mft is not None:
+        mft.commit()
+        sf = open(sumf, 'w')
+        print_sum_title(sf, ioncol)
+        ef = open(envf, 'w')
+        print_env_title(ef, ioncol)
+        for fname in pdbfnl:
+            sumlines, envlines = get_entry_lines(mft, fname)
+            for line in envlines:
+                print(line, file=ef)
+            for line in sumlines:
+                print(line, file=sf)
+        mft.close()
+    sf.close()
+    ef.close()
+    if modelf is not None:
+        mf.close()
+
+    print_progress(nitem, len(todofs), nfile, nsite, t0)
+    if failfs:
+        print("%d files could not be processed: %s" %(len(failfs),
+              ' '.join(failfs)))
+    return nfile, nsite, len(failfs)
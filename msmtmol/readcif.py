@@ -0,0 +1,265 @@
+"""
+This module was written for reading the mmCIF (PDBx) files, which are used
+for the large structures beyond the limits of the PDB format (99999 atoms and
+9999 residues). The _atom_site loop of the first model is read in a stream,
+one row a line, and the rows are converted column by column into the same
+Molecule as the one read from a PDB file. The residues are numbered from 1 in
+the order of the file, as in a renumbered PDB file, since the residue numbers
+of the mmCIF file are only unique in a chain.
+"""
+from __future__ import absolute_import
+from msmtmol.mol import Atom, Residue, Molecule, pdbheader
+from msmtmol.element import get_pdb_element
+from pymsmtexp import *
+from operator import itemgetter
+import re
+
+CIF_EXTS = ('.cif', '.mmcif', '.cif.gz', '.mmcif.gz')
+
+#A quoted or bare token of a CIF line
+CIF_TOKEN = re.compile(r"""'(.*?)'(?=\s|$)|"(.*?)"(?=\s|$)|(\S+)""")
+
+#Items of the header, the first row is used if an item is in a loop
+CIF_HEADER_ITEMS = ['_exptl.method', '_refine.ls_d_res_high',
+                    '_reflns.d_resolution_high',
+                    '_em_3d_reconstruction.resolution',
+                    '_refine.ls_R_factor_R_free',
+                    '_pdbx_database_status.recvd_initial_deposition_date']
+
+#Columns of the _atom_site loop which are read, the first one of the names
+#in the file is used, and their default values
+ATOM_SITE_COLS = [('group_PDB',), ('id',), ('auth_atom_id', 'label_atom_id'),
+                  ('auth_comp_id', 'label_comp_id'),
+                  ('auth_asym_id', 'label_asym_id'),
+                  ('auth_seq_id', 'label_seq_id'), ('pdbx_PDB_ins_code',),
+                  ('type_symbol',), ('pdbx_formal_charge',), ('Cartn_x',),
+                  ('Cartn_y',), ('Cartn_z',), ('pdbx_PDB_model_num',)]
+ATOM_SITE_DEFAULTS = ['ATOM', '', '', '', '', '', '', '', '', '', '', '', '1']
+
+def is_cif_file(fname):
+    return fname.lower().endswith(CIF_EXTS)
+
+def split_cif_line(line):
+    """Split a line into the tokens, the quotes of the quoted tokens are
+       removed."""
+    if ("'" not in line) and ('"' not in line):
+        return line.split()
+    toks = []
+    for i, j, k in CIF_TOKEN.findall(line):
+        toks.append(i or j or k)
+    return toks
+
+def iter_cif_lines(fp):
+    """Yield the tokens of each line of a CIF file, a text field between two
+       lines beginning with semicolon is one token. The comments and empty
+       lines are skipped."""
+
+    text = None
+    for line in fp:
+        if text is not None:
+            if line[0:1] == ';':
+                yield [''.join(text).rstrip('\n')]
+                text = None
+            else:
+                text.append(line)
+        elif line[0:1] == ';':
+            text = [line[1:]]
+        elif line[0:1] == '#':
+            continue
+        else:
+            toks = split_cif_line(line)
+            if toks:
+                yield toks
+
+def get_cif_value(items, keys, default='UNKNOWN'):
+    """Get the first value of the keys which is not missing."""
+    for key in keys:
+        if items.get(key, '?') not in ['?', '.']:
+            return items[key]
+    return default
+
+def get_cif_header(items):
+    """Get the experiment information of the header items, as those read
+       from a PDB file."""
+
+    header = pdbheader()
+    method = get_cif_value(items, ['_exptl.method'])
+    if method != 'UNKNOWN':
+        header.method = method
+        header.exptyp = method.split()[-1]
+        if method == 'X-RAY DIFFRACTION':
+            header.exptyp = 'X-RAY'
+    reso = get_cif_value(items, ['_refine.ls_d_res_high',
+                                 '_reflns.d_resolution_high',
+                                 '_em_3d_reconstruction.resolution'])
+    try:
+        header.reso = float(reso)
+    except ValueError:
+        pass
+    try:
+        header.rfree = float(get_cif_value(items,
+                                           ['_refine.ls_R_factor_R_free']))
+    except ValueError:
+        pass
+    header.depdate = get_cif_value(items,
+        ['_pdbx_database_status.recvd_initial_deposition_date'])
+    return header
+
+def get_atom_site_cols(keys):
+    """Get the indexes of the columns in ATOM_SITE_COLS in the keys of the
+       _atom_site loop, the first name of a column which is in the keys is
+       used and the index is None if none of them is."""
+    colids = []
+    for names in ATOM_SITE_COLS:
+        colid = None
+        for name in names:
+            if '_atom_site.' + name in keys:
+                colid = keys.index('_atom_site.' + name)
+                break
+        colids.append(colid)
+    return colids
+
+def read_cif_model(fp, fname):
+    """Read the atoms and residues of the first model from an open mmCIF
+       file. Return the molecule, atom IDs and residue IDs as those of a PDB
+       file."""
+
+    items = {}
+    keys = [] #Keys of the current loop
+    toks = [] #Tokens of the used _atom_site columns, row by row
+    row = [] #Tokens of a row which is in several lines
+    inloop = None
+    atsite = False
+    key = None
+
+    for line in iter_cif_lines(fp):
+        tok0 = line[0]
+        if tok0 == 'loop_':
+            if atsite:
+                break
+            inloop = 'keys'
+            keys = []
+            continue
+        if inloop == 'keys':
+            if tok0[0:1] == '_':
+                keys.append(tok0)
+                continue
+            inloop = 'data'
+            atsite = (keys[0][0:11] == '_atom_site.')
+            if atsite:
+                ncol = len(keys)
+                colids = get_atom_site_cols(keys)
+                for i in [1, 9, 10, 11]:
+                    if colids[i] is None:
+                        raise pymsmtError('There is no %s column in the '
+                            '_atom_site loop of the mmCIF file : %s .'
+                            %(ATOM_SITE_COLS[i][0], fname))
+                usedids = [i for i in colids if i is not None]
+                getcols = itemgetter(*usedids)
+                imodel = colids[-1]
+                model = None
+        if inloop == 'data':
+            if tok0[0:1] == '_' or tok0[0:5] == 'data_':
+                if atsite:
+                    break
+                inloop = None
+            elif atsite:
+                #A row is usually in one line
+                if row or (len(line) != ncol):
+                    row = row + line
+                    if len(row) < ncol:
+                        continue
+                    line = row[:ncol]
+                    row = row[ncol:]
+                #Only the first model is read
+                if imodel is not None:
+                    if model is None:
+                        model = line[imodel]
+                    elif line[imodel] != model:
+                        break
+                toks.extend(getcols(line))
+                continue
+            else:
+                #The first row of the header items in a loop
+                for i in range(0, min(len(keys), len(line))):
+                    if keys[i] in CIF_HEADER_ITEMS and keys[i] not in items:
+                        items[keys[i]] = line[i]
+                keys = []
+                continue
+        #Items which are not in a loop
+        if key is not None:
+            items[key] = tok0
+            key = None
+        elif tok0[0:1] == '_':
+            if len(line) > 1:
+                items[tok0] = line[1]
+            else:
+                key = tok0
+
+    if not toks:
+        raise pymsmtError('There is no _atom_site record in the mmCIF file : '
+                          '%s .' %fname)
+
+    #Column by column
+    nused = len(usedids)
+    nrow = len(toks) // nused
+    cols = []
+    j = 0
+    for i in range(0, len(ATOM_SITE_COLS)):
+        if colids[i] is None:
+            cols.append([ATOM_SITE_DEFAULTS[i]] * nrow)
+        else:
+            cols.append(toks[j::nused])
+            j = j + 1
+    del toks
+    gtypes, atids, atnames, resnames, chains, seqids, inscodes, atomtypes, \
+        charges, crdxs, crdys, crdzs = cols[:-1]
+    atids = [int(i) for i in atids]
+    crdxs = [float(i) for i in crdxs]
+    crdys = [float(i) for i in crdys]
+    crdzs = [float(i) for i in crdzs]
+
+    Atoms = {}
+    Residues = {}
+    resids = []
+    conterdict = {}
+    resnamedict = {}
+    elmtdict = {}
+    lastres = None
+    resid = 0
+    for k in range(0, nrow):
+        atid = atids[k]
+        atname = atnames[k]
+        resname = resnames[k]
+
+        #A new residue
+        reskey = (chains[k], seqids[k], inscodes[k], resname)
+        if reskey != lastres:
+            resid = resid + 1
+            resids.append(resid)
+            resnamedict[resid] = resname
+            conterdict[resid] = []
+            lastres = reskey
+        conterdict[resid].append(atid)
+
+        charge = charges[k]
+        if charge in ['?', '.']:
+            charge = ''
+        if (resname, atname) not in elmtdict:
+            elmtdict[(resname, atname)] = get_pdb_element(resname, atname)
+        element = elmtdict[(resname, atname)]
+
+        if atid not in Atoms:
+            Atoms[atid] = Atom(gtypes[k], atid, atname, element, atomtypes[k],
+                               (crdxs[k], crdys[k], crdzs[k]), charge, resid,
+                               resname)
+        else:
+            raise pymsmtError('There are more than one atom with atom id '
+                              '%d in the mmCIF file : %s .' %(atid, fname))
+
+    for i in resids:
+        Residues[i] = Residue(i, resnamedict[i], sorted(conterdict[i]))
+
+    mol = Molecule(Atoms, Residues, get_cif_header(items))
+
+    return mol, atids, resids
@@ -2,12 +2,60 @@
 This is the code for reading and writting pdb files.
 """
 from __future__ import absolute_import, print_function
-from msmtmol.mol import Atom, Residue, Molecule, get_reslist
+from msmtmol.mol import Atom, Residue, Molecule, pdbheader, get_reslist
 from msmtmol.readmol2 import get_pure_type, get_pure_num
-from msmtmol.element import ionnamel, CoRadiiDict, METAL_PDB
+from msmtmol.element import ionnamel, CoRadiiDict, get_pdb_element
+from msmtmol.readcif import is_cif_file, read_cif_model
 from pymsmtexp import *
+import gzip
+import io
+import numpy
+
+def open_pdb_file(fname):
+    """Open a PDB file to read, which can be gzipped."""
+    if fname.endswith('.gz'):
+        return io.TextIOWrapper(gzip.open(fname, 'rb'), encoding='latin-1')
+    return open(fname, 'r')
+
+def read_pdb_header(header, line):
+    """Read the experiment information from a header line of PDB file."""
+
+    if line[0:6] == 'HEADER':
+        depdate = line[50:59].strip()
+        if depdate:
+            header.depdate = depdate
+    elif line[0:6] == 'EXPDTA':
+        method = line[10:79].strip()
+        if method:
+            header.method = method
+    elif 'RESOLUTION.' in line:
+        line = line.split()
+        try:
+            header.reso = float(line[-1])
+        except:
+            try:
+                header.reso = float(line[-2])
+            except:
+                header.reso = 'UNKNOWN'
+    elif 'EXPERIMENT TYPE' in line:
+        line = line.split()
+        header.exptyp = line[-1]
+        if line[-1] == 'DIFFRACTION' and line[-2] == 'X-RAY':
+            header.exptyp = 'X-RAY'
+    elif (line[0:10] == 'REMARK   3') and (':' in line) and \
+      (header.rfree == 'UNKNOWN'):
+        key, val = line[10:].split(':', 1)
+        if key.strip() in ['FREE R VALUE', 'FREE R VALUE (NO CUTOFF)']:
+            try:
+                header.rfree = float(val)
+            except ValueError:
+                pass
+
+def read_first_model(fp, fname):
+    """Read the atoms and residues of the first model from an open PDB file,
+       stop at the end of the model, so the file can be read on for the
+       coordinates of the other models."""
 
-def get_atominfo_fpdb(fname):
     Atoms = {}
     Residues = {}
 
@@ -15,8 +63,7 @@ def get_atominfo_fpdb(fname):
     resids = []
     resnamedict = {}
     conterdict = {}
-
-    fp = open(fname, 'r')
+    header = pdbheader()
 
     for line in fp:
         if (line[0:4] == "ATOM") or (line[0:6] == "HETATM"):
@@ -38,90 +85,205 @@ def get_atominfo_fpdb(fname):
             atomtype = line[76:78].strip(" ")
             charge = line[78:80]
 
-            if (resname, atname) in list(METAL_PDB.keys()):
-                element = METAL_PDB[(resname, atname)][0]
-            elif atname[0:2].upper() in ['CL', 'BR']:
-                element = atname[0].upper() + atname[1].lower()
-            else:
-                element = atname[0]
+            element = get_pdb_element(resname, atname)
 
-            if atid not in list(Atoms.keys()):
+            if atid not in Atoms:
                 Atoms[atid] = Atom(gtype, atid, atname, element, atomtype, crd, charge, resid, resname)
             else:
                 raise pymsmtError('There are more than one atom with atom id '
                                   '%d in the PDB file : %s .' %(atid, fname))
 
-            if resid not in resids:
+            if resid not in resnamedict:
                 resids.append(resid)
-            if resid not in list(resnamedict.keys()):
                 resnamedict[resid] = resname
-
-    fp.close()
+                conterdict[resid] = []
+            conterdict[resid].append(atid)
+        elif line[0:6] == 'ENDMDL':
+            break
+        else:
+            read_pdb_header(header, line)
 
     resids.sort()
 
-    for i in resids:
-        preconter = []
-        for j in atids:
-            if (Atoms[j].resid == i) and (j not in preconter):
-                preconter.append(j)
-        preconter.sort()
-        conterdict[i] = preconter
-
     for i in resids:
         resname = resnamedict[i]
-        resconter = conterdict[i]
+        resconter = sorted(conterdict[i])
         Residues[i] = Residue(i, resname, resconter)
 
     del resnamedict
     del conterdict
 
-    mol = Molecule(Atoms, Residues)
+    mol = Molecule(Atoms, Residues, header)
 
     return mol, atids, resids
 
-def writepdb(mol, atids, fname):
+def get_atominfo_fpdb(fname, fp=None):
+    """Read the atoms and residues from a PDB file, the experiment
+       information in the header is read in the same pass as mol.header.
+       If fp is given, the PDB file is read from this open text file (e.g.
+       a member of an archive) and fname is only used in the messages.
+       Only the first model of a PDB file with several models is read, see
+       get_models_fpdb for the other models. An mmCIF file (by the extension
+       of fname) is read by read_cif_model."""
 
-    wf = open(fname, 'w')
-    print('REMARK, BUILD BY MCPB.PY', file=wf)
+    if fp is None:
+        fp = open_pdb_file(fname)
+    if is_cif_file(fname):
+        mol, atids, resids = read_cif_model(fp, fname)
+    else:
+        mol, atids, resids = read_first_model(fp, fname)
+    fp.close()
+
+    return mol, atids, resids
+
+def model_error(nmodel, fname):
+    return pymsmtError('The atoms of model %d are not the same as the first '
+                       'model in the PDB file : %s .' %(nmodel, fname))
+
+def iter_model_crds(fp, fname, mol, atids):
+    """Yield the coordinates of each model, the first model is taken from
+       mol and the others are read from the rest of the open PDB file."""
+
+    try:
+        yield numpy.array([mol.atoms[i].crd for i in atids])
+
+        natom = len(atids)
+        nmodel = 1
+        crds = None
+        for line in fp:
+            if (line[0:4] == "ATOM") or (line[0:6] == "HETATM"):
+                if crds is None:
+                    crds = numpy.empty((natom, 3))
+                    nmodel = nmodel + 1
+                    n = 0
+                if (n >= natom) or (int(line[6:11]) != atids[n]):
+                    raise model_error(nmodel, fname)
+                crds[n] = (float(line[30:38]), float(line[38:46]),
+                           float(line[46:54]))
+                n = n + 1
+            elif (line[0:6] == 'ENDMDL') and (crds is not None):
+                if n != natom:
+                    raise model_error(nmodel, fname)
+                yield crds
+                crds = None
+        #The last model without ENDMDL
+        if crds is not None:
+            if n != natom:
+                raise model_error(nmodel, fname)
+            yield crds
+    finally:
+        fp.close()
 
+def get_models_fpdb(fname, fp=None):
+    """Read a PDB file with one or more models (e.g. an NMR ensemble or MD
+       snapshots). The topology is read from the first model, the returned
+       iterator yields the coordinates of each model (including the first
+       one) as an array in the order of atids, one model a time. All the
+       models share the molecule and should have the same atoms. Only the
+       first model of an mmCIF file is read."""
+
+    if fp is None:
+        fp = open_pdb_file(fname)
+    if is_cif_file(fname):
+        mol, atids, resids = read_cif_model(fp, fname)
+        fp.close()
+        return mol, atids, resids, iter([numpy.array([mol.atoms[i].crd
+                                                       for i in atids])])
+    mol, atids, resids = read_first_model(fp, fname)
+
+    return mol, atids, resids, iter_model_crds(fp, fname, mol, atids)
+
+def writepdb(mol, atids, fname):
+    """Write the residues of the atoms into a PDB file, with a TER line
+       before each N-terminal, nonstandard or water residue except the
+       first one. The lines are formatted at once and written in one call."""
+
+    #Residues in the order of the atoms
     resids = []
+    resset = set()
     for i in atids:
-        if mol.atoms[i].resid not in resids:
-            resids.append(mol.atoms[i].resid)
+        resid = mol.atoms[i].resid
+        if resid not in resset:
+            resset.add(resid)
+            resids.append(resid)
 
     reslist = get_reslist(mol, resids)
+    terset = set(reslist.nterm + reslist.nonstd + reslist.water)
+    terset.discard(min(resids))
 
-    terlist = reslist.nterm + reslist.nonstd + reslist.water
-
-    terlist = list(set(terlist))
-
+    #Records of the atoms, None for a TER line
+    recs = []
     for i in resids:
-        if (i in terlist) and (i != min(resids)):
-            print('TER', file=wf)
+        if i in terset:
+            recs.append(None)
+        resname = mol.residues[i].resname
         for j in mol.residues[i].resconter:
             atm = mol.atoms[j]
-            gtype = atm.gtype
-            atid = atm.atid
             if len(atm.atname) == 3:
                 atname = atm.atname
             else:
                 atname = atm.atname.center(4)
             crd = atm.crd
-            resid = atm.resid
-            resname = mol.residues[resid].resname
-            print("%-6s%5d %4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f" \
-                     %(gtype, atid, atname, resname, 'A', resid, crd[0], crd[1], crd[2], 1.00, 0.00), file=wf)
-    print('END', file=wf)
+            recs.append((atm.gtype, atm.atid, atname, resname, 'A', i,
+                         crd[0], crd[1], crd[2], 1.00, 0.00))
+
+    fmt = "%-6s%5d %4s %3s %1s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f"
+    lines = ['REMARK, BUILD BY MCPB.PY']
+    for rec in recs:
+        if rec is None:
+            lines.append('TER')
+        else:
+            lines.append(fmt %rec)
+    lines.append('END')
+
+    wf = open(fname, 'w')
+    wf.write('\n'.join(lines) + '\n')
     wf.close()
 
-def writepdbatm(pdbatm, fname):
-    wf = open(fname, 'a')
+class BufferedWriter:
+    """
+    Keep the lines written into a file in memory and write them with one open
+    call when it is flushed or closed. It can be used as the file of the print
+    function and of writepdbatm. The default mode is append, as writepdbatm.
+    """
+
+    def __init__(self, fname, mode='a'):
+        self.fname = fname
+        self.mode = mode
+        self.buf = []
+
+    def write(self, line):
+        self.buf.append(line)
+
+    def getvalue(self):
+        return ''.join(self.buf)
+
+    def flush(self):
+        if self.buf:
+            wf = open(self.fname, self.mode)
+            wf.write(self.getvalue())
+            wf.close()
+            self.buf = []
+            self.mode = 'a'
+
+    def close(self):
+        self.flush()
+
+def get_pdbatm_line(pdbatm):
     if len(pdbatm.atname) == 3:
-        print("%-6s%5d %4s %3s %1s%4d   %8.3f%8.3f%8.3f%6.2f%6.2f" %(pdbatm.tiker, pdbatm.atid,\
-          pdbatm.atname, pdbatm.resname, pdbatm.chainid, pdbatm.resid, pdbatm.crdx, pdbatm.crdy, \
-          pdbatm.crdz, pdbatm.occp, pdbatm.tempfac), file=wf)
+        atname = pdbatm.atname
+    else:
+        atname = pdbatm.atname.center(4)
+    return "%-6s%5d %4s %3s %1s%4d   %8.3f%8.3f%8.3f%6.2f%6.2f" %(pdbatm.tiker,
+           pdbatm.atid, atname, pdbatm.resname, pdbatm.chainid, pdbatm.resid,
+           pdbatm.crdx, pdbatm.crdy, pdbatm.crdz, pdbatm.occp, pdbatm.tempfac)
+
+def writepdbatm(pdbatm, fname):
+    """fname is a file name, which is opened to append the atom, or a
+       BufferedWriter."""
+    if isinstance(fname, BufferedWriter):
+        print(get_pdbatm_line(pdbatm), file=fname)
     else:
-        print("%-6s%5d %4s %3s %1s%4d   %8.3f%8.3f%8.3f%6.2f%6.2f" %(pdbatm.tiker, pdbatm.atid,\
-         pdbatm.atname.center(4), pdbatm.resname, pdbatm.chainid, pdbatm.resid, pdbatm.crdx, pdbatm.crdy, \
-         pdbatm.crdz, pdbatm.occp, pdbatm.tempfac), file=wf)
+        wf = open(fname, 'a')
+        print(get_pdbatm_line(pdbatm), file=wf)
+        wf.close()
@@ -1,68 +1,229 @@
 """
-This module is used for reading the rst file.
+This module is used for reading and writing the Amber restart (or inpcrd)
+files, in either the ASCII format or the NetCDF format (ioutfm=1 of sander
+and pmemd). The coordinates and velocities are (N, 3) arrays, the velocities
+are in the units of the file (angstrom/(1/20.455 ps)), and the box is an
+array of the three lengths and three angles.
 """
 from __future__ import absolute_import, print_function
+from pymsmtexp import *
 import numpy
+import warnings
 
-def read_rstf(fname):
+try:
+    from scipy.io import netcdf_file
+except ImportError:
+    from scipy.io.netcdf import netcdf_file
 
-    fp = open(fname, 'r')
-    Vp = []
-    crds = []
-
-    num = 1
-    #Read the rst file
-    for line in fp:
-        if num >= 2:
-            line = line.strip('\n')
-            line = line.split()
-            vals = []
-        
-            #get pure list
-            for i in line:
-                if i != '' and i != ' ':
-                    vals.append(i)
-
-            if len(vals) <= 2: #it is a atom number line
-                try:
-                    atnum = int(vals[0])
-                except:
-                    continue
-            elif len(vals) >= 3: #it is coordinate line
-                for i in vals:
-                    crds.append(i)
-
-        num = num + 1
-
-    #Re-arrange the data
-    crds = [float(i) for i in crds]
-    crds = crds[0:3*atnum] #the coordinates
-    boxs = crds[3*atnum:] #the last several values
-
-    for i in range(0, atnum):
-        Vp.append(numpy.array(crds[3*i:3*i+3]))
-    V = numpy.array(Vp)
-    return V
+NC_EXTS = ('.nc', '.ncrst', '.rst.nc', '.ncrestrt')
 
+#Scale factor of the velocities in the NetCDF restart files
+VEL_SCALE = 20.455
 
-def write_rstf(outf, coord):
+def is_netcdf_file(fname):
+    """NetCDF files begin with CDF, the HDF5 (NetCDF4) files are not
+       supported by scipy."""
+    fp = open(fname, 'rb')
+    magic = fp.read(4)
+    fp.close()
+    if magic == b'\x89HDF':
+        raise IOError('The NetCDF4/HDF5 file %s is not supported, please '
+                      'write the restart file in the NetCDF3 format.' %fname)
+    return magic[0:3] == b'CDF'
 
-    fp = open(outf, 'w')
+#------------------------------------------------------------------------------
+# ASCII restart file
+#------------------------------------------------------------------------------
 
-    num = len(coord)
-    rows = num//2 + num%2
-
-    print("Restart File Generated by pyMSMT", file=fp)
-    print(" ", num, file=fp)
-   
-    for i in range(rows):
-        if (2*i < num) and (2*i+1 < num):
-            print("%12.7f%12.7f%12.7f%12.7f%12.7f%12.7f", coord[2*i][0],
-                  coord[2*i][1], coord[2*i][2], coord[2*i+1][0],
-                  coord[2*i+1][1], coord[2*i+1][2], file=fp)
+def read_ascii_vals(lines):
+    """Read the values in the lines of 12-character fields (12.7f), or
+       separated by spaces if the lines are not in fixed width."""
+    lines = [i.rstrip() for i in lines]
+    lines = [i for i in lines if i]
+    if all([len(i) % 12 == 0 for i in lines]):
+        data = ''.join(lines).encode('ascii')
+        return numpy.frombuffer(data, dtype='S12').astype(float)
+    else:
+        return numpy.array(' '.join(lines).split(), dtype=float)
+
+def read_ascii_rst(fname, hasvel=None):
+    """The hasvel tells if there are velocities in the file, which is only
+       needed for a file of 2 atoms with one line after the coordinates
+       (the velocities and a box are both 6 values in one line)."""
+
+    fp = open(fname, 'r')
+    lines = fp.readlines()
+    fp.close()
+
+    #The second line has the atom number and the time
+    atnum = int(lines[1].split()[0])
+    lines = [i for i in lines[2:] if i.strip()]
+
+    #The coordinates and velocities take ceil(3N/6) lines each and the box is
+    #the last line alone, so they are told apart by the line numbers. Only
+    #for 1 or 2 atoms one line after the coordinates can be either of them
+    nline = (3 * atnum + 5) // 6
+    if len(lines) < nline:
+        raise ValueError('There are less than %d coordinates in the restart '
+                         'file %s .' %(atnum, fname))
+    crds = read_ascii_vals(lines[0:nline])
+    left = lines[nline:]
+    if hasvel is None:
+        if (nline > 1) or (len(left) != 1):
+            hasvel = (len(left) >= nline)
+        elif atnum == 1:
+            #The velocities of 1 atom are 3 values and a box is 6 values
+            hasvel = (len(read_ascii_vals(left)) == 3)
         else:
-            print("%12.7f%12.7f%12.7f", coord[2*i][0], coord[2*i][1],
-                  coord[2*i][2], file=fp)
+            warnings.warn('The line after the coordinates of the 2 atoms in '
+                          'the restart file %s is read as the box, it can '
+                          'also be the velocities.' %fname, pymsmtWarning)
+            hasvel = False
+
+    vels = None
+    box = None
+    if hasvel:
+        if len(left) < nline:
+            raise ValueError('There are not velocities in the restart file '
+                             '%s .' %fname)
+        vels = read_ascii_vals(left[0:nline])
+        left = left[nline:]
+    if left:
+        box = read_ascii_vals(left[-1:])
+        if len(box) == 3:
+            box = numpy.concatenate([box, [90.0, 90.0, 90.0]])
+
+    if len(crds) != 3 * atnum or (vels is not None and
+                                  len(vels) != 3 * atnum):
+        raise ValueError('The coordinates or velocities of %d atoms are not '
+                         'complete in the restart file %s .' %(atnum, fname))
+    crds = crds.reshape(atnum, 3)
+    if vels is not None:
+        vels = vels.reshape(atnum, 3)
+    return crds, vels, box
+
+def write_ascii_rst(outf, crds, vels=None, box=None,
+                    title='Restart File Generated by pyMSMT', time=None):
+
+    def get_lines(vals):
+        vals = numpy.asarray(vals, dtype=float).reshape(-1)
+        nrow = len(vals) // 6
+        text = ('%12.7f' * 6 + '\n') * nrow %tuple(vals[0:6*nrow])
+        if len(vals) > 6 * nrow:
+            text = text + ('%12.7f' * (len(vals) - 6*nrow) + '\n') \
+                   %tuple(vals[6*nrow:])
+        return text
+
+    num = len(crds)
+    if time is None:
+        head = '%s\n%6d\n' %(title, num)
+    else:
+        head = '%s\n%6d%15.7E\n' %(title, num, time)
+
+    fp = open(outf, 'w')
+    fp.write(head + get_lines(crds))
+    if vels is not None:
+        fp.write(get_lines(vels))
+    if box is not None:
+        fp.write(get_lines(box))
     fp.close()
 
+#------------------------------------------------------------------------------
+# NetCDF restart file
+#------------------------------------------------------------------------------
+
+def read_netcdf_rst(fname):
+
+    ncf = netcdf_file(fname, 'r', mmap=False)
+    crds = numpy.array(ncf.variables['coordinates'][:], dtype=float)
+    vels = None
+    box = None
+    if 'velocities' in ncf.variables:
+        vels = numpy.array(ncf.variables['velocities'][:], dtype=float)
+    if 'cell_lengths' in ncf.variables:
+        box = numpy.concatenate([ncf.variables['cell_lengths'][:],
+                                 ncf.variables['cell_angles'][:]])
+        box = numpy.array(box, dtype=float)
+    ncf.close()
+    return crds, vels, box
+
+def write_netcdf_rst(outf, crds, vels=None, box=None,
+                     title='Restart File Generated by pyMSMT', time=None):
+
+    num = len(crds)
+    ncf = netcdf_file(outf, 'w', version=2)
+    ncf.Conventions = 'AMBERRESTART'
+    ncf.ConventionVersion = '1.0'
+    ncf.program = 'pyMSMT'
+    ncf.programVersion = '1.0'
+    ncf.title = title
+    ncf.application = 'AMBER'
+
+    ncf.createDimension('spatial', 3)
+    ncf.createDimension('atom', num)
+    ncf.createDimension('label', 5)
+    ncf.createDimension('cell_spatial', 3)
+    ncf.createDimension('cell_angular', 3)
+
+    var = ncf.createVariable('spatial', 'c', ('spatial',))
+    var[:] = numpy.array(list('xyz'), dtype='c')
+    var = ncf.createVariable('time', 'd', ())
+    var.units = 'picosecond'
+    var.data[...] = 0.0 if time is None else time
+
+    var = ncf.createVariable('coordinates', 'd', ('atom', 'spatial'))
+    var.units = 'angstrom'
+    var[:] = numpy.asarray(crds, dtype=float)
+
+    if vels is not None:
+        var = ncf.createVariable('velocities', 'd', ('atom', 'spatial'))
+        var.units = 'angstrom/picosecond'
+        var.scale_factor = VEL_SCALE
+        var[:] = numpy.asarray(vels, dtype=float)
 
+    if box is not None:
+        var = ncf.createVariable('cell_spatial', 'c', ('cell_spatial',))
+        var[:] = numpy.array(list('abc'), dtype='c')
+        var = ncf.createVariable('cell_angular', 'c',
+                                 ('cell_angular', 'label'))
+        var[:] = numpy.array([list('alpha'), list('beta '), list('gamma')],
+                             dtype='c')
+        var = ncf.createVariable('cell_lengths', 'd', ('cell_spatial',))
+        var.units = 'angstrom'
+        var[:] = numpy.asarray(box[0:3], dtype=float)
+        var = ncf.createVariable('cell_angles', 'd', ('cell_angular',))
+        var.units = 'degree'
+        var[:] = numpy.asarray(box[3:6], dtype=float)
+
+    ncf.close()
+
+#------------------------------------------------------------------------------
+# Restart file in either format
+#------------------------------------------------------------------------------
+
+def read_rst(fname, hasvel=None):
+    """Read a restart file, return the coordinates, velocities (None if
+       there are not any) and box (None if there is not one). The hasvel is
+       only used by the ASCII files, see read_ascii_rst."""
+    if is_netcdf_file(fname):
+        return read_netcdf_rst(fname)
+    else:
+        return read_ascii_rst(fname, hasvel)
+
+def write_rst(outf, crds, vels=None, box=None, netcdf=None):
+    """Write a restart file, in the NetCDF format if netcdf is True or (if
+       it is None) the file name has a NetCDF extension."""
+    if netcdf is None:
+        netcdf = outf.lower().endswith(NC_EXTS)
+    if netcdf:
+        write_netcdf_rst(outf, crds, vels, box)
+    else:
+        write_ascii_rst(outf, crds, vels, box)
+
+def read_rstf(fname):
+    """Read the coordinates of a restart file as an (N, 3) array."""
+    return read_rst(fname)[0]
+
+def write_rstf(outf, coord):
+    """Write the coordinates into an ASCII restart file."""
+    write_ascii_rst(outf, coord)
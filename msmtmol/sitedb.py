@@ -0,0 +1,117 @@
+"""
+This module was written for saving the metal centers found by PdbSearcher.py
+into a SQLite database, which has three tables:
+  structures: one record for each PDB file, the source is the file or archive
+              in the list of PdbSearcher.py
+  sites: one record for each metal center
+  contacts: one record for each bond between a metal ion and a ligating atom
+The sites are indexed on the ion element, geometry, coordination sphere
+(ligating residue letters) and the structures on the resolution, e.g.
+  SELECT s.pdb, m.ion_resid, m.geo_rms FROM sites m
+  JOIN structures s ON m.structure_id = s.id
+  WHERE m.ion_element = 'Zn' AND m.geometry = '4Te'
+  AND m.coord_sphere = 'CCCC' AND s.resolution < 2.0;
+"""
+from __future__ import absolute_import, print_function
+import sqlite3
+
+SCHEMA = [
+"""CREATE TABLE IF NOT EXISTS structures (
+  id INTEGER PRIMARY KEY,
+  fname TEXT UNIQUE,
+  source TEXT,
+  pdb TEXT,
+  exp_tech TEXT,
+  resolution REAL,
+  rfree REAL,
+  depdate TEXT,
+  natoms INTEGER,
+  nions INTEGER)""",
+"""CREATE TABLE IF NOT EXISTS sites (
+  id INTEGER PRIMARY KEY,
+  structure_id INTEGER REFERENCES structures(id),
+  ion_element TEXT,
+  ion_resid INTEGER,
+  ion_resname TEXT,
+  ion_atid INTEGER,
+  ion_atname TEXT,
+  coord_sphere TEXT,
+  coord_number INTEGER,
+  geometry TEXT,
+  geo_rms REAL)""",
+"""CREATE TABLE IF NOT EXISTS contacts (
+  site_id INTEGER REFERENCES sites(id),
+  resid INTEGER,
+  resname TEXT,
+  atid INTEGER,
+  atname TEXT,
+  element TEXT,
+  distance REAL)""",
+"CREATE INDEX IF NOT EXISTS idx_structures_source ON structures(source)",
+"CREATE INDEX IF NOT EXISTS idx_structures_resolution "
+"ON structures(resolution)",
+"CREATE INDEX IF NOT EXISTS idx_sites_structure ON sites(structure_id)",
+"CREATE INDEX IF NOT EXISTS idx_sites_element ON sites(ion_element)",
+"CREATE INDEX IF NOT EXISTS idx_sites_geometry ON sites(geometry)",
+"CREATE INDEX IF NOT EXISTS idx_sites_sphere ON sites(coord_sphere)",
+"CREATE INDEX IF NOT EXISTS idx_contacts_site ON contacts(site_id)",
+]
+
+def open_site_db(dbfname):
+    """Open (or create) the metal site database, return the connection."""
+    conn = sqlite3.connect(dbfname)
+    for sql in SCHEMA:
+        conn.execute(sql)
+    conn.commit()
+    return conn
+
+def to_real(val):
+    """The UNKNOWN resolution or R value is saved as NULL."""
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+def delete_structure(conn, source):
+    """Delete the records of the PDB files from a file or archive in the
+       list."""
+    stids = "(SELECT id FROM structures WHERE source = ?)"
+    conn.execute("DELETE FROM contacts WHERE site_id IN (SELECT id FROM "
+                 "sites WHERE structure_id IN %s)" %stids, (source,))
+    conn.execute("DELETE FROM sites WHERE structure_id IN %s" %stids,
+                 (source,))
+    conn.execute("DELETE FROM structures WHERE source = ?", (source,))
+
+def insert_results(conn, results):
+    """Insert the search results of the PDB files in one transaction, the old
+       records of the same files or archives are replaced."""
+
+    cur = conn.cursor()
+    sources = set()
+    for res in results:
+        if res.source not in sources:
+            delete_structure(conn, res.source)
+            sources.add(res.source)
+        if res.error:
+            continue
+        pdb, exptyp, reso, rfree, depdate, natoms, nions = res.struct
+        cur.execute("INSERT INTO structures (fname, source, pdb, exp_tech, "
+                    "resolution, rfree, depdate, natoms, nions) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (res.fname, res.source, pdb, exptyp, to_real(reso),
+                     to_real(rfree), depdate, natoms, nions))
+        stid = cur.lastrowid
+        for site in res.sites:
+            elmt, resid, resname, atid, atname, reslets, geo, georms, \
+                contacts = site
+            cur.execute("INSERT INTO sites (structure_id, ion_element, "
+                        "ion_resid, ion_resname, ion_atid, ion_atname, "
+                        "coord_sphere, coord_number, geometry, geo_rms) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (stid, elmt, resid, resname, atid, atname, reslets,
+                         len(contacts), geo, to_real(georms)))
+            siteid = cur.lastrowid
+            cur.executemany("INSERT INTO contacts VALUES "
+                            "(?, ?, ?, ?, ?, ?, ?)",
+                            [(siteid,) + tuple(i) for i in contacts])
+    conn.commit()
@@ -32,17 +32,23 @@ from mcpb.gene_pre_frcmod_file import gene_pre_frcmod_file
 from mcpb.gene_final_frcmod_file import (gene_by_empirical_way,
           gene_by_QM_fitting_sem, gene_by_QM_fitting_zmatrix)
 from mcpb.amber_modeling import gene_leaprc
-from lib.lib import FF_DICT, ambv
+from mcpb.stage_cache import (StageCache, get_stage_key, get_pdb_records,
+          get_site_pdb_records)
+from lib.lib import FF_DICT, ambv, parmadd
 from msmtmol.element import resnamel
 from title import print_title
 from pymsmtexp import *
 import warnings
 import os
+import time
 from optparse import OptionParser
 
 parser = OptionParser("Usage: MCPB.py -i input_file -s/--step step_number \n"
                       "               [--logf Gaussian/GAMESS-US output logfile] \n"
-                      "               [--fchk Gaussian fchk file]")
+                      "               [--fchk Gaussian fchk file] \n"
+                      "               [--cache cache_directory] \n"
+                      "       MCPB.py --cache cache_directory "
+                      "[--cachestats] [--cachegc days]")
 parser.add_option("-i", dest="inputfile", type='string',
                   help="Input file name")
 parser.add_option("-s", "--step", dest="step", type='string',
@@ -51,6 +57,17 @@ parser.add_option("--logf", dest="logfile", type='string',
                   help="Gaussian/GAMESS-US output logfile")
 parser.add_option("--fchk", dest="fchkfile", type='string',
                   help="Gaussian fchk file")
+parser.add_option("--cache", dest="cachedir", type='string',
+                  help="Directory of the content-addressed cache of the "
+                       "stage outputs. A stage with the same inputs as a "
+                       "cached one is restored from the cache instead of "
+                       "being recomputed.")
+parser.add_option("--cachestats", dest="cachestats", action="store_true",
+                  default=False, help="Print the statistics of the cache.")
+parser.add_option("--cachegc", dest="cachegc", type='float',
+                  help="Remove the cached stages which were not used in "
+                       "the given number of days and the unreferenced "
+                       "cached files.")
 (options, args) = parser.parse_args()
 
 #==============================================================================
@@ -59,6 +76,19 @@ parser.add_option("--fchk", dest="fchkfile", type='string',
 # Print the title of the program
 version = '2.0'
 print_title('MCPB.py', version)
+
+#Cache maintenance, which does not need the input file
+if options.cachestats or (options.cachegc is not None):
+    if options.cachedir is None:
+        raise pymsmtError('Need to provide the cache directory with the '
+                          '--cache option.')
+    stgcache = StageCache(options.cachedir)
+    if options.cachegc is not None:
+        stgcache.gc(options.cachegc)
+    if options.cachestats:
+        stgcache.print_stats()
+    quit()
+
 options.step = options.step.lower()
 
 # Default values
@@ -545,6 +575,96 @@ else:
 ##tleap input file
 ileapf = gname + '_tleap.in'
 
+#==============================================================================
+# Stage cache
+#==============================================================================
+#The key of each stage is the content hash of its exact inputs: the input
+#variables it uses, the input files, the PDB atoms involved, the force field
+#files and the program version.
+stgcache = None
+if options.cachedir is not None:
+    stgcache = StageCache(options.cachedir)
+    stgversion = 'MCPB.py %s AmberTools%d' %(version, ambv)
+    fff = FF_DICT[ff_choice]
+
+    if (options.step in ['1', '1n', '1m', '1a']):
+        stgfields = [('ion_ids', ionids), ('additional_resids', addres),
+                     ('add_bonded_pairs', addbpairs), ('group_name', gname),
+                     ('force_field', ff_choice), ('cut_off', cutoff),
+                     ('water_model', watermodel), ('large_opt', largeopt),
+                     ('sqm_opt', sqmopt), ('smmodel_chg', smchg),
+                     ('lgmodel_chg', lgchg)]
+        stginfs = premol2fs + [fff.mol2f]
+        stgrecords = get_site_pdb_records(orpdbf, ionids, cutoff, addres,
+                                          addbpairs)
+        stgoutfs = [smpdbf, stpdbf, lgpdbf, stfpf, lgfpf, smresf]
+        stgoutfs = stgoutfs + [gname + i for i in ['_small_opt.com',
+                   '_small_fc.com', '_small_opt.inp', '_small_fc.inp',
+                   '_large_mk.com', '_large_mk.inp', '_small_sqm.in',
+                   '_small_sqm.out', '_large_sqm.in', '_large_sqm.out']]
+    elif (options.step in ['2', '2s', '2e', '2z']):
+        stgfields = [('ion_ids', ionids), ('force_field', ff_choice),
+                     ('gaff', gaff), ('water_model', watermodel),
+                     ('frcmod_files', frcmodfs)]
+        stginfs = premol2fs + [stpdbf, stfpf, smresf, smpdbf, fff.datf]
+        stginfs = stginfs + fff.frcmodfs + frcmodfs
+        if gaff == 1:
+            stginfs.append(parmadd + 'gaff.dat')
+        elif gaff == 2:
+            stginfs.append(parmadd + 'gaff2.dat')
+        if (options.step in ['2', '2s']):
+            stgfields = stgfields + [('software_version', g0x),
+                        ('scale_factor', scalef), ('bondfc_avg', bondfc_avg),
+                        ('anglefc_avg', anglefc_avg)]
+            stginfs = stginfs + [i for i in [fcfchkf, fclogf]
+                                 if os.path.exists(i)]
+        elif (options.step == '2z'):
+            stgfields.append(('scale_factor', scalef))
+            stginfs.append(fclogf)
+        stgrecords = []
+        stgoutfs = [prefcdf, finfcdf]
+    elif (options.step in ['3', '3a', '3b', '3c', '3d']):
+        stgfields = [('ion_ids', ionids), ('force_field', ff_choice),
+                     ('residue_names', mcresname),
+                     ('chgfix_resids', chgfix_resids),
+                     ('software_version', g0x), ('lgmodel_chg', lgchg)]
+        stginfs = [stpdbf, lgpdbf, stfpf, lgfpf, mklogf, fff.mol2f]
+        stginfs = stginfs + premol2fs
+        stgrecords = []
+        stgoutfs = ['resp1.in', 'resp2.in',
+                    os.path.basename(mklogf).strip('.log') + '.esp']
+        for i in ['resp1', 'resp2']:
+            stgoutfs = stgoutfs + [i + '.out', i + '.pch', i + '.chg',
+                                   i + '_calc.esp']
+        stgoutfs = stgoutfs + [i + '.mol2' for i in mcresname]
+    elif (options.step in ['4', '4b', '4n1', '4n2']):
+        stgfields = [('group_name', gname), ('ion_ids', ionids),
+                     ('ion_info', ioninfo), ('residue_names', mcresname),
+                     ('naa_mol2files', naamol2fs), ('force_field', ff_choice),
+                     ('gaff', gaff), ('frcmod_files', frcmodfs),
+                     ('final_frcmod', finfcdf), ('water_model', watermodel),
+                     ('ion_paraset', paraset)]
+        stginfs = list(ionmol2fs)
+        if options.step != '4n2':
+            stginfs = stginfs + [stpdbf, stfpf]
+        stgrecords = get_pdb_records(orpdbf)
+        stgoutfs = [fipdbf, ileapf]
+        for i in ioninfo[0::4]:
+            stgoutfs = stgoutfs + [i + '.cmd', i + '.lib', i + '.log']
+
+    stgkey = get_stage_key(options.step, stgversion, stgfields, stginfs,
+                           stgrecords)
+    print('The content hash of the inputs of step %s is : %s'
+          %(options.step, stgkey))
+
+if (stgcache is not None) and stgcache.fetch(stgkey):
+    print('Step %s has identical inputs as a cached one, its outputs '
+          'are restored from the cache.' %options.step)
+    stepdone = True
+else:
+    stepdone = False
+    stgtime = int(time.time())
+
 #==============================================================================
 # Step 1 General_modeling
 #==============================================================================
@@ -558,7 +678,9 @@ ileapf = gname + '_tleap.in'
 #1m) Just rename the metal ion to the AMBER ion atom type style
 #1a) Default. Automatically rename the atom type of the atoms in the metal
 #    complex.
-if (options.step == '1n'):
+if stepdone:
+    pass
+elif (options.step == '1n'):
     gene_model_files(orpdbf, ionids, addres, addbpairs, gname, ff_choice,
         premol2fs, cutoff, watermodel, 0, largeopt, sqmopt, smchg, lgchg)
 elif (options.step == '1m'):
@@ -631,6 +753,9 @@ elif (options.step == '4n2'): #normal nonbonded model
         ioninfo, mcresname, naamol2fs, ff_choice, gaff, frcmodfs, finfcdf,
         ileapf, 3, watermodel, paraset)
 
+if (stgcache is not None) and (not stepdone):
+    stgcache.store(stgkey, stgoutfs, stgtime)
+
 #Print the reference
 print("="*66)
 print("To cite MCPB.py please use the following reference:")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Filename: MCPBBatch.py
+"""
+This is the MCPBBatch.py program written to run MCPB.py on a batch of
+structures. Each structure in the manifest file is run in an isolated working
+directory, the structures are run in parallel with a bounded process pool, and
+the status, timing and error of each job are collected into a summary table.
+The failed jobs can be re-run selectively.
+"""
+from __future__ import print_function
+from mcpb.batch import read_manifest, run_batch, print_summary
+from title import print_title
+from pymsmtexp import *
+from optparse import OptionParser
+import os
+import sys
+
+parser = OptionParser("Usage: MCPBBatch.py -m manifest_file "
+                      "[-s/--steps steps] [-d/--dir batch_directory] \n"
+                      "                     [-n/--nproc process_number] "
+                      "[--cache cache_directory] \n"
+                      "                     [--failed] [--jobs job_names]")
+parser.add_option("-m", "--manifest", dest="manifestf", type='string',
+                  help="Manifest file name, each line contains a MCPB.py "
+                       "input file name and optionally the steps run for it, "
+                       "e.g. 1A5T/1A5T.in 1 2s 3 4")
+parser.add_option("-s", "--steps", dest="steps", type='string',
+                  default='1,2,3,4',
+                  help="Default steps run for the jobs without steps in the "
+                       "manifest file, separated by comma. Default is 1,2,3,4")
+parser.add_option("-d", "--dir", dest="batchdir", type='string',
+                  default='MCPBBatch',
+                  help="Directory of the job working directories and the "
+                       "summary table. Default is MCPBBatch")
+parser.add_option("-n", "--nproc", dest="nproc", type='int', default=1,
+                  help="Number of the jobs run at the same time. Default is 1")
+parser.add_option("--cache", dest="cachedir", type='string',
+                  help="Content-addressed cache directory of MCPB.py, which "
+                       "can be shared by the jobs")
+parser.add_option("--failed", dest="failed", action="store_true",
+                  default=False,
+                  help="Only re-run the jobs which failed or were not "
+                       "finished in a previous run, from the failed step")
+parser.add_option("--jobs", dest="jobnames", type='string',
+                  help="Only run the jobs with these names (the input file "
+                       "names without extension), separated by comma")
+(options, args) = parser.parse_args()
+
+version = '1.0'
+print_title('MCPBBatch.py', version)
+
+if options.manifestf is None:
+    raise pymsmtError('Need to provide the manifest file with the -m option.')
+if options.nproc < 1:
+    raise pymsmtError('The process number should be a positive integer.')
+
+steps = [i.strip().lower() for i in options.steps.split(',') if i.strip()]
+jobs = read_manifest(options.manifestf, steps)
+
+names = None
+if options.jobnames is not None:
+    names = [i.strip() for i in options.jobnames.split(',') if i.strip()]
+    for i in names:
+        if i not in [j.name for j in jobs]:
+            raise pymsmtError('There is no job named %s in the manifest file.'
+                              %i)
+
+#MCPB.py in the same directory as this program, otherwise the one in PATH
+mcpbpy = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MCPB.py')
+if os.path.exists(mcpbpy):
+    mcpbcmd = [sys.executable, mcpbpy]
+else:
+    mcpbcmd = ['MCPB.py']
+
+jobs = run_batch(jobs, options.batchdir, mcpbcmd, options.nproc,
+                 options.cachedir, options.failed, names)
+print_summary(jobs, os.path.join(options.batchdir, 'summary.txt'))
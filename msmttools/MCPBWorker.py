@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# Filename: MCPBWorker.py
+"""
+This is the MCPBWorker.py program written to run MCPB.py as a long-lived
+worker service. It starts a pool of worker processes once, which preload the
+force field library and parameter files, and then runs the jobs submitted by
+a directory-based queue or a local socket. The queue depth and the latency of
+the jobs are written into the metrics file of the queue directory and are
+returned by the stats request of the socket.
+The same program is used to submit a job, get the stats or stop the service.
+"""
+from __future__ import print_function
+from mcpb.worker import (WorkerService, start_service, serve, send_request,
+                         submit_to_queue)
+from title import print_title
+from pymsmtexp import *
+from optparse import OptionParser
+from lib.lib import FF_DICT
+import json
+import os
+try:
+    from shutil import which
+except ImportError:
+    from distutils.spawn import find_executable as which
+
+parser = OptionParser("Usage: MCPBWorker.py [-q/--queue queue_directory] "
+                      "[-n/--nproc process_number] \n"
+                      "                      [-p/--port port] "
+                      "[--ff force_fields] [--cache cache_directory] \n"
+                      "                      [--interval seconds] \n"
+                      "       MCPBWorker.py --submit input_file "
+                      "[-s/--steps steps] [--jobdir job_directory] \n"
+                      "                      [-q/--queue queue_directory | "
+                      "-p/--port port] \n"
+                      "       MCPBWorker.py --stats/--shutdown "
+                      "[-q/--queue queue_directory | -p/--port port]")
+parser.add_option("-q", "--queue", dest="queuedir", type='string',
+                  default='MCPBWorker',
+                  help="Queue directory, which has the incoming, running, "
+                       "done and failed directories of the job files and the "
+                       "metrics file. Default is MCPBWorker")
+parser.add_option("-n", "--nproc", dest="nproc", type='int', default=1,
+                  help="Number of the worker processes. Default is 1")
+parser.add_option("-p", "--port", dest="port", type='int',
+                  help="Port of the local socket on 127.0.0.1, the socket is "
+                       "not used if it is not given. The port 0 means any "
+                       "free port")
+parser.add_option("--ff", dest="ffchoices", type='string',
+                  help="Force fields preloaded by the workers, separated by "
+                       "comma. Default is all the force fields")
+parser.add_option("--cache", dest="cachedir", type='string',
+                  help="Content-addressed cache directory used by MCPB.py")
+parser.add_option("--interval", dest="interval", type='float', default=1.0,
+                  help="Time interval of polling the queue directory in "
+                       "seconds. Default is 1.0")
+parser.add_option("--submit", dest="submitf", type='string',
+                  help="Submit a job with this MCPB.py input file, the path "
+                       "is relative to the job directory")
+parser.add_option("-s", "--steps", dest="steps", type='string',
+                  default='1,2,3,4',
+                  help="Steps of the submitted job, separated by comma. "
+                       "Default is 1,2,3,4")
+parser.add_option("--jobdir", dest="jobdir", type='string', default='.',
+                  help="Job directory of the submitted job, which is the "
+                       "working directory of MCPB.py. Default is the current "
+                       "directory")
+parser.add_option("--stats", dest="stats", action="store_true",
+                  default=False, help="Print the metrics of the service")
+parser.add_option("--shutdown", dest="shutdown", action="store_true",
+                  default=False,
+                  help="Stop the service after the submitted jobs are "
+                       "finished")
+(options, args) = parser.parse_args()
+
+#Client mode
+if options.submitf is not None:
+    steps = [i.strip().lower() for i in options.steps.split(',') if i.strip()]
+    if options.port is not None:
+        reply = send_request(options.port, {'cmd': 'submit',
+                             'dir': os.path.abspath(options.jobdir),
+                             'input': options.submitf, 'steps': steps})
+        if not reply['ok']:
+            raise pymsmtError(reply['error'])
+        print("Job %s is submitted." %reply['id'])
+    else:
+        jobf = submit_to_queue(options.queuedir, options.jobdir,
+                               options.submitf, steps)
+        print("Job file %s is submitted." %jobf)
+    quit()
+elif options.stats:
+    if options.port is not None:
+        stats = send_request(options.port, {'cmd': 'stats'})['stats']
+    else:
+        metf = open(os.path.join(options.queuedir, 'metrics.json'), 'r')
+        stats = json.load(metf)
+        metf.close()
+    print(json.dumps(stats, indent=1, sort_keys=True))
+    quit()
+elif options.shutdown:
+    if options.port is not None:
+        send_request(options.port, {'cmd': 'shutdown'})
+    else:
+        open(os.path.join(options.queuedir, 'stop'), 'w').close()
+    print("The service will stop after the submitted jobs are finished.")
+    quit()
+
+#Service mode
+version = '1.0'
+print_title('MCPBWorker.py', version)
+
+if options.nproc < 1:
+    raise pymsmtError('The process number should be a positive integer.')
+
+#MCPB.py in the same directory as this program, otherwise the one in PATH
+mcpbpy = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MCPB.py')
+if not os.path.exists(mcpbpy):
+    mcpbpy = which('MCPB.py')
+    if mcpbpy is None:
+        raise pymsmtError('Could not find the MCPB.py program.')
+
+ffchoices = None
+if options.ffchoices is not None:
+    ffchoices = [i.strip() for i in options.ffchoices.split(',') if i.strip()]
+    for i in ffchoices:
+        if i not in list(FF_DICT.keys()):
+            raise pymsmtError('There is no force field named %s.' %i)
+
+service = WorkerService(mcpbpy, options.queuedir, options.nproc, ffchoices,
+                        options.cachedir)
+port = start_service(service, options.port)
+
+print("The service is started with %d worker processes." %options.nproc)
+print("The queue directory is %s" %service.queuedir)
+if port is not None:
+    print("The socket is listening on 127.0.0.1:%d" %port)
+
+serve(service, options.interval)
+print("The service is stopped.")
@@ -12,30 +12,28 @@ The 12-6-4 LJ-type nonbonded model was proposed in:
 """
 from __future__ import division, print_function
 
-# OpenMM Imports
-import simtk.openmm as mm  #about force field
-import simtk.openmm.app as app #about algorithm
-
 # ParmEd imports
-from parmed import unit as u
-from parmed.amber import AmberParm
-from parmed.amber.mask import AmberMask
-from parmed.openmm.reporters import (StateDataReporter, NetCDFReporter,
-                                     RestartReporter)
+from parmed.amber import AmberFormat
 
 # pyMSMT Imports
 from msmtmol.getlist import get_blist, get_all_list
-from msmtmol.cal import calc_bond, calc_angle, calc_dih
+from msmtmol.cal import calc_bond
 from msmtmol.rstfile import read_rstf
-from msmtmol.element import Atnum, CoRadiiDict
-from api.AmberParm import read_amber_prm
+from msmtmol.element import CoRadiiDict
+from api.AmberParm import read_amber_prm, get_mask_atids
+from api.C4Context import C4Context, get_geo_ids, get_geo_vals, get_geo_diff
+from api.C4Ensemble import C4Ensemble, read_ensemble_file
+from api.C4Cache import C4Cache, get_settings_key
 from title import print_title
+from pymsmtexp import *
 
 # Other Imports
 from optparse import OptionParser
+import multiprocessing
 import os
-import sys
+import threading
 import numpy
+from scipy.spatial import cKDTree
 
 #-----------------------------------------------------------------------------#
 # Functions
@@ -53,123 +51,69 @@ def get_typ_dict(typinds, typs):
             typdict[typinds[i]].append(typs[i])
     return typdict
 
-def get_rmsd(initparas):
-
-    global idxs, mcresids2, atompairs
-
-    #Modify the C4 terms in the prmtop file
-    for i in range(0, len(idxs)):
-        prmtop.parm_data['LENNARD_JONES_CCOEF'][idxs[i]] = initparas[i]
-
-    #Overwrite the prmtop file
-    prmtop.write_parm('OptC4.top')
-
-    #Perform the OpenMM optimization
-    #Use AmberParm function to transfer the topology and
-    #coordinate file to the object OpenMM can use
-    Ambermol = AmberParm('OptC4.top', options.cfile)
-
-    # Create the OpenMM system
-    print('Creating OpenMM System')
-    if options.simupha == 'gas':
-        system = Ambermol.createSystem(nonbondedMethod=app.NoCutoff)
-    elif options.simupha == 'liquid':
-        system = Ambermol.createSystem(nonbondedMethod=app.PME,
-                                       nonbondedCutoff=8.0*u.angstroms,
-                                       constraints=app.HBonds,)
-
-    #Add restraints
-    force = mm.CustomExternalForce("k*((x-x0)^2+(y-y0)^2+(z-z0)^2)")
-    force.addGlobalParameter("k", 200.0)
-    force.addPerParticleParameter("x0")
-    force.addPerParticleParameter("y0")
-    force.addPerParticleParameter("z0")
-    #for i in range(0, len(Ambermol.atoms)):
-    for i, atom_crd in enumerate(Ambermol.positions):
-        #if (Ambermol.atoms[i].residue.number+1 not in mcresids2) and \
-        if (i+1 not in mcresids2) and \
-          (Ambermol.atoms[i].residue.name not in ['WAT', 'HOH']) and \
-          (Ambermol.atoms[i].name in ['CA', 'C', 'N']):
-            force.addParticle(i, atom_crd.value_in_unit(u.nanometers))
-    system.addForce(force)
-
-    # Create the integrator to do Langevin dynamics
-    # Temperature of heat bath, Friction coefficient, Time step
-    integrator = mm.LangevinIntegrator(300*u.kelvin, 1.0/u.picoseconds,
-                                       1.0*u.femtoseconds,)
-
-    # Define the platform to use; CUDA, OpenCL, CPU, or Reference. Or do not
-    # specify the platform to use the default (fastest) platform
-    # Create the Simulation object
-    if options.platf == 'ref':
-        platform = mm.Platform.getPlatformByName('Reference')
-        sim = app.Simulation(Ambermol.topology, system, integrator, platform)
-    elif options.platf == 'cpu':
-        platform = mm.Platform.getPlatformByName('CPU')
-        sim = app.Simulation(Ambermol.topology, system, integrator, platform)
-    elif options.platf == 'cuda':
-        platform = mm.Platform.getPlatformByName('CUDA')
-        prop = dict(CudaPrecision=options.presn)
-        sim = app.Simulation(Ambermol.topology, system, integrator, platform,
-                             prop)
-    elif options.platf == 'opencl':
-        platform = mm.Platform.getPlatformByName('OpenCL')
-        prop = dict(OpenCLPrecision=options.presn)
-        sim = app.Simulation(Ambermol.topology, system, integrator, platform,
-                             prop)
-
-    # Set the particle positions
-    sim.context.setPositions(Ambermol.positions)
-
-    # Output the rst file
-    restrt = RestartReporter(options.rfile, 100, write_velocities=False)
-    sim.reporters.append(restrt)
-
-    # Minimize the energy
-    print('Minimizing energy ' + str(options.maxsteps) + ' steps.')
-    sim.minimizeEnergy(maxIterations=options.maxsteps)
-
-    # Overwrite the final file
-    state = sim.context.getState(getPositions=True, enforcePeriodicBox=True)
-    restrt.report(sim, state)
-
-    val_aft_min = []
-    crds_aft_min = read_rstf(options.rfile)
-    for i in atompairs:
-        if len(i) == 2:
-            crd1 = crds_aft_min[i[0]-1]
-            crd2 = crds_aft_min[i[1]-1]
-            bond = calc_bond(crd1, crd2)
-            val_aft_min.append(('bond', bond))
-        elif len(i) == 3:
-            crd1 = crds_aft_min[i[0]-1]
-            crd2 = crds_aft_min[i[1]-1]
-            crd3 = crds_aft_min[i[2]-1]
-            angle = calc_angle(crd1, crd2, crd3)
-            val_aft_min.append(('angle', angle))
-        elif len(i) == 4:
-            crd1 = crds_aft_min[i[0]-1]
-            crd2 = crds_aft_min[i[1]-1]
-            crd3 = crds_aft_min[i[2]-1]
-            crd4 = crds_aft_min[i[3]-1]
-            dih = calc_dih(crd1, crd2, crd3, crd4)
-            val_aft_min.append(('dih', dih))
-
-    valdiffs = []
-    for i in range(0, len(atompairs)):
-        if val_bf_min[i][0] == 'bond':
-            valdiff = abs(val_aft_min[i][1] - val_bf_min[i][1]) * 1.0 / 100.0
-        elif val_bf_min[i][0] == 'angle':
-            valdiff = abs(val_aft_min[i][1] - val_bf_min[i][1]) * 1.0 / 2.0
-        elif val_bf_min[i][0] == 'dih':
-            valdiff = abs(val_aft_min[i][1] - val_bf_min[i][1])
-            if (360.0 - valdiff < valdiff):
-                valdiff = 360.0 - valdiff
-        valdiffs.append(valdiff)
-
-    fnldiff = numpy.sum(valdiffs)
+def get_site_atids(mol, atids, metids, radius):
+    """Get the IDs of the atoms within the radius of any metal ion, with a
+       k-d tree of the coordinates."""
+    crds = numpy.array([mol.atoms[i].crd for i in atids])
+    tree = cKDTree(crds)
+    siteids = set()
+    for i in metids:
+        for j in tree.query_ball_point(mol.atoms[i].crd, radius):
+            siteids.add(atids[j])
+    return sorted(siteids)
+
+def min_rmsd(initparas, c4ctx, idxs, geoids, val_bf_min, options,
+             crds=None):
+    """Minimize the structure with the C4 terms (from the coordinates given
+       or the coordinate file), return the error and the coordinates."""
+
+    #Modify the C4 terms in the live OpenMM context
+    c4ctx.set_c4(idxs, initparas)
+    crds = c4ctx.minimize(options.maxsteps, options.tol, crds)
+
+    val_aft_min = get_geo_vals(crds * 10.0, geoids)
+    fnldiff = get_geo_diff(val_aft_min, val_bf_min)
+    return fnldiff, crds
+
+def get_warm_start(initparas, c4ctx, idxs, start, options):
+    """Get the coordinates of a warm start (the C4 terms and the coordinates
+       minimized with them) if they can follow the C4 terms, else None."""
+
+    if start is None:
+        return None
+    return c4ctx.check_start(idxs, initparas, start, options.tol)
+
+def get_rmsd(initparas, c4ctxs, c4cache, idxs, geoids, val_bf_min,
+             options, ictx=0, start=None):
+
+    #The C4 terms which are evaluated before
+    fnldiff = c4cache.get(initparas)
+    if fnldiff is not None:
+        print(fnldiff, '(cached)')
+        return fnldiff
+
+    # Minimize the energy. For a warm start, it is from the given coordinates
+    # (of the base point of a gradient) or those of the nearest C4 terms
+    # evaluated before
+    crds = None
+    if options.warm:
+        if start is None:
+            crds = get_warm_start(initparas, c4ctxs[ictx], idxs,
+                                  c4cache.get_start(initparas), options)
+        else:
+            crds = get_warm_start(initparas, c4ctxs[ictx], idxs, start,
+                                  options)
+    fnldiff, crds = min_rmsd(initparas, c4ctxs[ictx], idxs, geoids,
+                             val_bf_min, options, crds)
     print(fnldiff)
 
+    #The structures minimized from a given start are not used as the starts
+    #of the others, which are then the same in any order of the threads
+    if start is None:
+        c4cache.put(initparas, fnldiff, crds)
+    else:
+        c4cache.put(initparas, fnldiff)
+
     return fnldiff
 
     #print('Calculate the RMSD')
@@ -187,6 +131,274 @@ def get_rmsd(initparas):
     #print('RMSD is: ', rmsd)
     #return rmsd
 
+def get_stencil(initparas, stepsize):
+    """The points of the forward finite-difference gradient."""
+    paras = [numpy.array(initparas, dtype=float)]
+    for i in range(0, len(initparas)):
+        para = numpy.array(initparas, dtype=float)
+        para[i] = para[i] + stepsize
+        paras.append(para)
+    return paras
+
+def get_grad(initparas, c4ctxs, c4cache, idxs, geoids, val_bf_min,
+             options):
+    """Forward finite-difference gradient of get_rmsd with the step size, the
+       points of the stencil are minimized at the same time, one context in
+       each thread."""
+
+    paras = get_stencil(initparas, options.stepsize)
+
+    vals = [None] * len(paras)
+    todo = list(range(0, len(paras)))
+    start = None
+    if options.warm:
+        #The other points are all minimized from the structure of the base
+        #point, which is evaluated first
+        vals[0] = get_rmsd(paras[0], c4ctxs, c4cache, idxs, geoids,
+                           val_bf_min, options)
+        crds = c4cache.get_crds(paras[0])
+        if crds is None:
+            crds = get_warm_start(paras[0], c4ctxs[0], idxs,
+                                  c4cache.get_start(paras[0]), options)
+            crds = min_rmsd(paras[0], c4ctxs[0], idxs, geoids, val_bf_min,
+                            options, crds)[1]
+        start = (paras[0], crds)
+        todo = todo[1:]
+    lock = threading.Lock()
+    errs = []
+
+    def worker(ictx):
+        while True:
+            with lock:
+                if not todo or errs:
+                    return
+                i = todo.pop(0)
+            try:
+                vals[i] = get_rmsd(paras[i], c4ctxs, c4cache, idxs,
+                                   geoids, val_bf_min, options, ictx, start)
+            except Exception as e:
+                with lock:
+                    errs.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,))
+               for i in range(0, len(c4ctxs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errs:
+        raise errs[0]
+
+    grad = (numpy.array(vals[1:]) - vals[0]) / options.stepsize
+    return grad
+
+def get_ens_rmsd(initparas, c4ens, c4cache, options):
+    """Weighted average error of the structures in the ensemble."""
+
+    #The C4 terms which are evaluated before
+    fnldiff = c4cache.get(initparas)
+    if fnldiff is not None:
+        print(fnldiff, '(cached)')
+        return fnldiff
+
+    fnldiff = c4ens.evaluate([initparas])[0]
+    print(fnldiff)
+    c4cache.put(initparas, fnldiff)
+    return fnldiff
+
+def get_ens_grad(initparas, c4ens, c4cache, options):
+    """Forward finite-difference gradient of get_ens_rmsd, all the points of
+       the stencil are sent to the workers at once."""
+
+    paras = get_stencil(initparas, options.stepsize)
+    vals = [c4cache.get(i) for i in paras]
+    todo = [i for i in range(0, len(paras)) if vals[i] is None]
+    if todo:
+        for i, val in zip(todo, c4ens.evaluate([paras[i] for i in todo])):
+            vals[i] = val
+            c4cache.put(paras[i], val)
+
+    grad = (numpy.array(vals[1:]) - vals[0]) / options.stepsize
+    return grad
+
+def get_c4_site(pfile, cfile, c4pfile, options):
+    """Get the metal site of a structure: add the C4 terms to the topology
+       file (saved as c4pfile) and get the C4 terms of the metal site, the
+       bonds, angles and dihedrals of it and their values."""
+
+    #Get the metal ion ids
+    crds_bf_min = read_rstf(cfile)
+    metids = get_mask_atids(AmberFormat(pfile), crds_bf_min, options.ion_mask)
+    if not metids:
+        raise pymsmtError('No atom is selected by the Amber mask %s .'
+                          %options.ion_mask)
+
+    #Get the metal center information from prmtop and coordinate files, only
+    #the residues around the metal ions are read
+    prmtop, mol, atids, resids = read_amber_prm(pfile, cfile, metids,
+                                                options.radius)
+
+    mettyps = []      #Amber Atom Type
+    mettypinds = []   #Atom Type Index
+    for j in metids:
+        i = j - 1
+        atyp = prmtop.parm_data['AMBER_ATOM_TYPE'][i]
+        mettyps.append(atyp)
+        mettypind = prmtop.parm_data['ATOM_TYPE_INDEX'][i]
+        mettypinds.append(mettypind)
+
+    #Only the atoms around the metal ions are used to get the bonds, angles and
+    #dihedrals, the atom IDs are those in the topology file
+    siteids = get_site_atids(mol, atids, metids, options.radius)
+    print('%d atoms are within %.1f angstroms of the metal ions.'
+          %(len(siteids), options.radius))
+
+    blist = get_blist(mol, siteids)
+    all_list = get_all_list(mol, blist, siteids, 8.0)
+    alist = all_list.anglist
+    dlist = all_list.dihlist
+
+    smcids = [] #Metal site ligating atom IDs
+    mcresids = []  #Metal Site Residue IDs
+    atompairs = [] #Distance pair
+    for i in metids:
+        crdi = mol.atoms[i].crd
+        atmi = mol.atoms[i].element
+        radiusi = CoRadiiDict[atmi]
+        for j in siteids:
+            if j != i:
+                crdj = mol.atoms[j].crd
+                atmj = mol.atoms[j].element
+                dis = calc_bond(crdi, crdj)
+                radiusj = CoRadiiDict[atmj]
+                radiusij = radiusi + radiusj
+                if (dis <= radiusij + 0.4) and (dis >= 0.1) and (atmj != 'H'):
+                    smcids.append(j)
+                    atompairs.append((i, j))
+                    if mol.atoms[j].resid not in mcresids:
+                        mcresids.append(mol.atoms[j].resid)
+
+    for i in alist:
+        if len(i) != 3:
+            raise ValueError('More than 3 atoms in one angle! ' + i)
+        j = [k-1 for k in i]
+        atnums = [prmtop.parm_data['ATOMIC_NUMBER'][l] for l in j]
+        if (list(set(metids) & set(i)) != []) and (1 not in atnums):
+            atompairs.append(i)
+
+    for i in dlist:
+        if len(i) != 4:
+            raise ValueError('More than 4 atoms in one dihedral! ' + i)
+        j = [k-1 for k in i]
+        atnums = [prmtop.parm_data['ATOMIC_NUMBER'][l] for l in j]
+        if (list(set(metids) & set(i)) != []) and (1 not in atnums):
+            atompairs.append(i)
+
+    #Add metal ion IDs to the Metal Site Residue IDs
+    mcresids2 = mcresids
+    for i in metids:
+        mcresids2.append(mol.atoms[i].resid)
+    mcresids2 = list(set(mcresids2))
+    mcresids2.sort()
+
+    print('Residues in the metal site: ', mcresids2)
+
+    mcids = []  #Metal site atom IDs
+    if options.model == 1: #Small model
+        mcids = smcids
+    elif options.model == 2: #Big model
+        for i in mcresids:
+            for j in mol.residues[i].resconter:
+                if mol.atoms[j].element != 'H':
+                    mcids.append(j)
+
+    #Calculate the distances between metal ion and ligating atoms
+    geoids = get_geo_ids(atompairs)
+    val_bf_min = get_geo_vals(crds_bf_min, geoids)
+
+    #print("Bond, angle and dihedral before minimization...")
+    #print(val_bf_min)
+
+    #Get the Amber mask of the metal center complex and print it into ptraj.in file
+
+    #Print the parmed input file, add new LJ types to the bonded atoms
+    maskns = []
+    for i in smcids:
+        maskn = str(mol.atoms[i].resid) + '@' + mol.atoms[i].atname
+        maskns.append(maskn)
+
+    parmedf = os.path.join(options.workdir, 'OptC4_parmed.in')
+
+    w_parmedf = open(parmedf, 'w')
+    print("add12_6_4 " + options.ion_mask, file=w_parmedf)
+    print("outparm %s" %c4pfile, file=w_parmedf)
+    print("quit", file=w_parmedf)
+    w_parmedf.close()
+
+    os.system("parmed -O -i %s -p %s -c %s" %(parmedf, pfile, cfile))
+
+    #Get the new molecule
+    prmtop, mol, atids, resids = read_amber_prm(c4pfile, cfile, metids,
+                                                options.radius)
+    c4terms = prmtop.parm_data['LENNARD_JONES_CCOEF']
+
+    mctyps = [] #Metal Site Atom Type
+    mctypinds = [] #Metal Site Atom Type Index
+    num = 0
+    for j in mcids:
+        k = j - 1
+        #assign new Amber atom types
+        #prmtop.parm_data['AMBER_ATOM_TYPE'][k] = 'X' + str(num)
+        atyp = prmtop.parm_data['AMBER_ATOM_TYPE'][k]
+        mctyps.append(atyp)
+        mctypind = prmtop.parm_data['ATOM_TYPE_INDEX'][k]
+        mctypinds.append(mctypind)
+        num = num + 1
+
+    #Get the atom type dictionary for people to see
+    mettypdict = get_typ_dict(mettypinds, mettyps)
+    mctypdict = get_typ_dict(mctypinds, mctyps)
+
+    print('The following is the dictionary of the atom types: ')
+    print(mettypdict)
+    print(mctypdict)
+
+    #Delete the repeat ATOM_TYPE_INDEX
+    mettypinds = list(set(mettypinds))
+    mettypinds.sort()
+    mctypinds = list(set(mctypinds))
+    mctypinds.sort()
+
+    #Detect the C4 terms which relates to the metal center complex
+    ntyps = prmtop.parm_data['POINTERS'][1]
+
+    idxs = [] #Index of C4 terms which needs to modify
+    iddict = {} #Dictionary of idx corresponding to ATOM_TYPE_INDEX pair
+    for i in mettypinds:
+        j = i - 1
+        for k in mctypinds:
+            l = k - 1
+            if j < l:
+                idx = prmtop.parm_data['NONBONDED_PARM_INDEX'][ntyps*j+l] - 1
+            else:
+                idx = prmtop.parm_data['NONBONDED_PARM_INDEX'][ntyps*l+j] - 1
+            idxs.append(idx)
+            iddict[idx] = (i, k)
+
+    idxs.sort()
+    initparas = [c4terms[i] for i in idxs]
+
+    #The C4 terms are named by the atom types, which are the same in the
+    #structures of an ensemble
+    c4keys = []
+    for i in idxs:
+        c4keys.append((tuple(sorted(mettypdict[iddict[i][0]])),
+                       tuple(sorted(mctypdict[iddict[i][1]]))))
+
+    print('Initial C4 parameters are : ', initparas)
+
+    return mcresids2, idxs, c4keys, initparas, geoids, val_bf_min
+
 #-----------------------------------------------------------------------------#
 # Main Program
 #-----------------------------------------------------------------------------#
@@ -198,20 +410,30 @@ parser = OptionParser("Usage: OptC4.py -m amber_mask -p topology_file "
                       "                [--size optimization_step_size] "
                       "[--method optimization_method] \n"
                       "                [--platform device_platform] "
-                      "[--model metal_complex_model]")
+                      "[--model metal_complex_model] \n"
+                      "                [--workdir working_directory] "
+                      "[--nproc parallel_contexts] \n"
+                      "                [--log evaluation_log] [--warm] "
+                      "[--tol minimization_tolerance] \n"
+                      "                [--radius site_radius] "
+                      "[--ensemble ensemble_file]")
 
 parser.set_defaults(simupha='gas', maxsteps=1000, stepsize=10.0, minm='bfgs',
-                    platf='cpu', presn='single', model=1)
+                    platf='cpu', presn='single', model=1, workdir='.',
+                    nproc=1, logf=None, warm=False, tol=None, radius=10.0,
+                    ensf=None)
 
 parser.add_option("-m", dest="ion_mask", type='string', help="Amber mask of "
                   "the center metal ion")
 parser.add_option("-p", dest="pfile", type='string', help="Topology file")
 parser.add_option("-c", dest="cfile", type='string', help="Coordinate file")
-parser.add_option("-r", dest="rfile", type='string', help="Restart file")
+parser.add_option("-r", dest="rfile", type='string', help="Restart file, "
+                  "the structure minimized with the final parameters is "
+                  "written into it")
 parser.add_option("--maxsteps", dest="maxsteps", type='int', \
                   help="Maximum minimization steps performed by OpenMM "
-                       "in each parameter optimization cycle. "
-                       "[Default: 1000]")
+                       "in each parameter optimization cycle, it is not used "
+                       "with --warm. [Default: 1000]")
 parser.add_option("--phase", dest="simupha", type='string', \
                   help="Simulation phase, either gas or liquid. "
                        "[Default: gas]")
@@ -246,6 +468,56 @@ parser.add_option("--model", dest="model", type='int', \
                   "binding heavy atoms) while 2 means a big (contains the "
                   "metal ion and heavy atoms in the ligating residues). "
                   "[Default: 1]")
+parser.add_option("--workdir", dest="workdir", type='string', \
+                  help="Directory of the files generated by the program, "
+                       "which are OptC4_parmed.in and the "
+                       "topology file with the C4 terms (the name of the "
+                       "topology file with a .c4 extension). [Default: .]")
+parser.add_option("--nproc", dest="nproc", type='int', \
+                  help="Number of the OpenMM contexts used to compute the "
+                       "finite-difference gradient of the cg, bfgs and slsqp "
+                       "methods at the same time, the CPU threads are divided "
+                       "among them. [Default: 1]")
+parser.add_option("--log", dest="logf", type='string', \
+                  help="Log file of the evaluated C4 terms and their "
+                       "objective values. The evaluations are appended to "
+                       "it, and a restarted run with the same inputs and "
+                       "settings reads them instead of minimizing again. "
+                       "[Default: no log file]")
+parser.add_option("--warm", dest="warm", action="store_true", \
+                  help="Start each minimization from the minimized "
+                       "coordinates of the nearest C4 terms evaluated before "
+                       "in the run instead of the coordinate file. The "
+                       "points of a finite-difference gradient all start "
+                       "from the structure of its base point. It needs a "
+                       "small --tol (e.g. 0.1), since a warm start is only "
+                       "used if the new C4 terms change its forces by ten "
+                       "times the tolerance (or the force left in it) at "
+                       "least, else the minimization is from the coordinate "
+                       "file. The minimizations only stop at the convergence "
+                       "(--maxsteps is not used), and it can not be used with "
+                       "--log since the objective values depend on the "
+                       "evaluations before.")
+parser.add_option("--tol", dest="tol", type='float', \
+                  help="Convergence tolerance of the minimization: it stops "
+                       "when the root-mean-square force is below it "
+                       "(kJ/mol/nm). [Default: 10.0, the default of OpenMM]")
+parser.add_option("--radius", dest="radius", type='float', \
+                  help="Radius (in angstrom) around the metal ions. The "
+                       "bonds, angles and dihedrals of the metal site are "
+                       "searched among the atoms within it, instead of all "
+                       "the atoms in the topology file. [Default: 10.0]")
+parser.add_option("--ensemble", dest="ensf", type='string', \
+                  help="Ensemble file of several structures of the metal "
+                       "site (e.g. different PDB entries or MD snapshots), "
+                       "the C4 terms are optimized against all of them "
+                       "instead of the -p and -c files. Each line has a "
+                       "topology file, a coordinate file and optionally a "
+                       "weight [Default: 1.0] and a restart file [Default: "
+                       "the -r file with the structure number appended]. "
+                       "Each structure is minimized in its own process and "
+                       "the objective is the weighted average of their "
+                       "errors.")
 (options, args) = parser.parse_args()
 
 # Print the title of the program
@@ -257,192 +529,132 @@ options.simupha=options.simupha.lower()
 options.minm=options.minm.lower()
 options.platf=options.platf.lower()
 
-#Get the metal center information from prmtop and coordinate files
-prmtop, mol, atids, resids = read_amber_prm(options.pfile, options.cfile)
-mask = AmberMask(prmtop, options.ion_mask)
-
-blist = get_blist(mol, atids)
-all_list = get_all_list(mol, blist, atids, 8.0)
-alist = all_list.anglist
-dlist = all_list.dihlist
-
-#Get the metal ion ids
-metids = []       #Atom IDs
-mettyps = []      #Amber Atom Type
-mettypinds = []   #Atom Type Index
-for i in mask.Selected():
-    j = i + 1
-    metids.append(j)
-    atyp = prmtop.parm_data['AMBER_ATOM_TYPE'][i]
-    mettyps.append(atyp)
-    mettypind = prmtop.parm_data['ATOM_TYPE_INDEX'][i]
-    mettypinds.append(mettypind)
-
-smcids = [] #Metal site ligating atom IDs
-mcresids = []  #Metal Site Residue IDs
-atompairs = [] #Distance pair
-for i in metids:
-    crdi = mol.atoms[i].crd
-    atmi = mol.atoms[i].element
-    radiusi = CoRadiiDict[atmi]
-    for j in atids:
-        if j != i:
-            crdj = mol.atoms[j].crd
-            atmj = mol.atoms[j].element
-            dis = calc_bond(crdi, crdj)
-            radiusj = CoRadiiDict[atmj]
-            radiusij = radiusi + radiusj
-            if (dis <= radiusij + 0.4) and (dis >= 0.1) and (atmj != 'H'):
-                smcids.append(j)
-                atompairs.append((i, j))
-                if mol.atoms[j].resid not in mcresids:
-                    mcresids.append(mol.atoms[j].resid)
-
-for i in alist:
-    if len(i) != 3:
-        raise ValueError('More than 3 atoms in one angle! ' + i)
-    j = [k-1 for k in i]
-    atnums = [prmtop.parm_data['ATOMIC_NUMBER'][l] for l in j]
-    if (list(set(metids) & set(i)) != []) and (1 not in atnums):
-        atompairs.append(i)
-
-for i in dlist:
-    if len(i) != 4:
-        raise ValueError('More than 4 atoms in one dihedral! ' + i)
-    j = [k-1 for k in i]
-    atnums = [prmtop.parm_data['ATOMIC_NUMBER'][l] for l in j]
-    if (list(set(metids) & set(i)) != []) and (1 not in atnums):
-        atompairs.append(i)
-
-#Add metal ion IDs to the Metal Site Residue IDs
-mcresids2 = mcresids
-for i in metids:
-    mcresids2.append(mol.atoms[i].resid)
-mcresids2 = list(set(mcresids2))
-mcresids2.sort()
-
-print('Residues in the metal site: ', mcresids2)
-
-mcids = []  #Metal site atom IDs
-if options.model == 1: #Small model
-    mcids = smcids
-elif options.model == 2: #Big model
-    for i in mcresids:
-        for j in mol.residues[i].resconter:
-            if mol.atoms[j].element != 'H':
-                mcids.append(j)
-
-#Calculate the distances between metal ion and ligating atoms
-val_bf_min = []
-crds_bf_min = read_rstf(options.cfile)
-for i in atompairs:
-    if len(i) == 2:
-        crd1 = crds_bf_min[i[0]-1]
-        crd2 = crds_bf_min[i[1]-1]
-        bond = calc_bond(crd1, crd2)
-        val_bf_min.append(('bond', bond))
-    elif len(i) == 3:
-        crd1 = crds_bf_min[i[0]-1]
-        crd2 = crds_bf_min[i[1]-1]
-        crd3 = crds_bf_min[i[2]-1]
-        angle = calc_angle(crd1, crd2, crd3)
-        val_bf_min.append(('angle', angle))
-    elif len(i) == 4:
-        crd1 = crds_bf_min[i[0]-1]
-        crd2 = crds_bf_min[i[1]-1]
-        crd3 = crds_bf_min[i[2]-1]
-        crd4 = crds_bf_min[i[3]-1]
-        dih = calc_dih(crd1, crd2, crd3, crd4)
-        val_bf_min.append(('dih', dih))
-
-#print("Bond, angle and dihedral before minimization...")
-#print(val_bf_min)
-
-#-----------------------------------------------------------------------------#
-#Get the Amber mask of the metal center complex and print it into ptraj.in file
-#-----------------------------------------------------------------------------#
-
-#Print the parmed input file, add new LJ types to the bonded atoms
-maskns = []
-for i in smcids:
-    maskn = str(mol.atoms[i].resid) + '@' + mol.atoms[i].atname
-    maskns.append(maskn)
-
-w_parmedf = open('OptC4_parmed.in', 'w')
-print("add12_6_4 " + options.ion_mask, file=w_parmedf)
-print("outparm %s.c4" %options.pfile, file=w_parmedf)
-print("quit", file=w_parmedf)
-w_parmedf.close()
-
-os.system("parmed -O -i OptC4_parmed.in -p %s -c %s" %(options.pfile, options.cfile))
-
-#Get the new molecule
-prmtop, mol, atids, resids = read_amber_prm(options.pfile + '.c4', options.cfile)
-c4terms = prmtop.parm_data['LENNARD_JONES_CCOEF']
-
-mctyps = [] #Metal Site Atom Type
-mctypinds = [] #Metal Site Atom Type Index
-num = 0
-for j in mcids:
-    k = j - 1
-    #assign new Amber atom types
-    #prmtop.parm_data['AMBER_ATOM_TYPE'][k] = 'X' + str(num)
-    atyp = prmtop.parm_data['AMBER_ATOM_TYPE'][k]
-    mctyps.append(atyp)
-    mctypind = prmtop.parm_data['ATOM_TYPE_INDEX'][k]
-    mctypinds.append(mctypind)
-    num = num + 1
-
-#Get the atom type dictionary for people to see
-mettypdict = get_typ_dict(mettypinds, mettyps)
-mctypdict = get_typ_dict(mctypinds, mctyps)
-
-print('The following is the dictionary of the atom types: ')
-print(mettypdict)
-print(mctypdict)
-
-#Delete the repeat ATOM_TYPE_INDEX
-mettypinds = list(set(mettypinds))
-mettypinds.sort()
-mctypinds = list(set(mctypinds))
-mctypinds.sort()
-
-#Detect the C4 terms which relates to the metal center complex
-ntyps = prmtop.pointers['NTYPES']
-
-idxs = [] #Index of C4 terms which needs to modify
-iddict = {} #Dictionary of idx corresponding to ATOM_TYPE_INDEX pair
-for i in mettypinds:
-    j = i - 1
-    for k in mctypinds:
-        l = k - 1
-        if j < l:
-            idx = prmtop.parm_data['NONBONDED_PARM_INDEX'][ntyps*j+l] - 1
-        else:
-            idx = prmtop.parm_data['NONBONDED_PARM_INDEX'][ntyps*l+j] - 1
-        idxs.append(idx)
-        iddict[idx] = (i, k)
-
-idxs.sort()
-initparas = [c4terms[i] for i in idxs]
-
-print('Initial C4 parameters are : ', initparas)
+#The warm starts are minimized to the convergence (maxIterations=0 of
+#OpenMM), so that the structures do not depend on a step limit
+if options.warm:
+    if options.tol is None:
+        raise pymsmtError('The --warm option needs the minimization '
+                          'tolerance of --tol.')
+    if options.logf is not None:
+        raise pymsmtError('The --warm option can not be used with --log.')
+    options.maxsteps = 0
+
+#Get the metal site of each structure
+if options.ensf is not None:
+    structs = read_ensemble_file(options.ensf, options.rfile)
+else:
+    structs = [(options.pfile, options.cfile, 1.0, options.rfile)]
+
+sites = []
+for n, struct in enumerate(structs):
+    pfile, cfile, weight, rfile = struct
+    if len(structs) == 1:
+        c4pfile = os.path.join(options.workdir,
+                               os.path.basename(pfile) + '.c4')
+    else:
+        print('Structure %d: %s %s' %(n+1, pfile, cfile))
+        c4pfile = os.path.join(options.workdir, '%d_%s.c4'
+                               %(n+1, os.path.basename(pfile)))
+    mcresids2, idxs, c4keys, paras, geoids, val_bf_min = \
+        get_c4_site(pfile, cfile, c4pfile, options)
+    if n == 0:
+        initparas = paras
+        c4keys0 = c4keys
+    else:
+        #The C4 terms in the same order of the first structure
+        if set(c4keys) != set(c4keys0):
+            raise pymsmtError('The C4 terms of the metal site in structure '
+                              '%d (%s) are not the same as those of the first '
+                              'one, they are named by the atom types: %s and '
+                              '%s .' %(n+1, pfile, c4keys, c4keys0))
+        keydict = dict(zip(c4keys, idxs))
+        idxs = [keydict[i] for i in c4keys0]
+    sites.append((c4pfile, cfile, weight, rfile, mcresids2, idxs, geoids,
+                  val_bf_min))
+
+#Build the OpenMM system and context once, only the C4 terms are changed in
+#each optimization cycle. The contexts are minimized at the same time for the
+#gradient, the CPU threads are divided among them
+if options.minm == 'powell':
+    options.nproc = 1
+if len(sites) > 1:
+    #Each structure is minimized in a worker process
+    print('Optimizing the C4 terms against %d structures' %len(sites))
+    c4ens = C4Ensemble(sites, options)
+    if options.minm == 'powell':
+        fprime = None
+    else:
+        fprime = get_ens_grad
+elif options.nproc > 1:
+    print('Computing the gradients with %d parallel contexts' %options.nproc)
+    nthreads = max(1, multiprocessing.cpu_count() // options.nproc)
+    c4ctxs = [C4Context(c4pfile, cfile, mcresids2, options, nthreads)
+              for i in range(0, options.nproc)]
+    fprime = get_grad
+else:
+    c4ctxs = [C4Context(c4pfile, cfile, mcresids2, options)]
+    fprime = None
+
+#Cache of the evaluations, which is replayed from the log file
+fnames = []
+for struct in structs:
+    fnames = fnames + [struct[0], struct[1]]
+setkey = get_settings_key(fnames,
+                          [('mask', options.ion_mask), ('idxs', idxs),
+                           ('weights', [i[2] for i in structs]),
+                           ('maxsteps', options.maxsteps),
+                           ('phase', options.simupha),
+                           ('platform', options.platf),
+                           ('precision', options.presn),
+                           ('model', options.model),
+                           ('warm', options.warm), ('tol', options.tol),
+                           ('radius', options.radius)])
+c4cache = C4Cache(setkey, len(idxs), options.logf, warm=options.warm)
 
 #Doing optimization of the parameters, initial was the normal C4 term
+if len(sites) > 1:
+    func = get_ens_rmsd
+    rmsdargs = (c4ens, c4cache, options)
+else:
+    func = get_rmsd
+    rmsdargs = (c4ctxs, c4cache, idxs, geoids, val_bf_min, options)
 
 if options.minm == 'powell':
     from scipy.optimize import fmin_powell as fmin
-    xopt = fmin(get_rmsd, initparas)
+    xopt = fmin(func, initparas, args=rmsdargs)
 elif options.minm == 'cg':
     from scipy.optimize import fmin_cg as fmin
-    xopt = fmin(get_rmsd, initparas, epsilon=options.stepsize)
+    xopt = fmin(func, initparas, fprime=fprime, args=rmsdargs,
+                epsilon=options.stepsize)
 elif options.minm == 'bfgs':
     from scipy.optimize import fmin_bfgs as fmin
-    xopt = fmin(get_rmsd, initparas, epsilon=options.stepsize)
+    xopt = fmin(func, initparas, fprime=fprime, args=rmsdargs,
+                epsilon=options.stepsize)
 elif options.minm == 'slsqp':
     from scipy.optimize import fmin_slsqp as fmin
-    xopt = fmin(get_rmsd, initparas, epsilon=options.stepsize)
+    xopt = fmin(func, initparas, fprime=fprime, args=rmsdargs,
+                epsilon=options.stepsize)
 
 print("Final parameters...")
 print(xopt)
 
+#Write the restart file of the final parameters
+xopt = numpy.atleast_1d(xopt)
+if len(sites) > 1:
+    c4ens.write_rst(xopt)
+    c4ens.close()
+    for struct in structs:
+        print('The structure minimized with the final parameters is written '
+              'into %s' %struct[3])
+else:
+    c4ctxs[0].set_c4(idxs, xopt)
+    crds = None
+    if options.warm:
+        crds = get_warm_start(xopt, c4ctxs[0], idxs, c4cache.get_start(xopt),
+                              options)
+    c4ctxs[0].minimize(options.maxsteps, options.tol, crds)
+    c4ctxs[0].write_rst()
+    print('The structure minimized with the final parameters is written '
+          'into %s' %options.rfile)
+print('%d evaluations were taken from the cache.' %c4cache.nhit)
+
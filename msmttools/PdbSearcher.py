@@ -9,13 +9,11 @@ information and generate the metal center complex pdb files for each center
 (with metal ion and ligating residues).
 """
 from __future__ import print_function
-from msmtmol.readpdb import get_atominfo_fpdb, writepdbatm
-from msmtmol.element import METAL_PDB, CoRadiiDict, resdict
-from msmtmol.mol import pdbatm
-from msmtmol.cal import calc_bond, det_geo
+from msmtmol.pdbsearch import search_pdb_files
+from msmtmol.element import METAL_PDB
 from optparse import OptionParser
 from title import print_title
-import os
+from pymsmtexp import *
 
 #==============================================================================
 # Setting the options
@@ -27,10 +25,19 @@ parser = OptionParser("Usage: PdbSearcher.py -i/--ion ionname "
                       "-s/--sum summary_file \n"
                       "                      [-c/--cut cutoff]")
 parser.add_option("-i", "--ion", type='string', dest="ionname",
-                  help="Element symbol of ion, e.g. Zn")
+                  help="Element symbol of ion, e.g. Zn. More than one ion "
+                       "can be separated by comma, e.g. Zn,Fe,Cu, or all for "
+                       "all the metal ions known in the PDB residue names, "
+                       "they are found in one read of each PDB file and the "
+                       "ion element is a column of the summary and "
+                       "environment files.")
 parser.add_option("-l", "--list", type='string', dest="inputf",
                   help="List file name, list file contains one PDB file name "
-                       "per line")
+                       "per line (an mmCIF file ending with .cif can also be "
+                       "used, whose residues are numbered from 1). A line "
+                       "can also be a tar or zip archive of PDB files (.pdb, "
+                       ".ent, .pdb.gz or .ent.gz), which is read without "
+                       "extracting it.")
 parser.add_option("-e", "--env", type='string', dest='envrmtf',
                   help="Environment file name. An environment file is used to "
                        "store the metal center environment information such "
@@ -50,6 +57,40 @@ parser.add_option("-c", "--cut", type='float', dest='cutoff',
                        "0.1 (smaller than 0.1 usually indicates a low quality "
                        "structure) and no bigger than the covalent radius sum "
                        "of the two atoms with a tolerance of 0.4.")
+parser.add_option("-n", "--nproc", type='int', dest='nproc', default=1,
+                  help="Optional. Number of the processes used to process "
+                       "the PDB files. The output files are the same for "
+                       "any number of processes. Default is 1.")
+parser.add_option("--chunk", type='int', dest='chunksize', default=8,
+                  help="Optional. Number of the PDB files sent to a process "
+                       "at a time when more than one process is used. "
+                       "Default is 8.")
+parser.add_option("--tar", type='string', dest='tarfname',
+                  help="Optional. Pack the metal center PDB files into this "
+                       "tar archive instead of writing them one by one, the "
+                       "archive is gzipped if the name ends with gz, e.g. "
+                       "MetalCenters.tar.gz. It can not be used with "
+                       "--manifest.")
+parser.add_option("--db", type='string', dest='dbfname',
+                  help="Optional. Also save the structures, metal centers and "
+                       "bonds into this SQLite database, which is indexed on "
+                       "the ion element, geometry, coordination sphere and "
+                       "resolution. The records of a PDB file already in the "
+                       "database are replaced.")
+parser.add_option("--manifest", type='string', dest='mftfname',
+                  help="Optional. Manifest file of the processed PDB files. "
+                       "Only the files which are new or modified since the "
+                       "last run with this manifest are processed, the "
+                       "outputs of the files which are not in the list any "
+                       "more are removed, and an interrupted run continues "
+                       "from the last checkpoint.")
+parser.add_option("--models", type='string', dest='modelf',
+                  help="Optional. Model file name. The metal sites in each "
+                       "model of the PDB files (e.g. NMR ensembles or MD "
+                       "snapshots) are written into this file, with the "
+                       "geometry in each model. The other output files are "
+                       "of the first model. It can not be used with "
+                       "--manifest.")
 (options, args) = parser.parse_args()
 
 #==============================================================================
@@ -68,194 +109,59 @@ pdbfnl = []
 fp = open(options.inputf, 'r')
 for line in fp:
     line = line.strip('\n').strip()
-    pdbfnl.append(line)
+    if line:
+        pdbfnl.append(line)
 fp.close()
 
 #==============================================================================
 # Print the title of each file
 #==============================================================================
 
-ionname = options.ionname
+metalels = []
+for i in METAL_PDB:
+    if METAL_PDB[i][0] not in metalels:
+        metalels.append(METAL_PDB[i][0])
 
-#Transfer the metal ion name
-if len(ionname) == 2:
-    ionname = ionname[0] + ionname[1:].lower()
-
-print("The ionname you chosen is : " + ionname)
+if options.ionname.strip().lower() == 'all':
+    ionnames = metalels
+else:
+    ionnames = []
+    for ionname in options.ionname.split(','):
+        ionname = ionname.strip()
+        if not ionname:
+            continue
+        #Transfer the metal ion name
+        if len(ionname) == 2:
+            ionname = ionname[0].upper() + ionname[1:].lower()
+        if ionname not in metalels:
+            raise pymsmtError('%s is not a metal ion element in the PDB '
+                              'residue names.' %ionname)
+        if ionname not in ionnames:
+            ionnames.append(ionname)
+
+print("The ionname you chosen is : " + ','.join(ionnames))
 
 if options.cutoff != None:
     print("The cutoff is: " + str(options.cutoff) + ' Angstrom.')
 else:
     print("Using the default method to determine the bond exists.")
 
-#summary file
-sf = open(options.sumf, 'w')
-print('PDB_ID,', 'EXP_TECH,', 'RESOLUTION,', 'ATOM_NUMBER,', \
-             'ION_NUMBER,', 'RES_ID,', 'RES_NAME,', 'ATOM_ID,', 'ATOM_NAME,', \
-             'COORD_SPHERE,', 'GEOMETRY,','GEO_RMS', file=sf)
-
-#environment file
-ef = open(options.envrmtf, 'w')
-print('PDB,', 'ION_RESID,', 'ION_RESNAME,', 'ION_ATOM_ID,', \
-             'ION_ATOM_NAME,', 'RESID,', 'RESNAME,', 'ATOM_ID,', 'ATOM_NAME,',\
-             'DISTANCE,', 'GEOMETRY,', 'GEO_RMS,', 'COORDINATE_SPHERE,', \
-             'EXP_TECH,', 'RESOLUTION', file=ef)
+if options.nproc < 1:
+    raise pymsmtError('The process number should be a positive integer.')
+if options.chunksize < 1:
+    raise pymsmtError('The chunk size should be a positive integer.')
+if (options.modelf is not None) and (options.mftfname is not None):
+    raise pymsmtError('The --models option can not be used with the '
+                      '--manifest option.')
+if (options.tarfname is not None) and (options.mftfname is not None):
+    raise pymsmtError('The --tar option can not be used with the '
+                      '--manifest option.')
 
 #==============================================================================
 # Do analysis for each pdb file
 #==============================================================================
 
-for fname in pdbfnl:
-    print("***Performing the " + fname + " file")
-
-    #get the metal list
-    mol, atids, resids = get_atominfo_fpdb(fname)
-
-    #Get the resolution and method
-    fp1 = open(fname, 'r')
-    for line in fp1:
-        if 'RESOLUTION.' in line:
-            line = line.split()
-            try:
-                reso = float(line[-1])
-            except:
-                try:
-                    reso = float(line[-2])
-                except:
-                    reso = 'UNKNOWN'
-        elif 'EXPERIMENT TYPE' in line:
-            line = line.split()
-            exptyp = line[-1]
-            if line[-1] == 'DIFFRACTION' and line[-2] == 'X-RAY':
-                exptyp = 'X-RAY'
-    fp1.close()
-
-    #Get the metal ion which is the ion user want to process
-    metallist = []
-    for i in atids:
-        resname = mol.residues[mol.atoms[i].resid].resname
-        atname = mol.atoms[i].atname
-        if (resname, atname) in list(METAL_PDB.keys()):
-            if METAL_PDB[(resname, atname)][0] == ionname:
-                metallist.append(i)
-
-    #for each metal ion in the metal list, print the metal center
-    for i in metallist:
-
-        mccrds = [] #The crds of metal site
-        crdi = mol.atoms[i].crd
-        elmti = mol.atoms[i].element
-        residi = mol.atoms[i].resid
-        atnamei = mol.atoms[i].atname
-        resnamei = mol.residues[residi].resname
-        radiusi = CoRadiiDict[elmti]
-        mcresids = [] #MetalCenter residue IDs
-
-        #Get the residues which is the metal site
-        for j in atids:
-            if j != i:
-                atnamej = mol.atoms[j].atname
-                crdj = mol.atoms[j].crd
-                residj = mol.atoms[j].resid
-                resnamej = mol.residues[residj].resname
-                elmtj = mol.atoms[j].element
-                radiusj = CoRadiiDict[elmtj]
-                radiusij = radiusi + radiusj + 0.40
-                disij = calc_bond(crdi, crdj)
-
-                if options.cutoff == None:
-                    if (disij >= 0.1) and (disij <= radiusij) \
-                       and (elmtj != 'H'):
-                        mccrds.append(crdi)
-                        mccrds.append(crdj)
-                        if (residj not in mcresids):
-                            mcresids.append(residj)
-                else:
-                    if (disij >= 0.1) and (disij <= options.cutoff) \
-                       and (elmtj != 'H'):
-                        mccrds.append(crdi)
-                        mccrds.append(crdj)
-                        if (residj not in mcresids):
-                            mcresids.append(residj)
-
-        #Getting the ligating reidue letters
-        reslets = ''
-        for j in mcresids:
-            resname = mol.residues[j].resname
-            if resname in list(resdict.keys()):
-                reslet = resdict[resname]
-            else:
-                reslet = 'X'
-            reslets = reslets + reslet
-        nospace = ''
-        reslets = nospace.join(sorted(reslets))
-        print('   Find metal center', reslets)
-
-        #Get the geometry and geometry rms
-        geo, georms = det_geo(mccrds)
-
-        #add the metal ions into the mcresids
-        if mol.atoms[i].resid not in mcresids:
-            mcresids.append(mol.atoms[i].resid)
-
-        mcpdbfn = fname.strip('.pdb') + '_res_' + str(i) + '_MetalCenter.pdb'
-        if os.path.isfile(mcpdbfn):
-            print("Overwritting the metal center pdb file: " + mcpdbfn)
-            os.system("rm %s" %mcpdbfn)
-
-        #print the residue which is in the cut off into the pdb file
-        for j in mcresids:
-            for k in mol.residues[j].resconter:
-                tiker = mol.atoms[k].gtype
-                atid = mol.atoms[k].atid
-                atname = mol.atoms[k].atname
-                resname = mol.atoms[k].resname
-                chainid = 'A'
-                resid = mol.atoms[k].resid
-                crdx = round(mol.atoms[k].crd[0], 3)
-                crdy = round(mol.atoms[k].crd[1], 3)
-                crdz = round(mol.atoms[k].crd[2], 3)
-                occp = 1.00
-                tempfac = 0.00
-                atmj = pdbatm(tiker, atid, atname, resname, chainid, resid,
-                              crdx, crdy, crdz, occp, tempfac)
-                writepdbatm(atmj, mcpdbfn)
-
-        #Print the environment
-        for j in atids:
-            atnamej = mol.atoms[j].atname
-            crdj = mol.atoms[j].crd
-            residj = mol.atoms[j].resid
-            resnamej = mol.residues[residj].resname
-            elmtj = mol.atoms[j].element
-            radiusj = CoRadiiDict[elmtj]
-            radiusij = radiusi + radiusj + 0.40
-            disij = calc_bond(crdi, crdj)
-
-            if options.cutoff == None:
-                if (disij >= 0.1) and (disij <= radiusij) \
-                   and (elmtj != 'H'):
-                    #print the environment file, for each bond in the metal site
-                    print(fname.strip('.pdb'),',', residi,',', resnamei, \
-                             ',', i, ',', atnamei,',', residj,',', resnamej,\
-                             ',', j,',', atnamej, ',', round(disij, 3),',', geo,\
-                             ',', round(georms, 3),',', reslets,',', exptyp,\
-                             ',', reso, file=ef)
-            else:
-                if (disij >= 0.1) and (disij <= options.cutoff) \
-                   and (elmtj != 'H'):
-                    #print the environment file, for each bond in the metal site
-                    print(fname.strip('.pdb'),',', residi,',', resnamei, \
-                             ',', i, ',', atnamei,',', residj,',', resnamej,\
-                             ',', j,',', atnamej, ',', round(disij, 3),',', geo,\
-                             ',', round(georms, 3),',', reslets,',', exptyp,\
-                             ',', reso, file=ef)
-
-        #print the summary file, for each metal site
-        print(fname.strip('.pdb'),',', exptyp,',', reso, \
-                 ',', len(atids), ',', len(metallist),',', residi,\
-                 ',', resnamei,',', i,',', atnamei,',', reslets,',', geo,\
-                 ',', round(georms, 3), file=sf)
-
-sf.close()
-ef.close()
+search_pdb_files(pdbfnl, ionnames, options.sumf, options.envrmtf,
+                 options.cutoff, options.nproc, options.chunksize,
+                 tarfname=options.tarfname, dbfname=options.dbfname,
+                 mftfname=options.mftfname, modelf=options.modelf)
@@ -11,7 +11,8 @@ modules = ['pymsmtexp', 'title']
 
 # Scripts
 scripts = ['msmttools/MCPB.py', 'msmttools/OptC4.py', 'msmttools/PdbSearcher.py',
-           'msmttools/espgen.py', 'msmttools/CartHess2FC.py', 'msmttools/IPMach.py']
+           'msmttools/espgen.py', 'msmttools/CartHess2FC.py', 'msmttools/IPMach.py',
+           'msmttools/MCPBBatch.py', 'msmttools/MCPBWorker.py']
 
 if __name__ == '__main__':
 
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Write and read back the restart files of 1, 2 and 3 atoms, with and without
+the velocities and box, in the ASCII and NetCDF formats.
+"""
+from __future__ import print_function
+from msmtmol.rstfile import write_rst, read_rst
+import numpy
+import os
+import warnings
+
+def get_status(val, ref):
+    if ref is None:
+        return 'none' if val is None else 'WRONG'
+    if val is None or numpy.shape(val) != numpy.shape(ref):
+        return 'WRONG'
+    return 'ok' if numpy.allclose(val, ref, atol=1.0e-6) else 'WRONG'
+
+warnings.simplefilter('ignore')
+box = numpy.array([30.0, 31.0, 32.0, 90.0, 91.0, 92.0])
+for atnum in [1, 2, 3]:
+    crds = numpy.arange(3 * atnum, dtype=float).reshape(atnum, 3) * 1.5
+    vels = numpy.arange(3 * atnum, dtype=float).reshape(atnum, 3) * 0.1
+    for ivel in [None, vels]:
+        for ibox in [None, box]:
+            for ext in ['rst7', 'ncrst']:
+                fname = 'check.' + ext
+                write_rst(fname, crds, ivel, ibox)
+                #The velocities of 2 atoms are only told from a box by
+                #the hint
+                hasvel = None
+                if atnum == 2 and ext == 'rst7':
+                    hasvel = (ivel is not None)
+                rcrds, rvels, rbox = read_rst(fname, hasvel)
+                os.remove(fname)
+                print('%d atoms, vels %-3s, box %-3s, %-5s: crds %s, vels %s, '
+                      'box %s' %(atnum, 'yes' if ivel is not None else 'no',
+                      'yes' if ibox is not None else 'no', ext,
+                      get_status(rcrds, crds), get_status(rvels, ivel),
+                      get_status(rbox, ibox)))
+
+#Without the hint, the line after the coordinates of 2 atoms is the box
+write_rst('check.rst7', numpy.ones((2, 3)), None, box)
+with warnings.catch_warnings(record=True) as warns:
+    warnings.simplefilter('always')
+    rcrds, rvels, rbox = read_rst('check.rst7')
+os.remove('check.rst7')
+print('2 atoms, no hint: vels %s, box %s, %d warning' %(get_status(rvels,
+      None), get_status(rbox, box), len(warns)))